@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+""" Процесс канала станции.
+
+Конвеер приёма одного гостя (StationChannelPipeline) в отдельном
+процессе: свой GIL и свой цикл GLib, поэтому каналы работают на разных
+ядрах, а зависание или падение одного канала не задевает остальные.
+Процесс подключается к супервизору по локальному сокету, выполняет его
+команды и раз в STATE_INTERVAL присылает состояние канала.
+
+Команды супервизора:
+    start {gputype, srtlatency}, stop, restart_sources {reason}
+    set_consumer {kind, enabled}, set_recording {directory, segment, fmt}
+
+Сообщения процесса:
+    worker_hello {ch, pid} - первое сообщение
+    alive, lost {reason}, keyframe_needed {reason} - колбэки конвеера
+    state {running, liveness, recording, srt, level, cpu, glib_lag, metrics}
+
+Закрытие управляющего соединения останавливает конвеер и завершает
+процесс. Запускается супервизором:
+
+    python3 -m scicall.channel_worker --channel 0 --supervisor /tmp/scicall-.../supervisor.sock
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from scicall.codec_registry import CodecRegistry, cache_path
+from scicall.control_plane import ControlClient
+from scicall.instrumentation import Instrumentation
+from scicall.liveness import DEFAULT_TIMEOUT
+from scicall.pipeline_utils import GPUType
+from scicall.station_pipeline import StationChannelPipeline
+
+STATE_INTERVAL = 1
+
+# Кадрирование не зависит от --control-codec станции.
+WORKER_CODEC = "line"
+
+
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+class ChannelWorker:
+    def __init__(self, channelno, liveness_timeout=DEFAULT_TIMEOUT):
+        self.stream = StationChannelPipeline(channelno, liveness_timeout)
+        self.stream.on_alive = lambda: self.emit("alive")
+        self.stream.on_lost = lambda reason: self.emit("lost", reason=reason)
+        self.stream.on_keyframe_needed = lambda reason: self.emit("keyframe_needed", reason=reason)
+        self.loop = None
+        self.session = None
+        self.glib_beat = time.monotonic()
+
+    def emit(self, cmd, **kwargs):
+        """ Вызывается из потоков gstreamer. """
+        dct = {"cmd": cmd}
+        dct.update(kwargs)
+        self.loop.call_soon_threadsafe(self.send, dct)
+
+    def send(self, dct):
+        if self.session is not None:
+            self.session.send(dct)
+
+    def glib_heartbeat(self):
+        """ Отметка цикла GLib: по её возрасту супервизор видит зависание
+            доставки сообщений шины, даже если цикл asyncio жив. """
+        self.glib_beat = time.monotonic()
+        return True
+
+    def on_start(self, data):
+        if self.stream.is_running():
+            self.stream.stop()
+        self.stream.start(gputype=GPUType[data["gputype"]], srtlatency=data["srtlatency"])
+
+    def on_set_recording(self, data):
+        self.stream.set_recording(data.get("directory"), data.get("segment"), data.get("fmt"))
+
+    def state(self):
+        instrumentation = Instrumentation.instance()
+        return {
+            "cmd": "state",
+            "running": self.stream.is_running(),
+            "liveness": self.stream.liveness_state(),
+            "recording": self.stream.is_recording(),
+            "srt": self.stream.srt_stats(),
+            "level": self.stream.audio_level(),
+            "cpu": cpu_seconds(),
+            "glib_lag": time.monotonic() - self.glib_beat,
+            "metrics": instrumentation.snapshot()["pipelines"] if instrumentation.enabled else None,
+        }
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(STATE_INTERVAL)
+            self.send(self.state())
+
+    async def run(self, path):
+        self.loop = asyncio.get_event_loop()
+        closed = asyncio.Event()
+        session = await ControlClient.connect_unix(path,
+            on_close=lambda session: closed.set(), codec=WORKER_CODEC)
+        session.on("start", self.on_start)
+        session.on("stop", lambda data: self.stream.stop())
+        session.on("restart_sources", lambda data: self.stream.restart_sources(data.get("reason")))
+        session.on("set_consumer", lambda data: self.stream.set_consumer(data["kind"], data["enabled"]))
+        session.on("set_recording", self.on_set_recording)
+        session.start_keepalive()
+        self.session = session
+        session.command("worker_hello", ch=self.stream.channelno, pid=os.getpid())
+
+        GLib.timeout_add(STATE_INTERVAL * 1000, self.glib_heartbeat)
+        reporter = asyncio.ensure_future(self.report())
+        await closed.wait()
+        reporter.cancel()
+        self.session = None
+        self.stream.stop()
+
+
+def main(args):
+    # Прерывание с терминала получает вся группа процессов, останавливает
+    # каналы супервизор.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Gst.init(sys.argv[:1])
+    Instrumentation.instance().enabled = args.metrics
+    CodecRegistry.instance().use_cache(args.codec_cache)
+    mainloop = GLib.MainLoop()
+    threading.Thread(target=mainloop.run, daemon=True).start()
+    worker = ChannelWorker(args.channel, args.liveness_timeout)
+    try:
+        asyncio.run(worker.run(args.supervisor))
+    finally:
+        mainloop.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channel", type=int, required=True)
+    parser.add_argument("--supervisor", required=True,
+        help="локальный сокет супервизора")
+    parser.add_argument("--liveness-timeout", type=int, default=DEFAULT_TIMEOUT)
+    parser.add_argument("--metrics", action="store_true",
+        help="присылать снимки метрик конвеера")
+    parser.add_argument("--codec-cache", default=cache_path(),
+        help="кэш реестра кодеров главного процесса")
+    sys.exit(main(parser.parse_args()))
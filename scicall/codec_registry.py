@@ -0,0 +1,294 @@
+""" Реестр кодеров и декодеров H.264 машины.
+
+Раньше аппаратный кодер проверялся пробным запуском nvh264enc при каждой
+сборке конвеера, а в автоматическом режиме кодер и декодер не выбирались
+вовсе. Реестр один раз в фоне проверяет все известные кодеры и декодеры
+(nvidia, va/vaapi, v4l2m2m, openh264, x264, libav): есть ли элемент,
+проходит ли через него короткий поток и с какой скоростью. В
+автоматическом режиме берётся самый быстрый из работающих.
+
+Результат сохраняется в кэш (~/.cache/scicall/codecs.json) с ключом из
+версии gstreamer и набора плагинов и при следующем запуске не
+перепроверяется, пока они не изменятся (или до --reprobe-codecs).
+Если работает только программный кодер, выбирается он, а в отчёте
+указано, почему не подошли остальные. Пока проверка не закончилась,
+выбор не ждёт её и берёт программный вариант.
+
+Процессы каналов сами ничего не проверяют (иначе они одновременно
+занимали бы сессии аппаратных кодеров): они только читают кэш,
+записанный главным процессом (use_cache).
+
+    python3 -m scicall.codec_registry
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from gi.repository import Gst
+
+PROBE_FRAMES = 120
+PROBE_TIMEOUT = 10
+PROBE_CAPS = "video/x-raw,width=640,height=480,framerate=30/1"
+
+FALLBACK = {
+    "encoder": "x264enc tune=zerolatency",
+    "decoder": "avdec_h264",
+}
+
+
+class CodecCandidate:
+    def __init__(self, description, family, hardware):
+        self.description = description
+        self.family = family
+        self.hardware = hardware
+
+    def factory(self):
+        return self.description.split()[0]
+
+
+CANDIDATES = {
+    "encoder": [
+        CodecCandidate("nvh264enc", "nvidia", True),
+        CodecCandidate("vah264enc", "va", True),
+        CodecCandidate("vaapih264enc", "vaapi", True),
+        CodecCandidate("v4l2h264enc", "v4l2m2m", True),
+        CodecCandidate("openh264enc", "openh264", False),
+        CodecCandidate("x264enc tune=zerolatency", "x264", False),
+    ],
+    "decoder": [
+        CodecCandidate("nvh264dec", "nvidia", True),
+        CodecCandidate("vah264dec", "va", True),
+        CodecCandidate("vaapih264dec", "vaapi", True),
+        CodecCandidate("v4l2h264dec", "v4l2m2m", True),
+        CodecCandidate("openh264dec", "openh264", False),
+        CodecCandidate("avdec_h264", "libav", False),
+    ],
+}
+
+
+def cache_path():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "scicall", "codecs.json")
+
+
+def registry_key():
+    """ Версия gstreamer и набор плагинов: при их смене кэш устаревает. """
+    plugins = sorted(f"{p.get_name()}:{p.get_version()}"
+        for p in Gst.Registry.get().get_plugin_list())
+    text = Gst.version_string() + "\n" + "\n".join(plugins)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def run_probe(description, timeout=PROBE_TIMEOUT):
+    """ Прогоняет конвеер до конца потока. Возвращает (время в секундах, None)
+        или (None, причина отказа). """
+    try:
+        pipeline = Gst.parse_launch(description)
+    except Exception as ex:
+        return None, str(ex)
+    start = time.monotonic()
+    try:
+        if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            return None, "can not start"
+        msg = pipeline.get_bus().timed_pop_filtered(timeout * Gst.SECOND,
+            Gst.MessageType.ERROR | Gst.MessageType.EOS)
+        if msg is None:
+            return None, "timeout"
+        if msg.type == Gst.MessageType.ERROR:
+            return None, msg.parse_error()[0].message
+        return time.monotonic() - start, None
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def probe_candidate(candidate, source, sink):
+    result = {
+        "description": candidate.description,
+        "family": candidate.family,
+        "hardware": candidate.hardware,
+        "ok": False,
+        "fps": None,
+        "reason": None,
+    }
+    if Gst.ElementFactory.find(candidate.factory()) is None:
+        result["reason"] = "plugin is not installed"
+        return result
+    if source is None:
+        result["reason"] = "no sample stream to decode"
+        return result
+    elapsed, reason = run_probe(f"{source} ! {candidate.description} ! {sink}")
+    if elapsed is None:
+        result["reason"] = reason
+        return result
+    result["ok"] = True
+    result["fps"] = round(PROBE_FRAMES / max(elapsed, 1e-6), 1)
+    return result
+
+
+class CodecRegistry:
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if CodecRegistry._instance is None:
+            CodecRegistry._instance = CodecRegistry()
+        return CodecRegistry._instance
+
+    def __init__(self, path=None):
+        self.path = path or cache_path()
+        self.mtx = threading.Lock()
+        self.ready = threading.Event()
+        self.thread = None
+        self.results = {}
+        self.cached = False
+        self.probing = True
+        self.key = None
+
+    def start(self, reprobe=False):
+        """ Проверка в фоне, вызывается после Gst.init. """
+        with self.mtx:
+            if self.thread is not None or not self.probing:
+                return
+            self.thread = threading.Thread(target=self.probe, args=(reprobe,), daemon=True)
+            self.thread.start()
+
+    def use_cache(self, path):
+        """ Только кэш главного процесса @path, без собственной проверки. """
+        self.path = path
+        self.probing = False
+        self.load_cached()
+
+    def load_cached(self):
+        if self.key is None:
+            self.key = registry_key()
+        results = self.load(self.key)
+        if results is not None:
+            self.results = results
+            self.cached = True
+            self.ready.set()
+
+    def is_ready(self):
+        """ Не блокирует: запускает проверку (или перечитывает кэш) и
+            сообщает, есть ли уже результат. """
+        if not self.ready.is_set():
+            if self.probing:
+                self.start()
+            else:
+                self.load_cached()
+        return self.ready.is_set()
+
+    def load(self, key):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != key:
+            return None
+        return data.get("results")
+
+    def save(self, key, results):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({ "key": key, "gstreamer": Gst.version_string(), "results": results }, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as ex:
+            print("CODECS: can not save cache:", ex)
+
+    def probe(self, reprobe=False):
+        try:
+            key = registry_key()
+            results = None if reprobe else self.load(key)
+            self.cached = results is not None
+            if results is None:
+                results = self.probe_all()
+                self.save(key, results)
+            self.results = results
+            self.print_report()
+        except Exception as ex:
+            print("CODECS: probe failed:", ex)
+        finally:
+            self.ready.set()
+
+    def probe_all(self):
+        source = f"videotestsrc num-buffers={PROBE_FRAMES} pattern=ball ! {PROBE_CAPS} ! videoconvert"
+        sink = "h264parse ! fakesink sync=false"
+        encoders = [ probe_candidate(c, source, sink) for c in CANDIDATES["encoder"] ]
+
+        # Образец для декодеров кодируется первым работающим кодером.
+        fd, sample = tempfile.mkstemp(suffix=".h264")
+        os.close(fd)
+        try:
+            source = None
+            for result in sorted(encoders, key=lambda r: r["hardware"]):
+                if not result["ok"]:
+                    continue
+                elapsed, _ = run_probe(
+                    f"videotestsrc num-buffers={PROBE_FRAMES} pattern=ball ! {PROBE_CAPS} ! videoconvert ! "
+                    f"{result['description']} ! h264parse ! video/x-h264,stream-format=byte-stream ! "
+                    f"filesink location={sample}")
+                if elapsed is not None:
+                    source = f"filesrc location={sample} ! h264parse"
+                    break
+            decoders = [ probe_candidate(c, source, "fakesink sync=false")
+                for c in CANDIDATES["decoder"] ]
+        finally:
+            os.unlink(sample)
+        return { "encoder": encoders, "decoder": decoders }
+
+    def working(self, kind):
+        return sorted((r for r in self.results.get(kind, []) if r["ok"]),
+            key=lambda r: r["fps"], reverse=True)
+
+    def best(self, kind):
+        """ Описание самого быстрого работающего элемента @kind ("encoder",
+            "decoder"); если проверка не закончилась или ничего не работает -
+            программный вариант. """
+        if not self.is_ready():
+            print("CODECS: probe is not finished, using", FALLBACK[kind])
+            return FALLBACK[kind]
+        working = self.working(kind)
+        return working[0]["description"] if working else FALLBACK[kind]
+
+    def encoder(self):
+        return self.best("encoder")
+
+    def decoder(self):
+        return self.best("decoder")
+
+    def best_family(self, kind):
+        if not self.is_ready():
+            return None
+        working = self.working(kind)
+        return working[0]["family"] if working else None
+
+    def print_report(self):
+        print("CODECS:", "cached" if self.cached else "probed", Gst.version_string())
+        for kind in ("encoder", "decoder"):
+            for r in self.results.get(kind, []):
+                if r["ok"]:
+                    print("CODECS: %s %s: %.0f fps" % (kind, r["description"], r["fps"]))
+                else:
+                    print("CODECS: %s %s: %s" % (kind, r["description"], r["reason"]))
+            working = self.working(kind)
+            if working:
+                print("CODECS: %s selected: %s" % (kind, working[0]["description"]))
+            else:
+                print("CODECS: %s: nothing works, fallback to %s" % (kind, FALLBACK[kind]))
+
+
+def main(reprobe):
+    Gst.init(sys.argv[:1])
+    CodecRegistry().probe(reprobe)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(reprobe="--cached" not in sys.argv))
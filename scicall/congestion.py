@@ -0,0 +1,189 @@
+""" Подстройка битрейта кодера гостя под канал.
+
+Гость на плохом канале отдаёт больше, чем пропускает канал: буфер srtsink
+растёт, пакеты опаздывают и выбрасываются, картинка на станции замирает.
+Контроллер раз в секунду читает статистику отправителя srt и управляет
+битрейтом кодера по схеме AIMD: при признаках перегрузки битрейт
+умножается на коэффициент, при чистом канале растёт на постоянный шаг.
+
+Признаки перегрузки:
+    - доля потерянных пакетов за опрос выше порога
+    - srt выбросил пакеты, не успевшие к сроку
+    - rtt вырос относительно наименьшего наблюдавшегося (очередь в сети)
+    - оценка полосы srt ниже текущего битрейта
+
+Если битрейт упирается в нижнюю границу ступени, можно понизить
+разрешение и частоту кадров (caps перед кодером). Разрешение меняется
+редко и с гистерезисом, так как кодер при этом пересоздаёт поток.
+"""
+
+import time
+
+from scicall.pipeline_builder import cached_caps
+from scicall.srt_stats import read_stats
+
+BITRATE_POLL_INTERVAL = 1
+
+# Множитель битрейта кодеров, у которых свойство bitrate не в кбит/с.
+BITRATE_SCALE = {
+    "openh264enc": 1000,
+}
+
+
+class VideoTier:
+    def __init__(self, width, height, fps, min_kbps):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.min_kbps = min_kbps
+
+    def caps(self):
+        return f"video/x-raw,width={self.width},height={self.height},framerate={self.fps}/1"
+
+    def __repr__(self):
+        return f"{self.width}x{self.height}@{self.fps}"
+
+
+TIERS = [
+    VideoTier(640, 480, 30, 700),
+    VideoTier(480, 360, 25, 350),
+    VideoTier(320, 240, 15, 0),
+]
+
+
+class AimdBitrate:
+    """ Битрейт по статистике отправителя, без привязки к gstreamer.
+
+        update(stats) возвращает новый битрейт в кбит/с или None.
+    """
+
+    def __init__(self, start=1500, minimum=200, maximum=2500, step=100,
+            decrease=0.7, loss_threshold=0.02, rtt_factor=2, rtt_margin=30,
+            clean_polls=3):
+        self.bitrate = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.decrease = decrease
+        self.loss_threshold = loss_threshold
+        self.rtt_factor = rtt_factor
+        self.rtt_margin = rtt_margin
+        self.clean_polls = clean_polls
+        self.clean = 0
+        self.base_rtt = None
+        self.last = None
+        self.reason = None
+
+    def congestion(self, stats):
+        """ Причина перегрузки или None. """
+        last, self.last = self.last, stats
+        rtt = stats.get("rtt_ms")
+        if rtt is not None and rtt > 0:
+            self.base_rtt = rtt if self.base_rtt is None else min(self.base_rtt, rtt)
+        if last is None:
+            return None
+
+        sent = stats["packets"] - last["packets"]
+        lost = stats["lost"] - last["lost"]
+        if sent > 0 and lost / sent > self.loss_threshold:
+            return "loss"
+        if stats["dropped"] > last["dropped"]:
+            return "drop"
+        if rtt is not None and self.base_rtt and \
+                rtt > self.base_rtt * self.rtt_factor + self.rtt_margin:
+            return "rtt"
+        bandwidth = stats.get("bandwidth_mbps")
+        if bandwidth and bandwidth * 1000 < self.bitrate:
+            return "bandwidth"
+        return None
+
+    def update(self, stats):
+        if not stats:
+            return None
+        self.reason = self.congestion(stats)
+        if self.reason:
+            self.clean = 0
+            new = max(self.minimum, int(self.bitrate * self.decrease))
+        else:
+            self.clean += 1
+            if self.clean < self.clean_polls:
+                return None
+            new = min(self.maximum, self.bitrate + self.step)
+        if new == self.bitrate:
+            return None
+        self.bitrate = new
+        return new
+
+
+class TierSelector:
+    """ Ступень разрешения по битрейту с гистерезисом и паузой. """
+
+    def __init__(self, tiers=TIERS, hysteresis=1.3, cooldown=10):
+        self.tiers = tiers
+        self.index = 0
+        self.hysteresis = hysteresis
+        self.cooldown = cooldown
+        self.changed_at = 0
+
+    def tier(self):
+        return self.tiers[self.index]
+
+    def update(self, bitrate, now=None):
+        """ Возвращает новую ступень или None. """
+        now = time.monotonic() if now is None else now
+        if now - self.changed_at < self.cooldown:
+            return None
+        index = self.index
+        if bitrate < self.tiers[index].min_kbps and index + 1 < len(self.tiers):
+            index += 1
+        elif index > 0 and bitrate >= self.tiers[index - 1].min_kbps * self.hysteresis:
+            index -= 1
+        if index == self.index:
+            return None
+        self.index = index
+        self.changed_at = now
+        return self.tiers[index]
+
+
+class CongestionController:
+    """ Связывает AIMD с элементами конвеера.
+
+        @encoder - кодер со свойством bitrate в кбит/с (у openh264enc - в
+            бит/с, см. BITRATE_SCALE; у v4l2h264enc свойства нет).
+        @srtsink - отправитель, чья статистика читается.
+        @capsfilter - caps перед кодером; если задан, при низком битрейте
+            понижается разрешение и частота кадров.
+    """
+
+    def __init__(self, encoder, srtsink, capsfilter=None, aimd=None, tiers=None):
+        self.encoder = encoder
+        self.srtsink = srtsink
+        self.capsfilter = capsfilter
+        self.aimd = aimd or AimdBitrate()
+        self.tiers = (tiers or TierSelector()) if capsfilter is not None else None
+        self.set_bitrate(self.aimd.bitrate)
+
+    def set_bitrate(self, kbps):
+        if self.encoder.find_property("bitrate") is None:
+            return
+        factory = self.encoder.get_factory().get_name()
+        self.encoder.set_property("bitrate", kbps * BITRATE_SCALE.get(factory, 1))
+
+    def poll(self):
+        bitrate = self.aimd.update(read_stats(self.srtsink))
+        if bitrate is not None:
+            print("GUEST: bitrate", bitrate, "kbps", self.aimd.reason or "")
+            self.set_bitrate(bitrate)
+        if self.tiers is not None:
+            tier = self.tiers.update(self.aimd.bitrate)
+            if tier is not None:
+                print("GUEST: video", tier)
+                self.capsfilter.set_property("caps", cached_caps(tier.caps()))
+
+    def snapshot(self):
+        return {
+            "bitrate_kbps": self.aimd.bitrate,
+            "reason": self.aimd.reason,
+            "tier": repr(self.tiers.tier()) if self.tiers else None,
+        }
+
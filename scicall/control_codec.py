@@ -0,0 +1,106 @@
+""" Кадрирование сообщений управляющего канала.
+
+Tcp не сохраняет границы сообщений: одно чтение может вернуть половину
+сообщения или несколько сообщений сразу. Кодек накапливает входящие байты
+и выдаёт только целые сообщения.
+"""
+
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CODECS = [ "line", "json", "msgpack" ]
+DEFAULT_CODEC = "line"
+MAX_FRAME_SIZE = 1 << 20
+
+
+class LineJsonCodec:
+    """ json сообщения, разделённые переводом строки. """
+
+    def __init__(self):
+        self.buffer = b""
+
+    def reset(self):
+        self.buffer = b""
+
+    def encode(self, dct):
+        return (json.dumps(dct) + "\n").encode("utf-8")
+
+    def feed(self, data):
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\n")
+        if len(self.buffer) > MAX_FRAME_SIZE:
+            self.buffer = b""
+            raise Exception("control message is too long")
+
+        messages = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                messages.append(json.loads(line.decode("utf-8")))
+            except ValueError:
+                print("control: malformed message", line[:80])
+        return messages
+
+
+class LengthPrefixedCodec:
+    """ Кадры вида: длина (4 байта, big endian) + тело в json или msgpack. """
+
+    HEADER = struct.Struct(">I")
+
+    def __init__(self, serializer="json"):
+        if serializer == "msgpack" and msgpack is None:
+            raise Exception("msgpack codec requires the msgpack package")
+        self.serializer = serializer
+        self.buffer = b""
+
+    def reset(self):
+        self.buffer = b""
+
+    def dumps(self, dct):
+        if self.serializer == "msgpack":
+            return msgpack.packb(dct, use_bin_type=True)
+        return json.dumps(dct).encode("utf-8")
+
+    def loads(self, payload):
+        if self.serializer == "msgpack":
+            return msgpack.unpackb(payload, raw=False)
+        return json.loads(payload.decode("utf-8"))
+
+    def encode(self, dct):
+        payload = self.dumps(dct)
+        return self.HEADER.pack(len(payload)) + payload
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        while len(self.buffer) >= self.HEADER.size:
+            size, = self.HEADER.unpack_from(self.buffer)
+            if size > MAX_FRAME_SIZE:
+                self.buffer = b""
+                raise Exception("control frame is too long")
+            end = self.HEADER.size + size
+            if len(self.buffer) < end:
+                break
+            payload = self.buffer[self.HEADER.size:end]
+            self.buffer = self.buffer[end:]
+            messages.append(self.loads(payload))
+        return messages
+
+
+def make_codec(kind=None):
+    """ Обе стороны канала должны использовать один и тот же кодек. """
+    kind = kind or DEFAULT_CODEC
+    if kind == "line":
+        return LineJsonCodec()
+    elif kind == "json":
+        return LengthPrefixedCodec("json")
+    elif kind == "msgpack":
+        return LengthPrefixedCodec("msgpack")
+    raise Exception(f"unknown control codec: {kind}")
@@ -0,0 +1,293 @@
+""" Управляющий канал станции и гостя на asyncio.
+
+Один цикл событий обслуживает все каналы: сервер принимает сколько угодно
+сессий, клиенты подключаются параллельно и без блокировок. Сообщения
+кадрируются кодеком из control_codec и раздаются обработчикам по полю "cmd".
+
+Станция слушает один порт на все каналы. Гость первым сообщением
+присылает hello_from_guest с номером канала "ch", и ChannelRouter
+передаёт сессию нужному каналу.
+
+Команды канала:
+    hello_from_guest, client_collision, no_such_channel - знакомство
+    set_srtlatency, start_common_stream, start_feedback_stream, ack - рукопожатие
+    remote_restart - перезапуск гостя по просьбе станции
+    keepalive - проверка живости, обрабатывается самой сессией
+
+Интерфейс работает с каналом через ControlLoopThread: цикл asyncio крутится
+в отдельном потоке, а события передаются в Qt сигналами (см. qt_control).
+
+Тот же протокол по локальному сокету связывает супервизор станции с
+процессами каналов (см. supervisor, channel_worker).
+"""
+
+import asyncio
+import threading
+import time
+import traceback
+
+from scicall.control_codec import make_codec
+from scicall.handshake import ack
+
+KEEPALIVE_INTERVAL = 1.5
+KEEPALIVE_TIMEOUT = 5
+CONNECT_TIMEOUT = 2
+READ_CHUNK = 4096
+LISTEN_BACKLOG = 1024
+
+
+class ControlSession:
+    """ Одно управляющее соединение.
+
+        Обработчики команд регистрируются через on(cmd, fn) и получают
+        сообщение целиком. Всё, для чего обработчика нет, уходит в
+        on_message(session, data). on_close(session) вызывается один раз.
+    """
+
+    def __init__(self, reader, writer, codec=None):
+        self.reader = reader
+        self.writer = writer
+        self.codec = make_codec(codec)
+        self.handlers = {}
+        self.on_message = None
+        self.on_close = None
+        self.keepaliver = None
+        self.closed = False
+        self.last_received = time.monotonic()
+        self.peer = writer.get_extra_info("peername")
+
+    def on(self, cmd, fn):
+        self.handlers[cmd] = fn
+
+    def send(self, dct):
+        if self.closed:
+            return
+        self.writer.write(self.codec.encode(dct))
+
+    def command(self, cmd, **kwargs):
+        dct = {"cmd": cmd}
+        dct.update(kwargs)
+        self.send(dct)
+
+    def dispatch(self, data):
+        cmd = data.get("cmd")
+        if cmd == "keepalive":
+            return
+        handler = self.handlers.get(cmd)
+        if handler:
+            handler(data)
+        elif self.on_message:
+            self.on_message(self, data)
+        else:
+            print("control: unresolved command", cmd)
+
+    async def serve(self):
+        try:
+            while not self.closed:
+                data = await self.reader.read(READ_CHUNK)
+                if not data:
+                    break
+                self.last_received = time.monotonic()
+                for msg in self.codec.feed(data):
+                    self.dispatch(msg)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.close()
+
+    def start_keepalive(self, interval=KEEPALIVE_INTERVAL, timeout=KEEPALIVE_TIMEOUT, payload=None):
+        """ Шлёт keepalive и закрывает сессию, если собеседник замолчал. """
+        payload = payload or {"cmd": "keepalive"}
+        self.keepaliver = asyncio.ensure_future(self.keepalive(interval, timeout, payload))
+
+    async def keepalive(self, interval, timeout, payload):
+        while not self.closed:
+            await asyncio.sleep(interval)
+            self.send(payload)
+            if time.monotonic() - self.last_received > timeout:
+                print("control: keepalive timeout", self.peer)
+                self.close()
+
+    async def drain_and_close(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.keepaliver and self.keepaliver is not asyncio.current_task():
+            self.keepaliver.cancel()
+        self.keepaliver = None
+        self.writer.close()
+        if self.on_close:
+            self.on_close(self)
+
+
+class ControlServer:
+    """ Сервер управляющего канала.
+
+        @on_session(session) вызывается для каждого нового соединения до
+        чтения первого сообщения, в нём назначаются обработчики.
+    """
+
+    def __init__(self, on_session, codec=None):
+        self.on_session = on_session
+        self.codec = codec
+        self.server = None
+        self.sessions = set()
+
+    async def listen(self, host, port):
+        self.server = await asyncio.start_server(self.handle, host, port, backlog=LISTEN_BACKLOG)
+
+    async def listen_unix(self, path):
+        self.server = await asyncio.start_unix_server(self.handle, path, backlog=LISTEN_BACKLOG)
+
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        session = ControlSession(reader, writer, self.codec)
+        self.sessions.add(session)
+        try:
+            self.on_session(session)
+            await session.serve()
+        finally:
+            self.sessions.discard(session)
+
+    async def close(self):
+        for session in list(self.sessions):
+            session.close()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        self.server = None
+
+
+class ControlClient:
+    """ Клиент управляющего канала. """
+
+    @staticmethod
+    async def connect(host, port, on_message=None, on_close=None,
+            codec=None, timeout=CONNECT_TIMEOUT):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout)
+        return ControlClient.serve(reader, writer, on_message, on_close, codec)
+
+    @staticmethod
+    async def connect_unix(path, on_message=None, on_close=None,
+            codec=None, timeout=CONNECT_TIMEOUT):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_unix_connection(path), timeout)
+        return ControlClient.serve(reader, writer, on_message, on_close, codec)
+
+    @staticmethod
+    def serve(reader, writer, on_message, on_close, codec):
+        session = ControlSession(reader, writer, codec)
+        session.on_message = on_message
+        session.on_close = on_close
+        asyncio.ensure_future(session.serve())
+        return session
+
+
+class ChannelRouter:
+    """ Раздаёт сессии единого управляющего порта каналам.
+
+        Канал должен иметь метод is_busy(). Выключенные каналы снимаются
+        с регистрации, и гость получает no_such_channel.
+    """
+
+    def __init__(self):
+        self.channels = {}
+        self.routes = {}
+
+    def register(self, channelno, channel):
+        self.channels[channelno] = channel
+
+    def unregister(self, channelno):
+        self.channels.pop(channelno, None)
+
+    def channel_of(self, session):
+        return self.routes.get(session)
+
+    def route(self, session, data):
+        """ Возвращает (канал, None) или (None, отказ для гостя). """
+        ch = data.get("ch")
+        channel = self.channels.get(ch)
+        if channel is None:
+            return None, {"cmd": "no_such_channel", "ch": ch}
+        if channel.is_busy():
+            return None, {"cmd": "client_collision", "ch": ch}
+        self.routes[session] = channel
+        return channel, None
+
+    def forget(self, session):
+        return self.routes.pop(session, None)
+
+
+class ControlLoopThread:
+    """ Цикл asyncio в отдельном потоке для интерфейса на Qt. """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if ControlLoopThread._instance is None:
+            ControlLoopThread._instance = ControlLoopThread()
+        return ControlLoopThread._instance
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        """ Запускает корутину в цикле, возвращает concurrent.futures.Future. """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, fn, *args):
+        self.loop.call_soon_threadsafe(fn, *args)
+
+
+class FakeGuest:
+    """ Гость без конвееров: отвечает на рукопожатие станции.
+        Нужен для проверки управляющего канала по петле. """
+
+    def __init__(self, channelno, codec=None):
+        self.channelno = channelno
+        self.codec = codec
+        self.session = None
+        self.ready = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.commands = []
+
+    async def connect(self, host, port):
+        self.session = await ControlClient.connect(host, port,
+            on_message=self.on_message,
+            on_close=lambda session: self.closed.set(),
+            codec=self.codec)
+        for cmd in ("set_srtlatency", "start_common_stream"):
+            self.session.on(cmd, self.acknowledge)
+        self.session.on("start_feedback_stream", self.on_feedback)
+        self.session.start_keepalive()
+        self.session.command("hello_from_guest", ch=self.channelno)
+
+    def acknowledge(self, data):
+        self.commands.append(data["cmd"])
+        self.session.send(ack(data["cmd"]))
+
+    def on_feedback(self, data):
+        self.acknowledge(data)
+        self.ready.set()
+
+    def on_message(self, session, data):
+        self.commands.append(data["cmd"])
+
+    def close(self):
+        if self.session:
+            self.session.close()
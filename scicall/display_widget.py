@@ -3,6 +3,10 @@ from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from PyQt5 import QtCore, QtGui, QtWidgets, QtOpenGL
 
+from scicall.shm_preview import ShmPreviewReader, PREVIEW_WIDTH, PREVIEW_HEIGHT, PREVIEW_FPS
+from scicall.level_meter import LEVEL_INTERVAL, LEVEL_FLOOR
+import scicall.monitor_profile as monitor_profile
+
 class GstreamerDisplay(QtOpenGL.QGLWidget):
 	""" Виджет, в котором рисует выходной элемент видоконвеера """
 
@@ -16,4 +20,85 @@ class GstreamerDisplay(QtOpenGL.QGLWidget):
 		self.setFixedSize(320,240)
 
 	def connect_to_sink(self, source):
-		source.set_window_handle(self.winid)
\ No newline at end of file
+		source.set_window_handle(self.winid)
+
+class ShmPreviewDisplay(QLabel):
+	""" Виджет предпросмотра из разделяемой памяти (см. shm_preview).
+		Кадры забираются таймером не чаще @fps, выключенный виджет не читает. """
+
+	def __init__(self, name, fps=PREVIEW_FPS):
+		super().__init__()
+		self.reader = ShmPreviewReader(name, fps=fps)
+		self.timer = QTimer()
+		self.timer.setInterval(int(1000 / fps))
+		self.timer.timeout.connect(self.update_frame)
+		palette = QPalette()
+		palette.setColor(QPalette.Window, Qt.black)
+		self.setAutoFillBackground(True)
+		self.setPalette(palette)
+		self.setAlignment(Qt.AlignCenter)
+		self.setFixedSize(320,240)
+
+	def set_active(self, enabled):
+		if enabled:
+			self.timer.start()
+		else:
+			self.timer.stop()
+			self.reader.stop()
+			self.clear()
+
+	def update_frame(self):
+		data = self.reader.pull()
+		if data is None:
+			return
+		image = QImage(data, PREVIEW_WIDTH, PREVIEW_HEIGHT, QImage.Format_RGB32)
+		self.setPixmap(QPixmap.fromImage(image).scaled(self.size(), Qt.KeepAspectRatio))
+
+class LevelMeter(QWidget):
+	""" Индикатор уровня звука по каналам: среднеквадратичный уровень
+		полосой, пиковый - чертой. @source() возвращает уровень из
+		level_meter.LevelTracker или None и опрашивается таймером. """
+
+	def __init__(self, source):
+		super().__init__()
+		self.source = source
+		self.level = None
+		self.timer = QTimer()
+		self.timer.timeout.connect(self.update_level)
+		self.timer.start(LEVEL_INTERVAL)
+
+	def connect_to_sink(self, sink):
+		pass
+
+	def update_level(self):
+		level = self.source()
+		if level is None and self.level is None:
+			return
+		self.level = level
+		self.update()
+
+	def fraction(self, db):
+		return min(max((db - LEVEL_FLOOR) / -LEVEL_FLOOR, 0), 1)
+
+	def paintEvent(self, ev):
+		painter = QPainter(self)
+		painter.fillRect(self.rect(), Qt.black)
+		if not self.level or not self.level["rms"]:
+			return
+		channels = len(self.level["rms"])
+		h = self.height() / channels
+		for i, (rms, peak) in enumerate(zip(self.level["rms"], self.level["peak"])):
+			top = int(i * h + 2)
+			bar = max(int(h) - 4, 1)
+			width = int(self.width() * self.fraction(rms))
+			color = Qt.green if rms < -18 else Qt.yellow if rms < -6 else Qt.red
+			painter.fillRect(0, top, width, bar, color)
+			x = int(self.width() * self.fraction(peak))
+			painter.fillRect(max(x - 2, 0), top, 2, bar, Qt.white)
+
+
+def audio_display(source):
+	""" Индикатор уровня или, при --spectrascope, окно спектроскопа. """
+	if monitor_profile.SPECTRASCOPE:
+		return GstreamerDisplay()
+	return LevelMeter(source)
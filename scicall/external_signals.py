@@ -6,24 +6,25 @@ from gi.repository import GObject, Gst, GstVideo
 import traceback
 import time
 
-from scicall.display_widget import GstreamerDisplay
+from scicall.display_widget import GstreamerDisplay, audio_display
 import scicall.pipeline_utils as pipeline_utils
 import scicall.util as util
 import json
 import threading
 
 from scicall.ports import *
+from scicall.station_pipeline import ExternalSourcePipeline
 
 class ExternalSignalPanel(QWidget):
     def __init__(self, chno, zone):
         self.mtx = threading.RLock()
         super().__init__()
-        self.srtlatency = 80
         self.zone = zone
         self.pipeline = None
+        self.source = ExternalSourcePipeline(chno)
         self.chno = chno
         self.viddisp = GstreamerDisplay()
-        self.auddisp = GstreamerDisplay()
+        self.auddisp = audio_display(self.source.audio_level)
         self.viddisp.setFixedSize(QSize(160, 160))
         self.auddisp.setFixedSize(QSize(160, 160))
         #self.displayout = QHBoxLayout()
@@ -72,92 +73,40 @@ class ExternalSignalPanel(QWidget):
         self.update_control()
 
     def update_control(self):
-        self.zone.start_restart_feedback_streams()
+        QTimer.singleShot(2, self.restart_pipeline)
 
     def source_type(self):
         with self.mtx:
             return self.source_types_cb.currentText()
 
     def stop_pipeline(self):
-        print("Q")
         with self.mtx:
-            if self.pipeline:
-                self.pipeline.set_state(Gst.State.NULL)
+            self.source.stop()
             self.pipeline = None
 
     def input_ndi_name(self):
         return self.ndi_name_list.currentText()
 
-    def global_audio_external_template(self):
-        srctype = self.source_type()
-        audio_source = "audiotestsrc"
-        audiocaps = pipeline_utils.global_audiocaps()
-        audioparser = pipeline_utils.default_audioparser()
-        audioencoder = pipeline_utils.default_audioencoder()
-        audio_output_port = external_mirror_audio_port(self.chno)
+    def start_pipeline(self):
+        with self.mtx:
+            self.source.source_type = self.source_type()
+            self.source.ndi_name = self.input_ndi_name()
+            self.pipeline = self.source.start(sync_handler=self.on_sync_message)
 
-        if srctype == "Нет":
-            return None
-        elif srctype == "Тестовый1":
-            audio_source = "audiotestsrc is-live=true"
-        elif srctype == "Тестовый2":
-            audio_source = "audiotestsrc is-live=true"
-        elif srctype == "NDI":
-            audio_source = f"""ndiaudiosrc do-timestamp=true timestamp-mode=2 timeout=0 ndi-name=\"{self.input_ndi_name()}\" ! audioresample ! audioconvert ! queue name=qa5"""                        
-
-        spectrascope = f"""audiotee. ! queue name=qa1 ! audioconvert ! spectrascope ! 
-            videoconvert ! autovideosink name=audioend""" 
-        srtout = f"""audiotee. ! queue name=qa2 ! {audioencoder} ! 
-                srtsink uri=srt://:{audio_output_port} wait-for-connection=false latency={self.srtlatency}"""
-        template = f""" 
-            {audio_source} ! audioconvert ! queue name=qa0 ! tee name=audiotee 
-            {spectrascope}
-            {srtout}
-        """ 
-        return template
-
-    def start_global_video_feedback_pipeline(self, ports):
-        with self.mtx:            
-            srctype = self.source_type()
-            videocaps = pipeline_utils.global_videocaps()
-            h264caps = "video/x-h264,profile=baseline,stream-format=byte-stream,alignment=au,framerate=30/1"
-            video_source = "videotestsrc"
-            video_encoder = "x264enc tune=zerolatency"
-
-            if srctype == "Нет":
-                return None
-            elif srctype == "Тестовый1":
-                video_source = "videotestsrc is-live=true"
-            elif srctype == "Тестовый2":
-                video_source = "videotestsrc pattern=snow is-live=true"
-            elif srctype == "NDI":
-                video_source = f"""ndivideosrc do-timestamp=true timestamp-mode=2 timeout=0 ndi-name=\"{self.input_ndi_name()}\" ! queue name=q5"""                        
-
-            srtsouts = ""
-            for p in ports:
-                srtsouts += f" h264tee. ! queue ! srtsink latency=60 uri=srt://:{p} wait-for-connection=false sync=false \n"
-            external_source_substring = self.global_audio_external_template()
-            template = f""" 
-                {video_source} ! videoconvert ! {videocaps} ! queue name=q0 ! tee name=sourcetee
-                sourcetee. ! queue name=q1 ! videoconvert ! autovideosink name=videoend
-                sourcetee. ! queue name=q2 ! {video_encoder} ! {h264caps} ! tee name=h264tee
-                {srtsouts}
-                {external_source_substring}
-            """ 
-            self.pipeline=Gst.parse_launch(template)
-            self.bus = self.pipeline.get_bus()
-            self.bus.add_signal_watch()
-            self.bus.enable_sync_message_emission()
-            self.bus.connect('sync-message::element', self.on_sync_message)
-            self.bus.connect('sync-message', self.on_sync_message)
-            
-            if self.source_type() != "Нет":
-                self.pipeline.set_state(Gst.State.PLAYING)
-    
-            qs = [ "q0", "q1", "q2", "q3", "q4", "q5", "qa0", "qa1", "qa2", "qa5" ] 
-            qs = [ self.pipeline.get_by_name(qname) for qname in qs ]
-            for q in qs:
-                pipeline_utils.setup_queuee(q)  
+    def restart_pipeline(self):
+        """ Смена источника требует пересборки. Порт раздачи гостям не меняется. """
+        with self.mtx:
+            self.stop_pipeline()
+            self.start_pipeline()
+
+    def feedback_videoport(self):
+        return self.source.feedback_videoport()
+
+    def request_keyframe(self, reason=None):
+        self.source.request_keyframe(reason)
+
+    def set_previews_active(self, active):
+        self.source.set_previews_active(active)
 
     def on_sync_message(self, bus, msg):
         with self.mtx:        
@@ -172,15 +121,15 @@ class ExternalSignalPanel(QWidget):
         if self.inited == False:
             self.inited = True
             self.source_types_cb.setCurrentIndex(0)
-            self.start_global_video_feedback_pipeline([])
+            self.start_pipeline()
 
 class ExternalSignalsZone(QWidget):
-    def __init__(self, zone):
+    def __init__(self, zone, externals_count=1):
         self.mtx = threading.RLock()
         super().__init__()
         self.panels = []
         self.lay = QHBoxLayout()
-        for i in range(1):
+        for i in range(externals_count):
             self.add_panel(i, zone)
         self.setLayout(self.lay)
         #self.start_global_audio_feedback_pipeline(zone.get_audioends())
@@ -209,14 +158,25 @@ class ExternalSignalsZone(QWidget):
         self.bus = None
         self.audio_pipeline = None
 
-    def start_global_streams(self, ports):
+    def feedback_videoport(self):
+        """ Видео обратного канала гостям отдаёт только первый источник. """
+        with self.mtx:
+            if self.panels:
+                return self.panels[0].feedback_videoport()
+            return None
+
+    def set_previews_active(self, active):
         with self.mtx:
             for z in self.panels:
-                z.start_global_video_feedback_pipeline(ports)
-            #self.start_global_audio_feedback_pipeline(self.zone.get_audioends())
+                z.set_previews_active(active)
+
+    def request_feedback_keyframe(self):
+        with self.mtx:
+            if self.panels:
+                self.panels[0].request_keyframe("guest request")
 
     def channels_count(self):
-        return 3
+        return self.zone.guests_count()
 
     #def set_volume(self, f, t, val):
         #name = f"v_{f}{t}"
@@ -0,0 +1,79 @@
+""" Раздача одного закодированного потока многим гостям через один srt порт.
+
+Раньше на каждого гостя к h264tee подключалась своя ветвь queue ! srtsink
+со своим слушающим портом: N потоков очередей и N копий буфера. Здесь
+один srtsink слушает один порт и принимает сколько угодно абонентов,
+каждый получает те же пакеты.
+
+Ограничение памяти и политика отбрасывания на абонента - средствами srt:
+в живом режиме у каждого соединения свой буфер отправки, пакеты старше
+задержки выбрасываются (too-late packet drop), а медленный абонент не
+задерживает остальных. Общая очередь перед srtsink выбрасывает старые
+буферы (QueueKind.FANOUT), если отправка всё же встала.
+"""
+
+import threading
+
+from gi.repository import Gst
+
+from scicall.pipeline_builder import GraphBuilder
+from scicall.queue_policy import QueueKind
+
+
+class SrtFanout:
+    """ Слушающий srtsink с учётом подключенных абонентов.
+
+        @on_caller_added(address) - вызывается из потока srt.
+    """
+
+    def __init__(self, port, srtlatency, stats=None, on_caller_added=None):
+        self.port = port
+        self.srtlatency = srtlatency
+        self.stats = stats
+        self.on_caller_added = on_caller_added
+        self.mtx = threading.Lock()
+        self.callers = {}
+        self.bin = None
+        self.srtsink = None
+
+    def build(self):
+        b = GraphBuilder(Gst.Bin.new(f"fanout{self.port}"), stats=self.stats)
+        first, self.srtsink = b.chain(b.queue(QueueKind.FANOUT, "qf"),
+            f"srtsink latency={self.srtlatency} uri=srt://:{self.port} wait-for-connection=false sync=false")
+        b.ghost("sink", first, "sink")
+        self.srtsink.connect("caller-added", self.caller_added)
+        self.srtsink.connect("caller-removed", self.caller_removed)
+        self.bin = b.build()
+        return self.bin
+
+    def caller_added(self, element, sock, address):
+        # sock в gst-srt не используется (всегда 0), абоненты различаются адресом.
+        address = address_text(address)
+        with self.mtx:
+            self.callers[address] = self.callers.get(address, 0) + 1
+        print("FANOUT:", self.port, "caller added", address)
+        if self.on_caller_added:
+            self.on_caller_added(address)
+
+    def caller_removed(self, element, sock, address):
+        address = address_text(address)
+        with self.mtx:
+            count = self.callers.pop(address, 0) - 1
+            if count > 0:
+                self.callers[address] = count
+        print("FANOUT:", self.port, "caller removed", address)
+
+    def callers_count(self):
+        with self.mtx:
+            return sum(self.callers.values())
+
+    def snapshot(self):
+        with self.mtx:
+            return { "port": self.port, "callers": sorted(self.callers) }
+
+
+def address_text(address):
+    try:
+        return f"{address.get_address().to_string()}:{address.get_port()}"
+    except Exception:
+        return str(address)
@@ -0,0 +1,29 @@
+""" Выбор кодера в интерфейсе.
+
+Виджет вынесен из pipeline_utils, чтобы станция без интерфейса (--server)
+не зависела от PyQt5.
+"""
+
+from PyQt5.QtWidgets import QComboBox
+
+from scicall.pipeline_utils import GPUType, detect_gpu_type, gpu_type_from_text
+
+
+class GPUChecker(QComboBox):
+    def __init__(self):
+        super().__init__()
+        
+        for a in GPUType:
+            self.addItem(a)
+
+    def automatic(self):
+        return detect_gpu_type()
+
+    def get(self):
+        return gpu_type_from_text(self.currentText())
+
+    def set(self, type):
+        lst = list(GPUType)
+        for i, o in enumerate(lst):
+            if type == o:
+                self.setCurrentIndex(i)
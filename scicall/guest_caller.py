@@ -6,22 +6,34 @@ from gi.repository import GObject, Gst, GstVideo
 import json
 import time
 
-from scicall.display_widget import GstreamerDisplay
+from scicall.display_widget import GstreamerDisplay, audio_display
 from scicall.util import get_video_captures_list, get_audio_captures_list
 
 from scicall.ports import *
+from scicall.gpu_checker import GPUChecker
+from scicall.qt_control import QtControlClient
+from scicall.handshake import ack
 from scicall.stream_settings import (
     MediaType,
 )
 
 import traceback
 import scicall.pipeline_utils as pipeline_utils
+from scicall.pipeline_builder import GraphBuilder
+from scicall.queue_policy import QueueKind, QueueStats
+from scicall.instrumentation import Instrumentation
+from scicall.congestion import CongestionController, BITRATE_POLL_INTERVAL
+from scicall.source_recovery import chain_between
+from scicall.keyframe import KeyframeRequester, encoder_with_gop
+import scicall.monitor_profile as monitor_profile
+from scicall.monitor_profile import video_monitor, audio_monitor, set_monitors_active
+from scicall.level_meter import LevelTracker
 import threading
 
 class GuestCaller(QWidget):
     """ Пользовательский виджет реализует удалённой станции. """
 
-    def __init__(self):
+    def __init__(self, guests_count=3, control_port=STATION_CONTROL_PORT):
         self.mtx = threading.RLock()
         self.IMMITATION_FLAG=False
         self.SRTLATENCY=60
@@ -43,17 +55,20 @@ class GuestCaller(QWidget):
             print(v.audio_caps())
 
         self.runned = False
+        self.levels = LevelTracker()
         self.display_widget = GstreamerDisplay()
         self.display_widget.setFixedSize(320,240)
-        self.spectroscope_widget = GstreamerDisplay()
-        self.spectroscope_widget.setFixedSize(320,240)
+        self.spectroscope_widget = audio_display(lambda: self.levels.get("miclevel"))
+        self.spectroscope_widget.setFixedSize(320,240 if monitor_profile.SPECTRASCOPE else 40)
         self.feedback_display_widget = GstreamerDisplay()
         self.feedback_display_widget.setFixedSize(320,240)
-        self.feedback_spectroscope_widget = GstreamerDisplay()
-        self.feedback_spectroscope_widget.setFixedSize(320,240)
+        self.feedback_spectroscope_widget = audio_display(lambda: self.levels.get("fblevel"))
+        self.feedback_spectroscope_widget.setFixedSize(320,240 if monitor_profile.SPECTRASCOPE else 40)
         self.channel_list = QComboBox()
-        self.channel_list.addItems(["1", "2", "3"])
+        self.channel_list.addItems([ str(i+1) for i in range(guests_count) ])
         self.station_ip = QLineEdit("127.0.0.1")
+        self.station_port = QLineEdit(str(control_port))
+        self.station_port.setValidator(QIntValidator(1, 65535))
         self.video_source = QComboBox()
         self.video_source.addItems([ r.user_readable_name() for r in self.videos ])
         self.audio_source = QComboBox()
@@ -77,7 +92,10 @@ class GuestCaller(QWidget):
         self.fb_volume_slider.setValue(1000)
         self.fb_volume_slider.sliderMoved.connect(self.fb_volume_action)
 
-        self.gpuchecker = pipeline_utils.GPUChecker()
+        self.gpuchecker = GPUChecker()
+        self.cb_adaptive_bitrate = QCheckBox("Адаптивный битрейт")
+        self.cb_adaptive_bitrate.setChecked(True)
+        self.cb_adaptive_resolution = QCheckBox("Снижать разрешение при плохом канале")
         #self.imitation_label_text = "Запуск без установки соединения (тест оборудования)"
         self.stop_immitation_label_text = "Остановить"
         self.connect_label_text = "Установить соединение"
@@ -103,15 +121,19 @@ class GuestCaller(QWidget):
         #self.info_layout.addWidget(self.status_label)
 
         self.control_layout.addWidget(QLabel("IP адрес сервера:"), 0, 0)
-        self.control_layout.addWidget(QLabel("Номер канала:"), 1, 0)
-        self.control_layout.addWidget(QLabel("Источник видео:"), 2, 0)
-        self.control_layout.addWidget(QLabel("Источник звука:"), 3, 0)
-        self.control_layout.addWidget(QLabel("Аппаратное ускорение:\n(поддерживаются карты\nnvidia)"), 6, 0)
+        self.control_layout.addWidget(QLabel("Управляющий порт:"), 1, 0)
+        self.control_layout.addWidget(QLabel("Номер канала:"), 2, 0)
+        self.control_layout.addWidget(QLabel("Источник видео:"), 3, 0)
+        self.control_layout.addWidget(QLabel("Источник звука:"), 4, 0)
+        self.control_layout.addWidget(QLabel("Аппаратное ускорение:\n(поддерживаются карты\nnvidia)"), 7, 0)
         self.control_layout.addWidget(self.station_ip, 0, 1)
-        self.control_layout.addWidget(self.channel_list, 1, 1)
-        self.control_layout.addWidget(self.video_source, 2, 1)
-        self.control_layout.addWidget(self.audio_source, 3, 1)
-        self.control_layout.addWidget(self.gpuchecker, 6, 1)
+        self.control_layout.addWidget(self.station_port, 1, 1)
+        self.control_layout.addWidget(self.channel_list, 2, 1)
+        self.control_layout.addWidget(self.video_source, 3, 1)
+        self.control_layout.addWidget(self.audio_source, 4, 1)
+        self.control_layout.addWidget(self.gpuchecker, 7, 1)
+        self.control_layout.addWidget(self.cb_adaptive_bitrate, 5, 0, 1, 2)
+        self.control_layout.addWidget(self.cb_adaptive_resolution, 6, 0, 1, 2)
         self.control_layout.addWidget(self.connect_button, 8, 0, 1, 2)
         #self.control_layout.addWidget(self.immitation_button, 7, 0, 1, 2)
 
@@ -141,22 +163,30 @@ class GuestCaller(QWidget):
         self.main_layout.addLayout(self.control_layout)
 
         self.setLayout(self.main_layout)
-        self.client = QTcpSocket()
 
         self.audio_enable_button.clicked.connect(self.audio_clicked)
         self.video_enable_button.clicked.connect(self.video_clicked)
         self.feed_audio_enable_button.clicked.connect(self.feed_audio_clicked)
         self.feed_video_enable_button.clicked.connect(self.feed_video_clicked)
 
-        self.client = QTcpSocket()
+        self.client = QtControlClient()
         self.client.connected.connect(self.on_client_connect)
+        self.client.failed.connect(self.on_client_failed)
         self.client.disconnected.connect(self.on_client_disconnect)
-        self.client.readyRead.connect(self.client_ready_read)
+        self.client.message.connect(self.new_opposite_command)
         self.connect_button.clicked.connect(self.connect_action)
         #self.immitation_button.clicked.connect(self.immitation_action)
 
         self.common_pipeline = None
         self.feedback_pipeline = None
+        self.fast_feedback_pipeline = None
+        self.monitors_active = True
+        self.queue_stats = {}
+        self.congestion = None
+        self.keyframes = None
+        self.congestion_timer = QTimer()
+        self.congestion_timer.timeout.connect(self.poll_congestion)
+        self.congestion_timer.start(BITRATE_POLL_INTERVAL * 1000)
 
     def volume_action(self):
         with self.mtx:
@@ -177,6 +207,10 @@ class GuestCaller(QWidget):
     def opposite_ip(self):
         return self.station_ip.text()
 
+    def opposite_port(self):
+        text = self.station_port.text()
+        return int(text) if text else STATION_CONTROL_PORT
+
     def on_client_disconnect(self):
         with self.mtx:
             self.stop_streams()
@@ -185,47 +219,63 @@ class GuestCaller(QWidget):
 
     def on_client_connect(self):
         with self.mtx:
+            print("success")
             self.connect_button.setText(self.disconnect_label_text)
+            self.send_to_opposite({"cmd": "hello_from_guest", "ch": self.channelno()})
 
-
-    def client_ready_read(self):
-        with self.mtx:
-            while self.client.bytesAvailable():
-                rawdata = self.client.readLineData(1024).decode("utf-8")
-                data = json.loads(rawdata)
-                self.new_opposite_command(data)
+    def on_client_failed(self, reason):
+        print("GUEST : connect failed:", reason)
+        msgBox = QMessageBox()
+        msgBox.setText("Не удалось установить соединение с сервером. \nСервер недоступен, или запрошенный канал неактивен.")
+        msgBox.exec()
 
     def new_opposite_command(self, data):
         print("STATION >>", data)
         cmd = data["cmd"]
         
-        if cmd == "hello_from_server":
-            self.send_to_opposite({"cmd": "hello_from_guest"})
-        elif cmd == "start_common_stream":
-            print("START_COMMON_STREAM")
-            time.sleep(0.2)
-            self.start_common_stream()
+        # Повторная команда приходит при смене задержки srt станцией,
+        # старые конвееры сначала останавливаются.
+        if cmd == "start_common_stream":
+            self.handshake_step(cmd, self.stop_common_stream, self.start_common_stream)
         elif cmd == "start_feedback_stream":
-            self.guest_channels_count = data["count_of_guests"]
-            self.external_channels_count = data["count_of_externals"]
-            time.sleep(0.2)
-            self.start_feedback_stream()
-            self.start_fast_feedback_audiostream()
+            self.handshake_step(cmd,
+                self.stop_feedback_stream, self.stop_fast_feedback_stream,
+                lambda: self.start_feedback_stream(data.get("videoport")),
+                self.start_fast_feedback_audiostream)
+            # Видео станции начнётся с ближайшего ключевого кадра, просим его сразу.
+            self.send_to_opposite({"cmd": "request_keyframe"})
         elif cmd == "set_srtlatency":
             self.SRTLATENCY = data["data"] 
+            self.send_to_opposite(ack(cmd))
         elif cmd == "client_collision":
             msgBox = QMessageBox()
             msgBox.setText("Кажется, этот канал кем-то занят. Попробуйте другой канал.")
+            msgBox.exec()
+        elif cmd == "no_such_channel":
+            msgBox = QMessageBox()
+            msgBox.setText("Запрошенный канал на станции отключён или не существует.")
             msgBox.exec()         
+        elif cmd == "request_keyframe":
+            if self.keyframes:
+                self.keyframes.request(data.get("reason"))
         elif cmd == "remote_restart":
             self.remote_restart()
-        elif cmd == "set_volumes":
-            self.set_mixer_volumes(guests=data["guest_channels"], externals=data["external_channels"])
         elif cmd == "keepalive":
             pass
         else:
             print("unresolved command")        
 
+    def handshake_step(self, name, *actions):
+        """ Выполняет шаг рукопожатия и подтверждает его станции. """
+        try:
+            for action in actions:
+                action()
+        except Exception as ex:
+            traceback.print_exc()
+            self.send_to_opposite(ack(name, ok=False, error=str(ex)))
+            return
+        self.send_to_opposite(ack(name))
+
     def remote_restart(self):
         with self.mtx:
             self.connect_action()
@@ -233,44 +283,19 @@ class GuestCaller(QWidget):
 
     def send_to_opposite(self, dct):
         with self.mtx:
-            self.client.writeData(json.dumps(dct).encode("utf-8"))
+            self.client.send(dct)
 
     def connect_action(self):
         with self.mtx:
-            if self.client.state() == QTcpSocket.ConnectedState or self.common_pipeline:
-                self.client.disconnectFromHost()
+            if self.client.is_connected() or self.common_pipeline:
+                self.client.disconnect_from_host()
                 self.stop_streams()
                 return 
+            if self.client.connecting:
+                return
 
             print("tryConnectTo server")
-            self.client.connectToHost(QHostAddress(self.opposite_ip()), channel_control_port(self.channelno()))
-            success = self.client.waitForConnected(400)
-            if success:
-                print("success")
-                self.client.disconnected.connect(self.on_disconnect)
-                self.create_keepaliver()
-            else:            
-                msgBox = QMessageBox()
-                msgBox.setText("Не удалось установить соединение с сервером. \nСервер недоступен, или запрошенный канал неактивен.")
-                msgBox.exec()
-
-    def create_keepaliver(self):
-        self.keepaliver = QTimer()
-        self.keepaliver.timeout.connect(self.keepalive_handler)
-        self.keepaliver.setInterval(1500)
-        self.keepaliver.start()
-
-    def keepalive_handler(self):
-        self.send_to_opposite({"cmd": "keepalive", "ch": self.channelno()+1})
-
-    def on_disconnect(self):
-        with self.mtx:
-            self.stop_streams()
-            self.client.disconnectFromHost()
-            
-            if self.keepaliver:
-                self.keepaliver.stop()
-                self.keepaliver = None
+            self.client.connect_to(self.opposite_ip(), self.opposite_port())
 
     def immitation_action(self):
         with self.mtx:   
@@ -290,9 +315,6 @@ class GuestCaller(QWidget):
     def audio_device(self):
         return self.audios[self.audio_source.currentIndex()]
 
-    def on_connect_button_clicked(self):
-        self.client.open(self.ip, channel_connect_port(self.channelno()))
-
     def video_clicked(self):
         self.enable_disable_video_input()
 
@@ -332,79 +354,88 @@ class GuestCaller(QWidget):
     
             videoout = f"srtsink uri=srt://{srthost}:{srtport} wait-for-connection=true latency={srtlatency} sync=false"
             audioout = f"srtsink uri=srt://{srthost}:{srtport+1} wait-for-connection=true latency={srtlatency} sync=false"
-    
-            spectrogramm = "audiotee. ! queue name=q3 ! audioconvert ! spectrascope ! videoconvert ! autovideosink name=audioend"
-            
+
             if self.IMMITATION_FLAG:
                 videoout = f"srtsink uri=srt://127.0.0.1:{srtport} wait-for-connection=true latency={srtlatency} sync=false"
                 audioout = f"srtsink uri=srt://127.0.0.1:{srtport+1} wait-for-connection=true latency={srtlatency} sync=false"
     
-            audiocaps = pipeline_utils.global_audiocaps()
-            h264caps = "video/x-h264,profile=baseline,stream-format=byte-stream,alignment=au,framerate=30/1"
-            pipeline_string = f"""
-                {video_device} name=cam ! video/x-raw,width=640,framerate=30/1 ! videoscale ! videoconvert ! 
-                    {videocaps} ! videocompositor. 
-                videotestsrc pattern=snow name=fakevideosrc ! video/x-raw,width=640,framerate=30/1 ! textoverlay text="Нет изображения" 
-                    valignment=center halignment=center font-desc="Sans, 72" ! videoconvert ! videoscale ! 
-                        {videocaps} ! videocompositor.
-                compositor name=videocompositor ! tee name=videotee
-    
-                {audio_device} name=mic ! volume name=volume ! volume name=onoffvol 
-                    ! tee name=audiotee 
-    
-                videotee. ! queue name=q0 ! videoconvert ! {videocoder} ! 
-                    {h264caps} ! 
-                         queue name=q4 ! 
-                {videoout}
-                
-                videotee. ! queue name=q1 !videoconvert ! autovideosink name=videoend
-                            
-                {spectrogramm}
-                audiotee. ! queue name=q2 ! audioconvert ! audioresample ! {audioencoder} ! 
-                {audioout}
-                """
-            self.common_pipeline = Gst.parse_launch(pipeline_string)
-
-            qs = [ self.common_pipeline.get_by_name(qname) for qname in [
-                "q0", "q1", "q2", "q3", "q4"
-            ]]
-            for q in qs:
-                pipeline_utils.setup_queuee(q)
+            # Частота кадров не фиксируется: её может понизить контроллер битрейта.
+            h264caps = "video/x-h264,profile=baseline,stream-format=byte-stream,alignment=au"
+            camcaps = "video/x-raw,width=640,framerate=30/1"
+
+            stats = QueueStats()
+            self.queue_stats["common"] = stats
+            b = GraphBuilder(stats=stats)
+            # Заставка "камера выключена" рисуется один раз (num-buffers=1) и
+            # повторяется imagefreeze. Её цепочка работает только при выключенной
+            # камере, переключение - через input-selector без смешивания кадров.
+            selector = b.add("input-selector name=videoselector")
+            videotee = b.add("tee name=videotee")
+            audiotee = b.add("tee name=audiotee")
+            b.chain(f"{video_device} name=cam", camcaps, "videoscale", "videoconvert",
+                videocaps, selector)
+            slate, _ = b.chain("videotestsrc pattern=black num-buffers=1 name=fakevideosrc", videocaps,
+                'textoverlay text="Нет изображения" valignment=center halignment=center font-desc="Sans, 36"',
+                "videoconvert", "imagefreeze is-live=true", selector)
+            b.link(selector, videotee)
+            b.chain(f"{audio_device} name=mic", "volume name=volume", "volume name=onoffvol", audiotee)
+
+            enccaps = b.add(videocaps, "enccaps")
+            encoder = b.add(encoder_with_gop(videocoder), "videoencoder")
+            _, videosink = b.chain(videotee, b.queue(QueueKind.RAW_VIDEO, "q0"), "videoconvert",
+                "videoscale", "videorate", enccaps, encoder, h264caps, "h264parse config-interval=-1",
+                b.queue(QueueKind.NETWORK, "q4"), videoout)
+            self.keyframes = KeyframeRequester(encoder)
+            b.chain(videotee, *video_monitor(b, "q1", "autovideosink name=videoend", self.monitors_active))
+            b.chain(audiotee, *audio_monitor(b, "q3", "autovideosink name=audioend", "miclevel",
+                self.monitors_active))
+            _, audiosink = b.chain(audiotee, b.queue(QueueKind.AUDIO, "q2"), "audioconvert", "audioresample", audioencoder, audioout)
+            self.common_pipeline = b.build()
+            self.slate_chain = chain_between(slate, b.get("videoselector"))[:-1]
+            pipeline_utils.deactivate_chain(self.slate_chain)
+            selector.set_property("active-pad", selector.get_static_pad("sink_0"))
+
+            monitor = Instrumentation.instance().register(
+                "guest.common", self.common_pipeline, stats, srtlatency)
+            monitor.watch_flow("video_out", b.get("q4"))
+            monitor.watch_flow("audio_out", audiosink, "sink")
+            monitor.watch_level("audio_out", self.levels, "miclevel")
+            # Только кодер: videorate до него переписывает pts.
+            monitor.watch_latency("video_encode", encoder, encoder, exit_padname="src")
+            monitor.watch_srt("video_out", videosink)
+            monitor.watch_srt("audio_out", audiosink)
+
+            self.congestion = None
+            if self.cb_adaptive_bitrate.isChecked():
+                self.congestion = CongestionController(encoder, videosink,
+                    enccaps if self.cb_adaptive_resolution.isChecked() else None)
     
             self.bus = self.common_pipeline.get_bus()
             self.bus.add_signal_watch()
+            self.levels.attach(self.bus)
             self.bus.enable_sync_message_emission()
             self.bus.connect('sync-message::element', self.on_sync_message)
             self.common_pipeline.set_state(Gst.State.PLAYING)
     
-            #self.fakevideosrc = pipeline_utils.imagesource("c:/users/asus/test.png")
-            self.fakevideosrc = self.common_pipeline.get_by_name("fakevideosrc")
-            self.videosrc = pipeline_utils.GstSubchain(self.common_pipeline.get_by_name("cam")) 
+            self.videosrc = self.common_pipeline.get_by_name("cam")
             self.audiosrc = self.common_pipeline.get_by_name("mic")
-            self.vconv = pipeline_utils.GstSubchain(self.common_pipeline.get_by_name("vconv")) 
-            self.aconv = pipeline_utils.GstSubchain(self.common_pipeline.get_by_name("aconv")) 
-            self.srtout = pipeline_utils.GstSubchain(self.common_pipeline.get_by_name("srtout"))
-            self.vstub = pipeline_utils.GstSubchain(self.common_pipeline.get_by_name("lalala"))
-            self.vcompose = self.common_pipeline.get_by_name("videocompositor")
-            self.videosrc.enabled=True
+            self.videoselector = selector
             self.audiosrc.enabled=True
     
-            self.vcompose_sink_0 = self.vcompose.get_static_pad("sink_0")
-            self.vcompose_sink_1 = self.vcompose.get_static_pad("sink_1")       
-            self.vcompose_sink_1.set_property("alpha", 0)
-    
             self.viden = True
             self.auden = True
             self.feed_auden = True
             self.volume_action()
 
-    def start_feedback_stream(self):
+    def start_feedback_stream(self, videoport=None):
+        """ @videoport - общий порт раздачи видео станции. Если станция его
+            не сообщила, используется прежний порт канала. """
         with self.mtx:
         
             videodecoder = pipeline_utils.video_decoder_type(self.get_gpu_type())
     
             srthost = self.station_ip.text()
-            srtport = channel_feedback_mpeg_stream_port(self.channelno())
+            srtport = videoport or channel_feedback_mpeg_stream_port(self.channelno())
             srtin0uri = f"uri=srt://{srthost}:{srtport}"
             srtin1uri = f"uri=srt://{srthost}:{srtport+1}"
             if self.IMMITATION_FLAG:
@@ -418,19 +449,20 @@ class GuestCaller(QWidget):
             srtlatency = self.SRTLATENCY
             audiocaps = pipeline_utils.global_audiocaps()
             
-            videopart = f"""
-                srtsrc {srtin0uri} latency={srtlatency} wait-for-connection=true
-                     ! h264parse ! {videodecoder} ! videoconvert ! tee name=videotee 
-                videotee. ! queue name=q0 ! autovideosink name=fbvideoend sync=false
-            """
-            self.feedback_pipeline = Gst.parse_launch(videopart)
-
-            qs = [ self.feedback_pipeline.get_by_name(qname) for qname in [
-                "q2", "q3", "q0"
-            ]]
-            for q in qs:
-                pipeline_utils.setup_queuee(q)
-                    
+            stats = QueueStats()
+            self.queue_stats["feedback"] = stats
+            b = GraphBuilder(stats=stats)
+            videotee = b.add("tee name=videotee")
+            b.chain(f"srtsrc {srtin0uri} latency={srtlatency} wait-for-connection=true",
+                "h264parse", videodecoder, "videoconvert", videotee)
+            b.chain(videotee, *video_monitor(b, "q0", "autovideosink name=fbvideoend sync=false",
+                self.monitors_active))
+            self.feedback_pipeline = b.build()
+
+            monitor = Instrumentation.instance().register(
+                "guest.feedback", self.feedback_pipeline, stats, srtlatency)
+            monitor.watch_flow("video_in", videotee, "sink")
+
             self.fbbus = self.feedback_pipeline.get_bus()
             self.fbbus.add_signal_watch()
             self.fbbus.enable_sync_message_emission()
@@ -438,59 +470,35 @@ class GuestCaller(QWidget):
             self.feedback_pipeline.set_state(Gst.State.PLAYING)        
             
     def start_fast_feedback_audiostream(self):
+        """ Станция присылает гостю одну готовую смесь без его собственного голоса. """
         with self.mtx:
             audioparser = pipeline_utils.default_audioparser()
             audiodecoder = pipeline_utils.default_audiodecoder()
             srtlatency = self.SRTLATENCY
-            audiocaps = pipeline_utils.global_audiocaps()
             srthost = self.station_ip.text()
+            srtport = channel_feedback_audio_port(self.channelno())
+
+            stats = QueueStats()
+            self.queue_stats["feedback_audio"] = stats
+            b = GraphBuilder(stats=stats)
+            audiotee = b.add("tee name=audiotee")
+            b.chain(f"srtsrc uri=srt://{srthost}:{srtport} do-timestamp=true latency={srtlatency} wait-for-connection=true",
+                audioparser, audiodecoder, "audioconvert", b.queue(QueueKind.AUDIO, "q4"), audiotee)
+            b.chain(audiotee, *audio_monitor(b, "q3", "autovideosink name=fbaudioend sync=false",
+                "fblevel", self.monitors_active))
+            b.chain(audiotee, b.queue(QueueKind.AUDIO, "q2"), "audioconvert", "audioresample",
+                "volume volume=1 name=onoffvol", "volume volume=1 name=fbvolume",
+                "autoaudiosink sync=false ts-offset=-2000000000 name=asink")
+            self.fast_feedback_pipeline = b.build()
+
+            monitor = Instrumentation.instance().register(
+                "guest.feedback_audio", self.fast_feedback_pipeline, stats, srtlatency)
+            monitor.watch_flow("audio_in", b.get("q4"))
+            monitor.watch_level("audio_in", self.levels, "fblevel")
 
-
-            audio_mirror_ports = [ channel_audio_mirror_port(i) for i in range(self.guest_channels_count) ]   
-            guests_srturi = [ f"uri=srt://{srthost}:{port}" for port in audio_mirror_ports ]
-
-            external_audio_ports = [ external_mirror_audio_port(i) for i in range(self.external_channels_count) ]   
-            externals_srturi = [ f"uri=srt://{srthost}:{port}" for port in external_audio_ports ]
-
-            spectrogramm = """audiotee. ! queue name=q3 ! audioconvert ! audioresample ! 
-                spectrascope ! videoconvert ! autovideosink name=fbaudioend sync=false"""
-            audiosinkout = """
-                audiotee. ! queue name=q2 ! audioconvert ! audioresample !
-                    volume volume=1 name=onoffvol ! volume volume=1 name=fbvolume ! 
-                        autoaudiosink sync=false ts-offset=-2000000000 name=asink                
-            """
-            template = f"""
-                liveadder latency=0 name=mix ! audioconvert ! queue name=q4 ! tee name=audiotee 
-                {spectrogramm}
-                {audiosinkout}
-            """
-            for i in range(self.guest_channels_count):
-                template += f"""
-                    srtsrc {guests_srturi[i]} do-timestamp=true latency={srtlatency} wait-for-connection=true ! 
-                        {audioparser} ! {audiodecoder} ! volume volume=1 name=guest_volume{i} ! queue name=qi{i} ! mix.
-                """
-            for i in range(self.external_channels_count):
-                template += f"""
-                    srtsrc {externals_srturi[i]} do-timestamp=true latency={srtlatency} wait-for-connection=true ! 
-                        {audioparser} ! {audiodecoder} ! volume volume=1 name=external_volume{i} ! queue name=qe{i} ! mix.
-                """
-            
-
-            self.fast_feedback_pipeline = Gst.parse_launch(template)
-            qs = [ self.fast_feedback_pipeline.get_by_name(qname) for qname in [
-                "q2", "q3", "q0", "q4"
-            ] +
-            [ f"qi{i}" for i in range(10) ] +
-            [ f"qe{i}" for i in range(10) ]
-            ]
-            for q in qs:
-                pipeline_utils.setup_queuee(q)
-
-            self.guest_volumes = [ self.fast_feedback_pipeline.get_by_name(f"guest_volume{i}") for i in range(self.guest_channels_count) ]
-            self.external_volumes = [ self.fast_feedback_pipeline.get_by_name(f"external_volume{i}") for i in range(self.external_channels_count) ]
-                    
             bus = self.fast_feedback_pipeline.get_bus()
             bus.add_signal_watch()
+            self.levels.attach(bus)
             bus.enable_sync_message_emission()
             bus.connect('sync-message::element', self.on_sync_message)
             self.fast_feedback_pipeline.set_state(Gst.State.PLAYING)      
@@ -510,20 +518,41 @@ class GuestCaller(QWidget):
                 if name=="fbaudioend":
                     self.feedback_spectroscope_widget.connect_to_sink(msg.src)
         
+    def set_previews_active(self, active):
+        """ Предпросмотр выключается, пока вкладка гостя скрыта. """
+        with self.mtx:
+            self.monitors_active = active
+            for pipeline in (self.common_pipeline, self.feedback_pipeline, self.fast_feedback_pipeline):
+                set_monitors_active(pipeline, active)
+
+    def poll_congestion(self):
+        with self.mtx:
+            if self.congestion is None or self.common_pipeline is None:
+                return
+            try:
+                self.congestion.poll()
+            except Exception:
+                traceback.print_exc()
+
     def stop_common_stream(self):
         with self.mtx:
+            self.congestion = None
+            self.keyframes = None
+            Instrumentation.instance().unregister("guest.common")
             if self.common_pipeline:
                 self.common_pipeline.set_state(Gst.State.NULL)
             self.common_pipeline = None
 
     def stop_feedback_stream(self):
         with self.mtx:
+            Instrumentation.instance().unregister("guest.feedback")
             if self.feedback_pipeline:
                 self.feedback_pipeline.set_state(Gst.State.NULL)
             self.feedback_pipeline = None        
 
     def stop_fast_feedback_stream(self):
         with self.mtx:
+            Instrumentation.instance().unregister("guest.feedback_audio")
             if self.fast_feedback_pipeline:
                 self.fast_feedback_pipeline.set_state(Gst.State.NULL)
             self.fast_feedback_pipeline = None        
@@ -531,17 +560,17 @@ class GuestCaller(QWidget):
     def enable_disable_video_input(self):
         with self.mtx:
             if self.viden is True:
-                self.videosrc.set_state(Gst.State.NULL)           
-                #self.fakevideosrc.set_state(Gst.State.PLAYING)
+                pipeline_utils.activate_chain(self.slate_chain)
+                self.videoselector.set_property("active-pad",
+                    self.videoselector.get_static_pad("sink_1"))
+                pipeline_utils.deactivate_chain([ self.videosrc ])
                 self.viden = False  
-                self.vcompose_sink_0.set_property("alpha", 0)       
-                self.vcompose_sink_1.set_property("alpha", 1)
                 self.video_enable_button.setText(self.VIDEO_ENABLE_TEXT)            
             else:
-                self.videosrc.set_state(Gst.State.PLAYING)            
-                #self.fakevideosrc.set_state(Gst.State.NULL)            
-                self.vcompose_sink_0.set_property("alpha", 1)       
-                self.vcompose_sink_1.set_property("alpha", 0)  
+                pipeline_utils.activate_chain([ self.videosrc ])
+                self.videoselector.set_property("active-pad",
+                    self.videoselector.get_static_pad("sink_0"))
+                pipeline_utils.deactivate_chain(self.slate_chain)
                 self.video_enable_button.setText(self.VIDEO_DISABLE_TEXT)
                 self.viden = True
 
@@ -581,10 +610,3 @@ class GuestCaller(QWidget):
             self.stop_feedback_stream()
             self.stop_fast_feedback_stream()
             self.IMMITATION_FLAG = False
-
-    def set_mixer_volumes(self, guests, externals):
-        for i in range(len(guests)):
-            self.guest_volumes[i].set_property("volume", guests[i])
-
-        for i in range(len(externals)):
-            self.external_volumes[i].set_property("volume", externals[i])
\ No newline at end of file
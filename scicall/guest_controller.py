@@ -6,30 +6,26 @@ from gi.repository import GObject, Gst, GstVideo
 import traceback
 import time
 
-from scicall.display_widget import GstreamerDisplay
+from scicall.display_widget import GstreamerDisplay, ShmPreviewDisplay, audio_display
 import scicall.pipeline_utils as pipeline_utils
 import json
 import threading
 
 from scicall.ports import *
+from scicall.gpu_checker import GPUChecker
 from scicall.external_signals import ExternalSignalPanel
 from scicall.external_signals import ExternalSignalsZone
+from scicall.station_pipeline import StationChannelPipeline
+from scicall.mix_minus import MixMinusPipeline
+from scicall.qt_control import QtControlServer
+from scicall.control_plane import ChannelRouter
+from scicall.handshake import StationHandshake, HandshakeState
+from scicall.srt_stats import AdaptiveLatency, SRT_POLL_INTERVAL
+from scicall.shm_preview import available as shm_preview_available
 
-class Server(QTcpServer):
-    def __init__(self):
-        super().__init__()
-
-    def writeData(self, socket, data):
-        socket.writeData(data)
+DEFAULT_RECORD_DIR = "recordings"
 
-    def incomingConnection(self, socket):
-        self.sock = QTcpSocket()
-        print(socket)
-        self.sock.setSocketDescriptor(socket)
-        
 class ConnectionController(QWidget):
-    write_socket_data = pyqtSignal(QTcpSocket, bytes)
-
     def __init__(self, number, zone):
         super().__init__()
         self.mtx = threading.RLock()
@@ -37,29 +33,51 @@ class ConnectionController(QWidget):
         self.extvid = None
         self.audio_appsrcs = []
         self.zone = zone
-        self.flow_runned = False
         self.audio_feedback_checkboxes = []
         self.video_connected = False
         self.audio_connected = False
         self.runned = False
         self.channelno = number
-        self.display = GstreamerDisplay()
-        self.spectroscope = GstreamerDisplay()
+        self.stream = StationChannelPipeline(number)
+        self.stream.on_lost = self.on_stream_lost
+        self.stream.on_keyframe_needed = self.request_guest_keyframe
+        if zone.shm_preview:
+            self.display = ShmPreviewDisplay(self.stream.monitor_name())
+        else:
+            self.display = GstreamerDisplay()
+        self.spectroscope = audio_display(self.stream.audio_level)
         self.feedback_spectroscope = GstreamerDisplay() 
         self.layout = QHBoxLayout()
         self.clients = []
-        self.server = Server()
-        self.write_socket_data.connect(self.server.writeData, Qt.QueuedConnection)
-        self.server.newConnection.connect(self.on_server_new_connect)
+        self.handshake = StationHandshake(
+            send=self.send_to_opposite,
+            schedule=QTimer.singleShot,
+            prepare_feedback=self.prepare_feedback,
+            on_ready=self.on_handshake_ready,
+            on_failed=self.on_handshake_failed)
+        self.handshake_status = "нет"
         self.listener = None
 
         #self.cb_get_vmix_srt = QCheckBox("Забирать ndi(видео)")
         self.cb_ndi_output = QCheckBox("Конвертировать в ndi поток")
         self.cb_ndi_output.setChecked(True)
+        self.cb_ndi_output.stateChanged.connect(self.update_consumers)
+        self.cb_preview = QCheckBox("Предпросмотр")
+        self.cb_preview.setChecked(True)
+        self.cb_preview.stateChanged.connect(self.update_consumers)
+        self.previews_visible = True
+        self.cb_record = QCheckBox("Запись")
+        self.cb_record.setChecked(zone.record_dir is not None)
+        self.cb_record.stateChanged.connect(self.update_recording)
 
         self.common_channel_cb = QCheckBox("Прямой канал:")
         self.feedback_channel_cb = QCheckBox("Обратный канал:")
         self.srtlatency_edit = QLineEdit("80")
+        self.cb_adaptive_latency = QCheckBox("Адаптивная задержка srt")
+        self.adaptive = None
+        self.srt_timer = QTimer()
+        self.srt_timer.timeout.connect(self.poll_srt)
+        self.srt_timer.start(SRT_POLL_INTERVAL * 1000)
         self.common_channel_cb.setChecked(True)
         self.feedback_channel_cb.setChecked(True)
 
@@ -78,10 +96,13 @@ class ConnectionController(QWidget):
         self.make_checkboxes_for_sound_feedback()          
         self.control_layout.addWidget(QLabel("srt latency:"))   
         self.control_layout.addWidget(self.srtlatency_edit)
+        self.control_layout.addWidget(self.cb_adaptive_latency)
         self.control_layout.addStretch()
 
         #self.control_layout2.addWidget(self.cb_get_vmix_srt)
         self.control_layout2.addWidget(self.cb_ndi_output)
+        self.control_layout2.addWidget(self.cb_preview)
+        self.control_layout2.addWidget(self.cb_record)
         self.control_layout2.addStretch()
 
         self.layout.addWidget(self.display)
@@ -103,7 +124,6 @@ class ConnectionController(QWidget):
 
         self.common_pipeline=None
         self.feedback_pipeline=None
-        self.sample_controller=None
         self.feedback_pipeline_started = False
 
     def get_audioend(self):
@@ -117,24 +137,31 @@ class ConnectionController(QWidget):
 
     def make_checkboxes_for_sound_feedback(self):
         self.volume_retrans_audio = []
-        for i in range(3):
+        self.volume_external_audio = []
+        self.volume_layout = QGridLayout()
+        columns = 4
+        for i in range(self.zone.guests_count()):
             wdg = QCheckBox("Ретранс. звука: " + str(i+1))
             if self.channelno != i: wdg.setChecked(True)
-            self.control_layout.addWidget(wdg)
+            self.volume_layout.addWidget(wdg, i // columns, i % columns)
             self.audio_feedback_checkboxes.append(wdg)
             self.volume_retrans_audio.append(wdg)
             wdg.stateChanged.connect(self.update_volume_helper)
-        extwdg = QCheckBox("Внешн. звук ")
-        self.control_layout.addWidget(extwdg)
-        self.audio_feedback_checkboxes.append(extwdg)
-        self.volume_external_audio = extwdg
-        extwdg.stateChanged.connect(self.update_volume_helper)
+        row = (self.zone.guests_count() + columns - 1) // columns
+        for i in range(self.zone.externals_count()):
+            extwdg = QCheckBox("Внешн. звук: " + str(i+1))
+            self.volume_layout.addWidget(extwdg, row + i // columns, i % columns)
+            self.audio_feedback_checkboxes.append(extwdg)
+            self.volume_external_audio.append(extwdg)
+            extwdg.stateChanged.connect(self.update_volume_helper)
+        self.control_layout.addLayout(self.volume_layout)
 
     def update_volume_helper(self):
         self.update_volume()
 
     def update_volume(self):
-        self.send_volumes_instruction()
+        self.zone.mixer.set_volumes(
+            self.channelno, self.guest_volumes_array(), self.external_volumes_array())
 
     def guest_volumes_array(self):
         arr = []
@@ -146,124 +173,131 @@ class ConnectionController(QWidget):
 
     def external_volumes_array(self):
         arr = []
-        extenabled = self.volume_external_audio.isChecked()
-        extvolume = 1 if extenabled else 0
-        arr.append(extvolume)
+        for i in range(len(self.volume_external_audio)):
+            extenabled = self.volume_external_audio[i].isChecked()
+            extvolume = 1 if extenabled else 0
+            arr.append(extvolume)
         return arr
 
-    def send_volumes_instruction(self):
-        dct = {
-            "cmd" : "set_volumes",
-            "guest_channels" : self.guest_volumes_array(),
-            "external_channels" : self.external_volumes_array()
-        }
-        self.send_to_opposite(dct)
-        
     def sound_feedback_list(self):
         ret=[]
-        for i in range(3):
-            if self.audio_feedback_checkboxes[i].isChecked():
+        for i in range(len(self.volume_retrans_audio)):
+            if self.volume_retrans_audio[i].isChecked():
                 ret.append(i)
         return ret
 
     def update_info(self):
         self.need_update = False
         self.infowdg.setText(f"""
-Контрольный порт: {self.control_port()}
+Контрольный порт: {self.zone.control_port}
+Гость: {self.handshake_status}
 Имя ndi потока: {self.ndi_name()}
 srt порты взаимодействия с клиентом:
 вход видео: {channel_mpeg_stream_port(self.channelno)}
 вход аудио:{channel_mpeg_stream_port(self.channelno)+1}
-выход видео:{channel_feedback_mpeg_stream_port(self.channelno)}
-выход аудио:{channel_feedback_mpeg_stream_port(self.channelno)+1}
+выход видео (общий):{external_feedback_video_port(0)}
+выход аудио:{channel_feedback_audio_port(self.channelno)}
 """)
 
-    def control_port(self):
-        return channel_control_port(self.channelno)
+    def is_busy(self):
+        return len(self.clients) != 0
 
-    def on_server_new_connect(self):
-        print("STATION: on_server_connect", self.channelno, self.clients)
-        client = self.server.nextPendingConnection()
-        client = self.server.sock
+    def attach(self, session):
+        print("STATION: guest connected", self.channelno, session.peer)
+        self.clients.append(session)
+        self.adaptive = None
+        if self.cb_adaptive_latency.isChecked():
+            self.adaptive = AdaptiveLatency(self.get_srt_latency())
+        self.handshake_status = "подключается"
+        self.update_info()
+        self.handshake.start(self.get_srt_latency(),
+            common=self.common_channel_cb.isChecked(),
+            feedback=self.feedback_channel_cb.isChecked())
 
-        if len(self.clients) == 0:
-            client.readyRead.connect(self.client_ready_read)
-            client.disconnected.connect(self.client_disconnected)
-            self.clients.append(client)
-            self.send_to_opposite({"cmd": "hello_from_server"})
-            self.create_keepaliver()
-        else:
-            dct = {"cmd": "client_collision"}
-            client.writeData((json.dumps(dct) + "\n").encode("utf-8"))
-            client.close()
+    def on_handshake_ready(self):
+        self.handshake_status = "подключён"
+        self.update_info()
 
-    def create_keepaliver(self):
-        self.keepaliver = QTimer(self)
-        self.keepaliver.timeout.connect(self.keepalive_handler)
-        self.keepaliver.setInterval(1500)
-        self.keepaliver.start()
+    def on_handshake_failed(self, state, reason):
+        """ Гость не прошёл рукопожатие: соединение закрывается, и
+            client_disconnected перезапускает приём канала для следующего гостя.
+            Канал остаётся зарегистрированным на управляющем порту. """
+        self.handshake_status = f"рукопожатие не удалось ({state.value}: {reason})"
+        self.update_info()
+        for session in self.clients:
+            self.zone.control_server.close_session(session)
 
-    def keepalive_handler(self):
-        self.send_to_opposite({"cmd": "keepalive", "ch": self.channelno+1})
+    def poll_srt(self):
+        """ Опрос статистики приёма, при необходимости - смена задержки. """
+        if self.adaptive is None or not self.handshake.is_ready():
+            return
+        if not self.cb_adaptive_latency.isChecked():
+            return
+        new = self.adaptive.update(self.stream.srt_stats().get("video"))
+        if new is not None and new != self.get_srt_latency():
+            self.renegotiate_latency(new)
+
+    def renegotiate_latency(self, srtlatency):
+        print("STATION: channel", self.channelno, "srtlatency -->", srtlatency)
+        self.srtlatency_edit.setText(str(srtlatency))
+        self.handshake.reset()
+        self.stop_common_stream()
+        self.start_common_stream()
+        self.handshake.start(srtlatency,
+            common=self.common_channel_cb.isChecked(),
+            feedback=self.feedback_channel_cb.isChecked())
+
+    def request_guest_keyframe(self, reason):
+        self.send_to_opposite({"cmd": "request_keyframe", "reason": reason})
+
+    def on_stream_lost(self, reason):
+        if self.clients:
+            self.stream.restart_sources(reason)
 
     def restart_button_handle(self):
         self.send_to_opposite({"cmd": "remote_restart"})
 
     def start_control_server(self):
-        port = channel_control_port(self.channelno)
-        self.server.listen(QHostAddress("0.0.0.0"), port)
+        self.zone.router.register(self.channelno, self)
         
-    def client_disconnected(self):
+    def client_disconnected(self, session):
+        if session not in self.clients:
+            return
         print("STATION : guest_disconnected")
+        if self.handshake.state != HandshakeState.FAILED:
+            self.handshake_status = "нет"
+            self.update_info()
         self.clients.clear()
-        self.stop_streams()
-        self.keepaliver.stop()
-        self.keepaliver = None
-
-    def client_ready_read(self):
-        client = self.clients[0]
-        while client.bytesAvailable():
-            rawdata = client.readLineData(1024).decode("utf-8")
-            data = json.loads(rawdata)
-            self.new_opposite_command(data)
-
-    def new_opposite_command(self, data):
+        self.handshake.reset()
+        self.adaptive = None
+        if self.runned:
+            self.restart_streams()
+        else:
+            self.stop_streams()
+
+    def new_opposite_command(self, session, data):
+        if session not in self.clients:
+            return
         cmd = data["cmd"]        
         if cmd == "keepalive":
             pass
 
-        elif cmd == "hello_from_guest":
-            self.send_to_opposite({"cmd": "set_srtlatency", "data": self.get_srt_latency()})
-            time.sleep(0.2)
-
-            if self.common_channel_cb.isChecked():
-                #self.start_common_stream()
-                self.send_to_opposite({"cmd": "start_common_stream"})
-
-            time.sleep(0.2)
-
-            if self.feedback_channel_cb.isChecked():
-                self.send_to_opposite({
-                    "cmd": "start_feedback_stream",
-                    "count_of_guests" : 3,
-                    "count_of_externals" : 1
-                })
-                self.send_volumes_instruction()
-                self.zone.start_restart_feedback_streams()
+        elif cmd == "ack":
+            self.handshake.on_ack(data)
+        elif cmd == "request_keyframe":
+            self.zone.external_zone.request_feedback_keyframe()
         else:
             print("unresolved command")        
 
     def send_to_opposite(self, dct):
         if len(self.clients) == 0:
             return
-        client = self.clients[0]
-        client.writeData((json.dumps(dct) + "\n").encode("utf-8"))
-        client.flush()
+        self.zone.control_server.send(self.clients[0], dct)
 
     def stop_control_server(self):
-        for c in self.clients:
-            c.close()
-        self.server.close()
+        self.zone.router.unregister(self.channelno)
+        for session in self.clients:
+            self.zone.control_server.close_session(session)
 
     def enable_disable_clicked(self):
         try:
@@ -272,13 +306,11 @@ srt порты взаимодействия с клиентом:
                 self.stop_control_server()
                 self.enable_disable_button.setText("Включить канал")
                 self.runned = False
-                self.cb_ndi_output.setEnabled(True)
             else:
                 self.start_control_server()
                 self.start_common_stream()
                 self.enable_disable_button.setText("Отключить канал")
                 self.runned = True
-                self.cb_ndi_output.setEnabled(False)
             self.update_info()
         except Exception as ex:
             traceback.print_exc()
@@ -288,73 +320,51 @@ srt порты взаимодействия с клиентом:
             msgBox.exec()
         
     def ndi_name(self):
-        return f"Guest{self.channelno+1}-AudioVideo"
+        return self.stream.ndi_name()
 
     def get_gpu_type(self):
         return self.zone.get_gpu_type()
 
     def start_common_stream(self):
-        videodecoder = pipeline_utils.video_decoder_type(self.get_gpu_type())
-        videocoder = pipeline_utils.video_coder_type(self.get_gpu_type())
-        srtport = channel_mpeg_stream_port(self.channelno)
-        audio_mirror_port = channel_audio_mirror_port(self.channelno)
-        srtlatency = self.get_srt_latency()
-
-        audiocaps = pipeline_utils.global_audiocaps()
-        udpspam = internal_channel_audio_udpspam_port(self.channelno)
-
-        ndisink = f"ndisink ndi-name={self.ndi_name()}"
-        if not self.cb_ndi_output.isChecked():
-            ndisink = "fakesink"
+        self.stream.start(
+            gputype=self.get_gpu_type(),
+            srtlatency=self.get_srt_latency(),
+            sync_handler=self.on_sync_message)
+        self.common_pipeline = self.stream.pipeline
+        self.update_recording()
+        self.update_consumers()
+
+    def update_consumers(self):
+        """ Декодирование на станции идёт только для подключенных потребителей.
+            Предпросмотр скрытой вкладки отключается вместе с декодером. """
+        preview = self.cb_preview.isChecked() and self.previews_visible
+        self.stream.set_consumer("ndi", self.cb_ndi_output.isChecked())
+        if self.zone.shm_preview:
+            self.stream.set_consumer("shm_preview", preview)
+            self.display.set_active(preview)
+        else:
+            self.stream.set_consumer("video_preview", preview)
+        self.stream.set_consumer("audio_preview", preview)
 
-        audioparser = pipeline_utils.default_audioparser()
-        audiodecoder = pipeline_utils.default_audiodecoder()
+    def set_previews_active(self, active):
+        self.previews_visible = active
+        if self.stream.is_running():
+            self.update_consumers()
 
-        self.common_pipeline = Gst.parse_launch(
-            f"""srtsrc uri=srt://:{srtport} wait-for-connection=true latency={srtlatency} 
-                    ! queue name=q0 ! h264parse ! {videodecoder} ! tee name=t1 
+    def update_recording(self):
+        if self.cb_record.isChecked():
+            self.stream.set_recording(self.zone.record_dir or DEFAULT_RECORD_DIR)
+        else:
+            self.stream.set_recording(None)
 
-            srtsrc uri=srt://:{srtport+1} wait-for-connection=true latency={srtlatency} ! 
-            queue name=q2 ! tee name=opusin ! {audioparser} ! {audiodecoder}
-             ! audioconvert ! audioresample !  tee name=t2 
-            
-            t1. ! queue name=qt0 ! videoconvert ! autovideosink sync=false name=videoend
-            t2. ! queue name=qt1 !audioconvert ! spectrascope ! videoconvert ! 
-                autovideosink sync=false name=audioend
-
-            t1. ! queue ! videoconvert ! combiner.
-            t2. ! queue ! audioconvert ! audioresample ! combiner.
-            ndisinkcombiner name=combiner ! {ndisink} 
-
-            opusin. ! queue name=qt5 ! srtsink uri=srt://:{audio_mirror_port} wait-for-connection=false latency={srtlatency}
-        """)
-        qs = [ self.common_pipeline.get_by_name(qname) for qname in [
-            "q0", "q2", "qt0", "qt1", "qt2", "qt3", "qt4", "qt5"
-        ]]
-        for q in qs:
-            pipeline_utils.setup_queuee(q)
-
-        self.last_sample = time.time()
-        self.bus = self.common_pipeline.get_bus()
-        self.bus.add_signal_watch()
-        self.bus.enable_sync_message_emission()
-        self.bus.connect('sync-message::element', self.on_sync_message)
-        self.common_pipeline.set_state(Gst.State.PLAYING)
-
-    def feedback_videoport(self):
-        return channel_feedback_mpeg_stream_port(self.channelno)
+    def prepare_feedback(self):
+        return {"videoport": self.zone.external_zone.feedback_videoport()}
         
     def stop_common_stream(self):
         with self.mtx:
-            if self.common_pipeline:
-                self.common_pipeline.set_state(Gst.State.NULL)
-            time.sleep(0.1)
+            self.stream.stop()
             self.common_pipeline = None
 
-            if self.sample_controller:
-               self.sample_controller.stop()
-            self.sample_controller = None
-
     def on_sync_message(self, bus, msg):
         """Биндим контрольное изображение к переданному снаружи виджету."""
         #pass
@@ -378,31 +388,52 @@ srt порты взаимодействия с клиентом:
     def stop_streams(self):
         with self.mtx:
             self.stop_common_stream()
+
+    def restart_streams(self):
+        """ Приём канала заново, для следующего гостя. """
+        with self.mtx:
+            self.stop_common_stream()
+            self.start_common_stream()
             
     def is_connected(self):
         with self.mtx:
             return self.common_pipeline is not None
 
 class ConnectionControllerZone(QWidget):
-    def __init__(self):
-        self.feedback_stream_stoped = True
+    def __init__(self, guests_count=3, externals_count=1, control_port=STATION_CONTROL_PORT,
+            record_dir=None, shm_preview=False):
+        validate_port_map(guests_count, externals_count)
+        self.record_dir = record_dir
+        self.shm_preview = shm_preview and shm_preview_available()
+        if shm_preview and not self.shm_preview:
+            print("STATION: shared memory preview is not available, using window previews")
+        self._guests_count = guests_count
+        self._externals_count = externals_count
         self.mtx = threading.RLock()
         super().__init__()
+        self.control_port = control_port
+        self.router = ChannelRouter()
+        self.control_server = QtControlServer()
+        self.control_server.message.connect(self.on_control_message)
+        self.control_server.session_closed.connect(self.on_control_closed)
+        self.control_server.listen("0.0.0.0", control_port)
         self.zones = []
         self.vlayout = QVBoxLayout()
         self.hlayout = QHBoxLayout()
-        self.gpuchecker = pipeline_utils.GPUChecker()
+        self.gpuchecker = GPUChecker()
         self.hlayout.addStretch()
         self.hlayout.addWidget(QLabel("Использовать аппаратное ускорение: "))
         self.hlayout.addWidget(self.gpuchecker)
         self.vlayout.addLayout(self.hlayout)
         
-        for i in range(3):
+        for i in range(self.guests_count()):
             self.add_zone(i, self)
             self.zones[-1].enable_disable_clicked()
             self.zones[-1].enable_disable_button.setEnabled(False)
 
-        self.external_zone = ExternalSignalsZone(self)
+        self.external_zone = ExternalSignalsZone(self, self.externals_count())
+        self.mixer = MixMinusPipeline(self.guests_count(), self.externals_count())
+        self.mixer.start()
         
         self.vlayout.addWidget(self.external_zone)
         for wdg in self.zones:
@@ -416,33 +447,38 @@ class ConnectionControllerZone(QWidget):
     def get_gpu_type(self):
         return self.gpuchecker.get()
 
+    def guests_count(self):
+        return self._guests_count
+
+    def externals_count(self):
+        return self._externals_count
+
+    def on_control_message(self, session, data):
+        channel = self.router.channel_of(session)
+        if channel:
+            channel.new_opposite_command(session, data)
+        elif data.get("cmd") == "hello_from_guest":
+            channel, refusal = self.router.route(session, data)
+            if channel is None:
+                print("STATION: refuse guest", session.peer, refusal["cmd"])
+                self.control_server.send_and_close(session, refusal)
+                return
+            channel.attach(session)
+
+    def on_control_closed(self, session):
+        channel = self.router.forget(session)
+        if channel:
+            channel.client_disconnected(session)
+
+    def set_previews_active(self, active):
+        for wdg in self.zones:
+            wdg.set_previews_active(active)
+        self.external_zone.set_previews_active(active)
+
     def add_zone(self, i, zone):
         wdg = ConnectionController(i, zone)
         self.zones.append(wdg)
         
-    def restart_feedback_streams(self):
-        with self.mtx:
-            self.feedback_stream_stoped = True
-            self.external_zone.stop_streams()
-            QTimer.singleShot(20, self.restart_feedback_streams_part2)
-
-    def get_feedback_video_ports(self):
-        ports = []
-        for z in self.zones:
-            if z.is_connected():
-                ports.append(z.feedback_videoport())
-        return ports
-
-    def restart_feedback_streams_part2(self):
-        with self.mtx:
-            ports = self.get_feedback_video_ports()
-            self.external_zone.start_global_streams(ports)
-            self.feedback_stream_stoped = False
-            
-    def start_restart_feedback_streams(self):
-        with self.mtx:
-            QTimer.singleShot(2, self.restart_feedback_streams)
-
     def get_audioends(self):
         return [ z.get_audioend() for z in self.zones ]
 
@@ -0,0 +1,126 @@
+""" Рукопожатие станции с гостем.
+
+hello_from_guest --> set_srtlatency --> start_common_stream --> start_feedback_stream
+
+Каждый следующий шаг отправляется только после подтверждения ("ack")
+предыдущего, вместо слепых пауз. Если подтверждение не пришло за
+отведённое время, рукопожатие считается проваленным.
+
+Машина состояний не зависит от цикла событий: отправка сообщений и
+таймеры передаются снаружи (QTimer в интерфейсе, asyncio на сервере).
+"""
+
+import time
+from enum import Enum
+
+
+class HandshakeState(str, Enum):
+    IDLE = "idle"
+    LATENCY = "set_srtlatency"
+    COMMON = "start_common_stream"
+    FEEDBACK = "start_feedback_stream"
+    READY = "ready"
+    FAILED = "failed"
+
+
+def ack(of, ok=True, **kwargs):
+    """ Подтверждение, которым гость отвечает на шаг рукопожатия. """
+    dct = {"cmd": "ack", "of": of, "ok": ok}
+    dct.update(kwargs)
+    return dct
+
+
+class StationHandshake:
+    """ Станционная сторона рукопожатия.
+
+        @send(dct) - отправка сообщения гостю.
+        @schedule(ms, fn) - однократный таймер.
+        @prepare_feedback() - вызывается перед start_feedback_stream, чтобы
+            станция уже раздавала обратный поток, когда гость к нему подключится.
+            Может вернуть словарь полей, добавляемых в start_feedback_stream
+            (например, порт видео обратного канала).
+    """
+
+    def __init__(self, send, schedule, prepare_feedback=None,
+            on_ready=None, on_failed=None, timeout=3000):
+        self.send = send
+        self.schedule = schedule
+        self.prepare_feedback = prepare_feedback
+        self.on_ready = on_ready
+        self.on_failed = on_failed
+        self.timeout = timeout
+        self.state = HandshakeState.IDLE
+        self.token = 0
+        self.started = None
+        self.common = True
+        self.feedback = True
+
+    def is_ready(self):
+        return self.state == HandshakeState.READY
+
+    def reset(self):
+        self.token += 1
+        self.state = HandshakeState.IDLE
+
+    def start(self, srtlatency, common=True, feedback=True):
+        self.common = common
+        self.feedback = feedback
+        self.started = time.time()
+        self.step(HandshakeState.LATENCY, {"cmd": "set_srtlatency", "data": srtlatency})
+
+    def step(self, state, dct):
+        self.state = state
+        self.token += 1
+        token = self.token
+        self.send(dct)
+        self.schedule(self.timeout, lambda: self.on_timeout(token))
+
+    def next_after_latency(self):
+        if self.common:
+            self.step(HandshakeState.COMMON, {"cmd": "start_common_stream"})
+        else:
+            self.next_after_common()
+
+    def next_after_common(self):
+        if self.feedback:
+            dct = {"cmd": "start_feedback_stream"}
+            if self.prepare_feedback:
+                dct.update(self.prepare_feedback() or {})
+            self.step(HandshakeState.FEEDBACK, dct)
+        else:
+            self.finish()
+
+    def finish(self):
+        self.token += 1
+        self.state = HandshakeState.READY
+        print("STATION: handshake done in", int((time.time() - self.started) * 1000), "ms")
+        if self.on_ready:
+            self.on_ready()
+
+    def fail(self, reason):
+        self.token += 1
+        failed_state = self.state
+        self.state = HandshakeState.FAILED
+        print("STATION: handshake failed on", failed_state.value, ":", reason)
+        if self.on_failed:
+            self.on_failed(failed_state, reason)
+
+    def on_timeout(self, token):
+        if token != self.token:
+            return
+        self.fail("timeout")
+
+    def on_ack(self, data):
+        """ Обрабатывает подтверждение гостя. Подтверждения не текущего шага игнорируются. """
+        if data.get("of") != self.state.value:
+            return
+        if not data.get("ok", True):
+            self.fail(data.get("error", "guest error"))
+            return
+
+        if self.state == HandshakeState.LATENCY:
+            self.next_after_latency()
+        elif self.state == HandshakeState.COMMON:
+            self.next_after_common()
+        elif self.state == HandshakeState.FEEDBACK:
+            self.finish()
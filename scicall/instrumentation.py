@@ -0,0 +1,362 @@
+""" Измерение задержек и пропускной способности конвееров.
+
+Конвееры регистрируются при запуске и снимаются при остановке. Для каждого
+собирается:
+    - кадры в секунду и битрейт веток (буферная проба на паде)
+    - задержка ветки: время прохождения буфера с данным pts между двумя падами
+    - заполненность, переполнения и потери очередей (queue_policy.QueueStats)
+    - статистика srt соединений: rtt, потери, повторы, полоса (srt_stats)
+    - уровень звука веток с индикатором (level_meter)
+    - задержка, заявленная конвеером (запрос latency), и оценка задержки
+      "от стекла до стекла": заявленная задержка + задержка srt
+
+Снимок метрик раз в несколько секунд пишется в json файл и отдаётся по http:
+/metrics в текстовом формате prometheus, /json - тот же снимок в json.
+
+Пробы ставятся только если измерения включены (--metrics-port или
+--metrics-dump), иначе регистрация ничего не стоит.
+
+Конвееры из других процессов (каналы станции в отдельных процессах)
+присылают готовые снимки, они публикуются через publish().
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from gi.repository import Gst
+
+from scicall.srt_stats import read_stats
+
+LATENCY_SAMPLES = 100
+MAX_PENDING_PTS = 256
+
+
+class FlowMeter:
+    """ Кадры (буферы) и байты, прошедшие через пад.
+
+        Частота и битрейт считаются от предыдущего снимка того же
+        потребителя (@consumer): http и периодическая запись в файл не
+        сбрасывают окно друг другу.
+    """
+
+    def __init__(self, pad):
+        self.pad = pad
+        self.buffers = 0
+        self.bytes = 0
+        self.mtx = threading.Lock()
+        self.started = time.monotonic()
+        self.last = {}
+        self.probe = pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+
+    def on_buffer(self, pad, info):
+        self.buffers += 1
+        self.bytes += info.get_buffer().get_size()
+        return Gst.PadProbeReturn.OK
+
+    def snapshot(self, consumer=None):
+        now = time.monotonic()
+        buffers, bytes = self.buffers, self.bytes
+        with self.mtx:
+            last_time, last_buffers, last_bytes = self.last.get(consumer, (self.started, 0, 0))
+            self.last[consumer] = (now, buffers, bytes)
+        dt = max(now - last_time, 1e-3)
+        return {
+            "fps": round((buffers - last_buffers) / dt, 2),
+            "kbps": round((bytes - last_bytes) * 8 / dt / 1000, 1),
+            "buffers": buffers,
+            "bytes": bytes,
+        }
+
+    def detach(self):
+        self.pad.remove_probe(self.probe)
+
+
+class BranchLatency:
+    """ Время прохождения буфера между двумя падами, сопоставление по pts. """
+
+    def __init__(self, enter_pad, exit_pad):
+        self.enter_pad = enter_pad
+        self.exit_pad = exit_pad
+        # Пробы входа и выхода работают в разных потоках.
+        self.mtx = threading.Lock()
+        self.pending = OrderedDict()
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+        self.enter_probe = enter_pad.add_probe(Gst.PadProbeType.BUFFER, self.on_enter)
+        self.exit_probe = exit_pad.add_probe(Gst.PadProbeType.BUFFER, self.on_exit)
+
+    def on_enter(self, pad, info):
+        pts = info.get_buffer().pts
+        if pts != Gst.CLOCK_TIME_NONE:
+            with self.mtx:
+                if len(self.pending) > MAX_PENDING_PTS:
+                    self.pending.popitem(last=False)
+                self.pending[pts] = time.monotonic()
+        return Gst.PadProbeReturn.OK
+
+    def on_exit(self, pad, info):
+        with self.mtx:
+            entered = self.pending.pop(info.get_buffer().pts, None)
+        if entered is not None:
+            self.samples.append(time.monotonic() - entered)
+        return Gst.PadProbeReturn.OK
+
+    def snapshot(self):
+        samples = list(self.samples)
+        if not samples:
+            return { "avg_ms": None, "max_ms": None }
+        return {
+            "avg_ms": round(sum(samples) / len(samples) * 1000, 2),
+            "max_ms": round(max(samples) * 1000, 2),
+        }
+
+    def detach(self):
+        self.enter_pad.remove_probe(self.enter_probe)
+        self.exit_pad.remove_probe(self.exit_probe)
+
+
+def pipeline_latency(pipeline):
+    """ Задержка, заявленная элементами живого конвеера, в мс. """
+    query = Gst.Query.new_latency()
+    if not pipeline.query(query):
+        return None
+    live, minimum, maximum = query.parse_latency()
+    if not live:
+        return None
+    return minimum / Gst.MSECOND
+
+
+class PipelineMonitor:
+    def __init__(self, name, pipeline, queue_stats=None, srtlatency=0, enabled=True):
+        self.name = name
+        self.pipeline = pipeline
+        self.queue_stats = queue_stats
+        self.srtlatency = srtlatency
+        self.enabled = enabled
+        self.flows = {}
+        self.latencies = {}
+        self.srt = {}
+        self.levels = {}
+
+    def watch_srt(self, branch, element):
+        """ Статистика srt читается по запросу, проб не требует. """
+        if element is not None:
+            self.srt[branch] = element
+
+    def unwatch_srt(self, branch):
+        self.srt.pop(branch, None)
+
+    def watch_level(self, branch, tracker, name):
+        """ Уровень читается из LevelTracker конвеера, проб не требует. """
+        self.levels[branch] = (tracker, name)
+
+    def watch_flow(self, branch, element, padname="src"):
+        if not self.enabled or element is None:
+            return
+        self.flows[branch] = FlowMeter(element.get_static_pad(padname))
+
+    def watch_latency(self, branch, enter_element, exit_element,
+            enter_padname="sink", exit_padname="sink"):
+        if not self.enabled or enter_element is None or exit_element is None:
+            return
+        self.latencies[branch] = BranchLatency(
+            enter_element.get_static_pad(enter_padname),
+            exit_element.get_static_pad(exit_padname))
+
+    def snapshot(self, consumer=None):
+        reported = pipeline_latency(self.pipeline)
+        return {
+            "flows": { branch: meter.snapshot(consumer) for branch, meter in self.flows.items() },
+            "latency": { branch: meter.snapshot() for branch, meter in self.latencies.items() },
+            "queues": self.queue_stats.snapshot() if self.queue_stats else {},
+            "srt": { branch: read_stats(element) for branch, element in list(self.srt.items()) },
+            "levels": { branch: level_numbers(tracker.get(name))
+                for branch, (tracker, name) in list(self.levels.items()) },
+            "pipeline_latency_ms": reported,
+            "glass_to_glass_estimate_ms":
+                None if reported is None else reported + self.srtlatency,
+        }
+
+    def detach(self):
+        for meter in list(self.flows.values()) + list(self.latencies.values()):
+            meter.detach()
+        self.flows = {}
+        self.latencies = {}
+        self.srt = {}
+        self.levels = {}
+
+
+def level_numbers(level):
+    if level is None:
+        return None
+    return { "rms_db": [ round(v, 1) for v in level["rms"] ],
+        "peak_db": [ round(v, 1) for v in level["peak"] ] }
+
+
+class Instrumentation:
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if Instrumentation._instance is None:
+            Instrumentation._instance = Instrumentation()
+        return Instrumentation._instance
+
+    def __init__(self):
+        self.mtx = threading.RLock()
+        self.enabled = False
+        self.monitors = {}
+        self.remote = {}
+        self.http = None
+
+    def register(self, name, pipeline, queue_stats=None, srtlatency=0):
+        """ Регистрирует конвеер. Конвеер с тем же именем заменяется. """
+        with self.mtx:
+            self.unregister(name)
+            monitor = PipelineMonitor(name, pipeline, queue_stats, srtlatency, self.enabled)
+            self.monitors[name] = monitor
+            return monitor
+
+    def monitor(self, name):
+        with self.mtx:
+            return self.monitors.get(name)
+
+    def unregister(self, name):
+        with self.mtx:
+            monitor = self.monitors.pop(name, None)
+            if monitor:
+                monitor.detach()
+
+    def publish(self, name, snapshot):
+        """ Снимок конвеера, измеренного в другом процессе. """
+        with self.mtx:
+            self.remote[name] = snapshot
+
+    def withdraw(self, name):
+        with self.mtx:
+            self.remote.pop(name, None)
+
+    def snapshot(self, consumer=None):
+        """ @consumer - кто читает снимок, у каждого своё окно частот (FlowMeter). """
+        with self.mtx:
+            monitors = list(self.monitors.values())
+            result = dict(self.remote)
+        for monitor in monitors:
+            try:
+                result[monitor.name] = monitor.snapshot(consumer)
+            except Exception as ex:
+                result[monitor.name] = { "error": str(ex) }
+        return { "time": time.time(), "pipelines": result }
+
+    def prometheus(self, consumer="http"):
+        return prometheus_text(self.snapshot(consumer))
+
+    def start_dump(self, path, interval):
+        def loop():
+            while True:
+                time.sleep(interval)
+                tmp = path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(self.snapshot("dump"), f, indent=1)
+                os.replace(tmp, path)
+        threading.Thread(target=loop, daemon=True).start()
+
+    def start_http(self, port):
+        instrumentation = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics"):
+                    body = instrumentation.prometheus().encode("utf-8")
+                    ctype = "text/plain; version=0.0.4"
+                elif self.path.startswith("/json"):
+                    body = json.dumps(instrumentation.snapshot("json")).encode("utf-8")
+                    ctype = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.http = Server(("0.0.0.0", port), Handler)
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+        print("metrics: http://0.0.0.0:%d/metrics" % port)
+
+
+def label(**kwargs):
+    return ",".join('%s="%s"' % (k, str(v).replace('"', "'")) for k, v in kwargs.items())
+
+
+def prometheus_text(snapshot):
+    lines = []
+
+    def metric(name, value, **labels):
+        if value is not None:
+            lines.append("scicall_%s{%s} %s" % (name, label(**labels), value))
+
+    for pname, p in snapshot["pipelines"].items():
+        if "error" in p:
+            continue
+        metric("pipeline_latency_ms", p["pipeline_latency_ms"], pipeline=pname)
+        metric("glass_to_glass_estimate_ms", p["glass_to_glass_estimate_ms"], pipeline=pname)
+        for branch, flow in p["flows"].items():
+            metric("fps", flow["fps"], pipeline=pname, branch=branch)
+            metric("bitrate_kbps", flow["kbps"], pipeline=pname, branch=branch)
+            metric("buffers_total", flow["buffers"], pipeline=pname, branch=branch)
+        for branch, lat in p["latency"].items():
+            metric("branch_latency_avg_ms", lat["avg_ms"], pipeline=pname, branch=branch)
+            metric("branch_latency_max_ms", lat["max_ms"], pipeline=pname, branch=branch)
+        for qname, q in p["queues"].items():
+            metric("queue_fill", q["fill"], pipeline=pname, queue=qname, kind=q["kind"])
+            metric("queue_level_ms", q["time_ms"], pipeline=pname, queue=qname, kind=q["kind"])
+            metric("queue_overruns_total", q["overruns"], pipeline=pname, queue=qname, kind=q["kind"])
+            metric("queue_drops_total", q["drops"], pipeline=pname, queue=qname, kind=q["kind"])
+        for branch, srt in p["srt"].items():
+            if not srt:
+                continue
+            metric("srt_rtt_ms", srt["rtt_ms"], pipeline=pname, branch=branch)
+            metric("srt_latency_ms", srt["latency_ms"], pipeline=pname, branch=branch)
+            metric("srt_bandwidth_mbps", srt["bandwidth_mbps"], pipeline=pname, branch=branch)
+            metric("srt_rate_mbps", srt["rate_mbps"], pipeline=pname, branch=branch)
+            metric("srt_lost_total", srt["lost"], pipeline=pname, branch=branch)
+            metric("srt_retransmitted_total", srt["retransmitted"], pipeline=pname, branch=branch)
+            metric("srt_dropped_total", srt["dropped"], pipeline=pname, branch=branch)
+            metric("srt_callers", srt["callers"], pipeline=pname, branch=branch)
+        for branch, level in p.get("levels", {}).items():
+            if not level:
+                continue
+            for channel, (rms, peak) in enumerate(zip(level["rms_db"], level["peak_db"])):
+                metric("audio_rms_db", rms, pipeline=pname, branch=branch, channel=channel)
+                metric("audio_peak_db", peak, pipeline=pname, branch=branch, channel=channel)
+    return "\n".join(lines) + "\n"
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics-port", type=int, default=0,
+        help="порт http с метриками конвееров (/metrics, /json)")
+    parser.add_argument("--metrics-dump", default=None,
+        help="файл, в который периодически пишется снимок метрик в json")
+    parser.add_argument("--metrics-interval", type=float, default=5)
+
+
+def setup_from_args(args):
+    instrumentation = Instrumentation.instance()
+    instrumentation.enabled = bool(args.metrics_port or args.metrics_dump)
+    if args.metrics_port:
+        instrumentation.start_http(args.metrics_port)
+    if args.metrics_dump:
+        instrumentation.start_dump(args.metrics_dump, args.metrics_interval)
+    return instrumentation
@@ -108,7 +108,6 @@ class Interaptor(QObject):
     Это позволяет перехватывать стандартный вывод в подчинённых процессах и перенаправлять его на встроенную консоль.
     """
     INSTANCE = None
-    srt_disconnect = pyqtSignal()
 
     @classmethod
     def instance(cls):            
@@ -123,7 +122,6 @@ class Interaptor(QObject):
         self.do_retrans(old_file=stdout, new_desc=new_desc)
         self.prevent_mode = False
         self.newdata_stream = None
-        self.last_disconnect = time.time()
         #register_destructor(id(self), self.stop_listen)
 
     def set_communicator(self, comm):
@@ -141,10 +139,6 @@ class Interaptor(QObject):
 
     def newdata_handler(self, inputdata):
         self.new_file.write(inputdata)
-        if " srtlib epoll.cpp:903:update_events: : epoll/update: IPE: update struck" in inputdata:
-            if time.time() - self.last_disconnect > 0.5:
-                self.srt_disconnect.emit()
-            self.last_disconnect = time.time()
         # TODO: Стандартизировать варианты обработки.
         #if self.without_wrap:
         #else:
@@ -0,0 +1,57 @@
+""" Ключевой кадр по запросу для подключившихся посреди потока.
+
+Новый получатель не может декодировать поток до ближайшего IDR, а кодер
+с длинной группой кадров присылает его через секунды. Поэтому при
+подключении получателя (caller-added у слушающего srtsink) или по
+управляющей команде request_keyframe кодеру отправляется событие
+force-key-unit.
+
+Кэшировать и досылать последний IDR отдельному абоненту общий srtsink
+не позволяет, поэтому заголовки SPS/PPS вставляются h264parse
+config-interval=-1 перед каждым IDR, и первый же вынужденный ключевой
+кадр самодостаточен.
+"""
+
+import time
+
+from gi.repository import Gst, GstVideo
+
+MIN_KEYFRAME_INTERVAL = 0.5
+
+# Ограничение группы кадров на случай потерянного запроса, в кадрах.
+KEYFRAME_MAX_DISTANCE = 60
+
+
+class KeyframeRequester:
+    """ Отправляет кодеру @encoder запрос ключевого кадра не чаще, чем раз
+        в @min_interval секунд: подключение нескольких гостей разом даёт
+        один ключевой кадр, а не серию. """
+
+    def __init__(self, encoder, min_interval=MIN_KEYFRAME_INTERVAL):
+        self.encoder = encoder
+        self.min_interval = min_interval
+        self.last = None
+
+    def request(self, reason=None):
+        now = time.monotonic()
+        if self.last is not None and now - self.last < self.min_interval:
+            return False
+        self.last = now
+        event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        print("KEYFRAME: request", self.encoder.get_name(), reason or "")
+        return self.encoder.get_static_pad("src").send_event(event)
+
+
+def encoder_with_gop(videocoder):
+    """ Описание кодера с ограниченной группой кадров. """
+    if videocoder.startswith("x264enc"):
+        return f"{videocoder} key-int-max={KEYFRAME_MAX_DISTANCE}"
+    if videocoder.startswith(("nvh264enc", "openh264enc")):
+        return f"{videocoder} gop-size={KEYFRAME_MAX_DISTANCE}"
+    if videocoder.startswith("vah264enc"):
+        return f"{videocoder} key-int-max={KEYFRAME_MAX_DISTANCE}"
+    if videocoder.startswith("vaapih264enc"):
+        return f"{videocoder} keyframe-period={KEYFRAME_MAX_DISTANCE}"
+    if videocoder.startswith("v4l2h264enc"):
+        return f'{videocoder} extra-controls="controls,video_gop_size={KEYFRAME_MAX_DISTANCE}"'
+    return videocoder
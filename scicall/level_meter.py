@@ -0,0 +1,75 @@
+""" Измерение уровня звука для индикаторов.
+
+Вместо audioconvert ! spectrascope ! videoconvert ! autovideosink, где
+ради признака "звук есть" считается бпф и рисуются кадры видео, в ветвь
+ставится элемент level: он раз в LEVEL_INTERVAL присылает на шину
+сообщение со среднеквадратичным и пиковым уровнем каналов в дБ.
+LevelTracker собирает последние значения по шине, индикатор интерфейса
+(display_widget.LevelMeter) и метрики читают их как числа.
+
+Сообщения принимаются синхронным обработчиком шины на потоке конвеера:
+цикл GLib для этого не нужен (в интерфейсе Qt его может не быть).
+
+Спектроскоп остаётся доступен по --spectrascope (см. monitor_profile).
+"""
+
+import threading
+import time
+
+LEVEL_INTERVAL = 100
+LEVEL_FLOOR = -60
+
+MS = 1000000
+
+
+def level_elements(name, interval=LEVEL_INTERVAL):
+    """ Описания ветви индикатора для GraphBuilder.chain. """
+    return [ "audioconvert",
+        f"level name={name} interval={interval * MS} post-messages=true",
+        "fakesink sync=false async=false" ]
+
+
+def level_values(structure, field):
+    value = structure.get_value(field)
+    if value is None:
+        return []
+    return [ max(float(v), LEVEL_FLOOR) for v in value ]
+
+
+class LevelTracker:
+    """ Последние уровни элементов level по сообщениям шин.
+
+        Значения: { "rms": [дБ по каналам], "peak": [...], "time": monotonic }.
+    """
+
+    def __init__(self):
+        self.mtx = threading.Lock()
+        self.levels = {}
+
+    def attach(self, bus):
+        bus.enable_sync_message_emission()
+        bus.connect("sync-message::element", self.on_message)
+
+    def on_message(self, bus, msg):
+        structure = msg.get_structure()
+        if structure is None or structure.get_name() != "level":
+            return
+        level = {
+            "rms": level_values(structure, "rms"),
+            "peak": level_values(structure, "peak"),
+            "time": time.monotonic(),
+        }
+        with self.mtx:
+            self.levels[msg.src.get_name()] = level
+
+    def get(self, name, max_age=1):
+        """ Уровень элемента @name или None, если сообщений давно не было. """
+        with self.mtx:
+            level = self.levels.get(name)
+        if level is None or time.monotonic() - level["time"] > max_age:
+            return None
+        return level
+
+    def forget(self, name):
+        with self.mtx:
+            self.levels.pop(name, None)
@@ -0,0 +1,158 @@
+""" Определение наличия потока без опроса каждого буфера.
+
+Проба на паде взводится один раз за интервал и снимается первым же
+буфером (PadProbeReturn.REMOVE), так что python вызывается не чаще раза
+в интервал, а не на каждый кадр. Если за интервал проба не сработала,
+поток считается потерянным.
+
+Дополнительно поток считается потерянным сразу:
+    - по сигналу caller-removed слушающего srt элемента
+    - по EOS или ошибке элемента конвеера на шине
+caller-added перевзводит пробу, чтобы новое соединение было замечено
+в ближайший интервал.
+
+Проба взводится из потока цикла, а срабатывает на потоке конвеера,
+поэтому словарь проб и флаг seen меняются под замком, а проба снимается
+из словаря, только если это та самая проба (info.id).
+
+Колбэки вызываются в контексте GLib: цикл GLib станции, в интерфейсе Qt -
+его диспетчер или qt_glib.GlibPump.
+"""
+
+import threading
+from enum import Enum
+
+from gi.repository import GLib, Gst
+
+DEFAULT_TIMEOUT = 1000
+
+
+class Liveness(str, Enum):
+    WAITING = "waiting"
+    ALIVE = "alive"
+    LOST = "lost"
+
+
+class LivenessMonitor:
+    """ @timeout - интервал в мс, за который должен пройти хотя бы один буфер.
+        @on_alive() - поток появился.
+        @on_lost(reason) - поток пропал: "timeout", "caller-removed", "eos", "error".
+    """
+
+    def __init__(self, name, timeout=DEFAULT_TIMEOUT, on_alive=None, on_lost=None):
+        self.name = name
+        self.timeout = timeout
+        self.on_alive = on_alive
+        self.on_lost = on_lost
+        self.state = Liveness.WAITING
+        self.pads = []
+        self.mtx = threading.Lock()
+        self.probes = {}
+        self.seen = False
+        self.handlers = []
+        self.bus_elements = None
+        self.timer = None
+
+    def watch_pad(self, pad):
+        self.pads.append(pad)
+
+    def watch_srt(self, element):
+        """ Сигналы соединения слушающего srtsrc/srtsink. """
+        self.handlers.append((element, element.connect("caller-added", self.on_caller_added)))
+        self.handlers.append((element, element.connect("caller-removed", self.on_caller_removed)))
+
+    def watch_bus(self, bus, elements=None):
+        """ @elements - чьи ошибки учитывать; по умолчанию все. """
+        self.bus_elements = elements
+        self.handlers.append((bus, bus.connect("message::eos", self.on_eos)))
+        self.handlers.append((bus, bus.connect("message::error", self.on_error)))
+
+    def start(self):
+        self.state = Liveness.WAITING
+        self.arm()
+        self.timer = GLib.timeout_add(self.timeout, self.on_timer)
+
+    def stop(self):
+        if self.timer is not None:
+            GLib.source_remove(self.timer)
+            self.timer = None
+        self.disarm()
+        for obj, handler in self.handlers:
+            obj.disconnect(handler)
+        self.handlers = []
+
+    def arm(self):
+        # Замок держится, пока id пробы не сохранён: проба, сработавшая
+        # сразу после add_probe, ждёт его в on_buffer.
+        with self.mtx:
+            self.seen = False
+            for pad in self.pads:
+                if pad not in self.probes:
+                    self.probes[pad] = pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+
+    def disarm(self):
+        with self.mtx:
+            probes, self.probes = self.probes, {}
+        for pad, probe in probes.items():
+            pad.remove_probe(probe)
+
+    def on_buffer(self, pad, info):
+        with self.mtx:
+            self.seen = True
+            if self.probes.get(pad) == info.id:
+                del self.probes[pad]
+        return Gst.PadProbeReturn.REMOVE
+
+    def on_timer(self):
+        with self.mtx:
+            seen = self.seen
+        if seen:
+            if self.state != Liveness.ALIVE:
+                self.set_alive()
+        elif self.state == Liveness.ALIVE:
+            self.set_lost("timeout")
+        self.arm()
+        return True
+
+    def set_alive(self):
+        self.state = Liveness.ALIVE
+        print("LIVENESS:", self.name, "alive")
+        if self.on_alive:
+            self.on_alive()
+
+    def set_lost(self, reason):
+        if self.state == Liveness.LOST:
+            return
+        self.state = Liveness.LOST
+        print("LIVENESS:", self.name, "lost:", reason)
+        if self.on_lost:
+            self.on_lost(reason)
+
+    # Сигналы srt приходят из его собственного потока.
+    def on_caller_added(self, element, *args):
+        GLib.idle_add(self.rearm)
+
+    def on_caller_removed(self, element, *args):
+        GLib.idle_add(self.lost_from_signal, "caller-removed")
+
+    def rearm(self):
+        self.arm()
+        return False
+
+    def lost_from_signal(self, reason):
+        if self.state == Liveness.ALIVE:
+            self.set_lost(reason)
+        return False
+
+    def is_own(self, msg):
+        if not self.bus_elements:
+            return True
+        return any(msg.src is el or msg.src.has_as_ancestor(el) for el in self.bus_elements)
+
+    def on_eos(self, bus, msg):
+        if self.is_own(msg):
+            self.set_lost("eos")
+
+    def on_error(self, bus, msg):
+        if self.is_own(msg):
+            self.set_lost("error")
@@ -0,0 +1,175 @@
+""" Главное окно интерфейса станции и гостя. """
+
+import traceback
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+from scicall.util import get_filtered_devices_list, start_device_monitor, stop_device_monitor
+from scicall.guest_caller import GuestCaller
+from scicall.guest_controller import ConnectionController, ConnectionControllerZone
+
+
+class GstreamerDisplay(QWidget):
+    """ Виджет, в котором рисует выходной элемент видоконвеера """
+
+    def __init__(self):
+        super().__init__()
+        self.winid = self.winId()
+        palette = QPalette()
+        palette.setColor(QPalette.Window, Qt.black)
+        self.setAutoFillBackground(True)
+        self.setPalette(palette)
+
+    def connect_to_sink(self, source):
+        source.set_window_handle(self.winid)
+
+
+class WorkZone(QWidget):
+    """ Контроллер одного потока.
+
+            @mediatype - определяет тип контроллера - аудио/видео.
+    """
+
+    def __init__(self, mediatype):
+        super().__init__()
+
+        if mediatype == MediaType.VIDEO:
+            self.display = GstreamerDisplay()
+        else:
+            self.display = GstreamerDisplay()
+
+        self.control_panel = ControlPanel(mediatype)
+        self.pipeline = StreamPipeline(self.display)
+        self.main_layout = QHBoxLayout()
+        self.main_layout.addWidget(self.display)
+        self.main_layout.addWidget(self.control_panel)
+        self.setLayout(self.main_layout)
+        self.control_panel.enable_disable_button.clicked.connect(
+            self.enable_disable_clicked)
+
+        captures = get_filtered_devices_list(mediatype)
+        self.control_panel.set_devices_list(captures)
+
+    def enable_disable_clicked(self):
+        """ По активации кнопки происходит компиляция данных панели управления и
+                запускается строительство конвеера. Деактивация уничтожает конвеер.
+        """
+
+        if self.pipeline.runned():
+            self.control_panel.unfreeze()
+            self.stop_pipeline()
+        else:
+            self.control_panel.freeze()
+            self.setup_pipeline()
+
+    def setup_pipeline(self):
+        input_settings = self.control_panel.input_settings()
+        translation_settings = self.control_panel.translation_settings()
+        display_settings = self.control_panel.display_settings()
+        try:
+            self.pipeline.make_pipeline(
+                input_settings, translation_settings, display_settings)
+            self.pipeline.setup()
+            self.pipeline.start()
+        except Exception as ex:
+            traceback.print_exc()
+            msgBox = QMessageBox()
+            msgBox.setText("Запуск конвеера привёл к исключению:\r\n" +
+                           traceback.format_exc())
+            msgBox.exec()
+
+    def stop_pipeline(self):
+        try:
+            self.pipeline.stop()
+        except Exception as ex:
+            traceback.print_exc()
+            msgBox = QMessageBox()
+            msgBox.setText("Остановка конвеера привела к исключению:\r\n" +
+                           traceback.format_exc())
+            msgBox.exec()
+
+
+class MultiWorkZone(QWidget):
+    """Рабочая зона состоит из набора однотпных пар аудио/видео контроллеров"""
+
+    def __init__(self):
+        super().__init__()
+        self.zones = []
+        self.layout = QHBoxLayout()
+        self.setLayout(self.layout)
+
+    def add_zone(self):
+        zone_video = WorkZone(MediaType.VIDEO)
+        zone_audio = WorkZone(MediaType.AUDIO)
+        peer_layout = QVBoxLayout()
+        peer_layout.addWidget(zone_video)
+        peer_layout.addWidget(zone_audio)
+        self.zones.append(zone_video)
+        self.zones.append(zone_audio)
+        self.layout.addLayout(peer_layout)
+
+class ExpertWidget(QWidget):
+    def __init__(self):
+        super().__init__()
+        self.workzone = MultiWorkZone()
+        self.workzone.add_zone()
+        self.workzone.add_zone()
+        self.layout = QVBoxLayout()
+        self.layout.addWidget(self.workzone)
+        self.setLayout(self.layout)
+
+class Container(QWidget):
+    def __init__(self, wdg):
+        super().__init__()    
+        self.vlayout = QVBoxLayout()
+        self.hlayout = QHBoxLayout()
+        self.hlayout.addStretch()
+        self.hlayout.addWidget(wdg)
+        self.hlayout.addStretch()
+        self.vlayout.addStretch()
+        self.vlayout.addLayout(self.hlayout)
+        self.vlayout.addStretch()
+        self.setLayout(self.vlayout)
+
+
+class CentralWidget(QTabWidget):
+    need_resize = pyqtSignal()
+
+    def __init__(self, args):
+        super().__init__()    	
+        self.userwdg1 = GuestCaller(guests_count=args.channels, control_port=args.control_port)
+        self.stantionwdg= ConnectionControllerZone(
+            guests_count=args.channels, externals_count=args.externals,
+            control_port=args.control_port, record_dir=args.record,
+            shm_preview=args.shm_preview)
+        #self.experwdg = ExpertWidget()
+        self.addTab(Container(self.userwdg1), "Гость")
+        self.addTab(Container(self.stantionwdg), "Сервер")
+        #self.addTab(Container(self.experwdg), "Тестовый")
+        if args.pause_hidden_previews:
+            self.currentChanged.connect(self.update_previews)
+            self.update_previews()
+
+    def update_previews(self):
+        """ Предпросмотр рисуется только на видимой вкладке. """
+        self.userwdg1.set_previews_active(self.currentIndex() == 0)
+        self.stantionwdg.set_previews_active(self.currentIndex() == 1)
+
+class MainWindow(QMainWindow):
+    """Главное окно"""
+
+    def __init__(self, args):
+        super().__init__()
+        
+        start_device_monitor()  # Монитор необходим, чтобы работали запросы списков устройств
+        self.cw = CentralWidget(args)
+        stop_device_monitor()
+
+        self.setCentralWidget(self.cw)
+        self.cw.need_resize.connect(self.need_resize_handle)
+
+    def need_resize_handle(self):
+        self.setFixedSize(self.minimumSizeHint())
+        self.adjustSize()
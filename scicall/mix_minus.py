@@ -0,0 +1,131 @@
+from gi.repository import GObject, Gst
+import threading
+
+import scicall.pipeline_utils as pipeline_utils
+from scicall.ports import *
+from scicall.pipeline_builder import GraphBuilder
+from scicall.queue_policy import QueueKind, QueueStats
+from scicall.instrumentation import Instrumentation
+
+
+def internal_rtp_opus_caps():
+    return "application/x-rtp,media=audio,encoding-name=OPUS,clock-rate=48000,payload=96"
+
+
+def internal_audio_out_template(port):
+    """ Отправка закодированного opus в микшер станции по локальному udp. """
+    return f"rtpopuspay pt=96 ! udpsink host=127.0.0.1 port={port} sync=false async=false"
+
+
+class MixMinusPipeline:
+    """ Микшер станции "N минус один".
+
+        Звук каждого гостя и каждого внешнего источника декодируется один раз
+        и попадает в свой канал общего многоканального потока (audiointerleave).
+        Смесь для гостя i - одна строка матрицы audiomixmatrix: громкости
+        остальных гостей и внешних источников, собственный голос гостя с
+        нулевым весом. Смесь кодируется один раз и отправляется гостю одним
+        srt потоком.
+
+        Схема:
+            тишина, in{j}, ext{e} --> interleave --> mixed
+            mixed --> out{i} --> mix{i} (строка i матрицы) --> opusenc --> srtsink
+
+        Ветвей и потоков на гостя - по одной, а не по одной на пару гостей.
+    """
+
+    def __init__(self, guests_count, externals_count, srtlatency=80):
+        self.mtx = threading.RLock()
+        self.guests_count = guests_count
+        self.externals_count = externals_count
+        self.srtlatency = srtlatency
+        self.pipeline = None
+        self.bus = None
+        self.stats = QueueStats()
+        self.guest_volumes = [ [ 0 ] * guests_count for i in range(guests_count) ]
+        self.external_volumes = [ [ 0 ] * externals_count for i in range(guests_count) ]
+
+    def channels(self):
+        """ Каналы общего потока: тишина, гости, внешние источники. """
+        return 1 + self.guests_count + self.externals_count
+
+    def matrix_row(self, i):
+        row = [ 0 ]
+        row += [ 0 if j == i else self.guest_volumes[i][j] for j in range(self.guests_count) ]
+        row += self.external_volumes[i]
+        return "<<" + ", ".join(f"(float){float(v)}" for v in row) + ">>"
+
+    def build_input(self, b, interleave, channel, port):
+        audiocaps = pipeline_utils.global_audiocaps()
+        audiodecoder = pipeline_utils.default_audiodecoder()
+        _, last = b.chain(f"udpsrc port={port} caps={internal_rtp_opus_caps()}",
+            "rtpjitterbuffer latency=20", "rtpopusdepay", audiodecoder,
+            "audioconvert", "audioresample", audiocaps)
+        b.link(last, interleave, sinkpad=f"sink_{channel}")
+
+    def build_output(self, b, i, mixed):
+        audiocaps = pipeline_utils.global_audiocaps()
+        audioencoder = pipeline_utils.default_audioencoder()
+        srtport = channel_feedback_audio_port(i)
+
+        matrix = b.add(f"audiomixmatrix mode=manual in-channels={self.channels()} out-channels=1",
+            f"mix{i}")
+        Gst.util_set_object_arg(matrix, "matrix", self.matrix_row(i))
+        b.chain(mixed, b.queue(QueueKind.AUDIO, f"out{i}"), matrix, "audioconvert", audiocaps,
+            audioencoder,
+            f"srtsink uri=srt://:{srtport} wait-for-connection=false latency={self.srtlatency} name=srtout{i}")
+
+    def build(self):
+        self.stats = QueueStats()
+        b = GraphBuilder(stats=self.stats)
+        audiocaps = pipeline_utils.global_audiocaps()
+        interleave = b.add("audiointerleave channel-positions-from-input=false", "interleave")
+        mixed = b.add("tee name=mixed")
+        b.link(interleave, mixed)
+
+        # Тишина держит поток смесей, пока никто не подключён.
+        _, silence = b.chain("audiotestsrc is-live=true wave=silence", audiocaps)
+        b.link(silence, interleave, sinkpad="sink_0")
+        for j in range(self.guests_count):
+            self.build_input(b, interleave, 1 + j, internal_channel_audio_udpspam_port(j))
+        for e in range(self.externals_count):
+            self.build_input(b, interleave, 1 + self.guests_count + e,
+                internal_external_audio_udpspam_port(e))
+        for i in range(self.guests_count):
+            self.build_output(b, i, mixed)
+        pipeline = b.build()
+
+        monitor = Instrumentation.instance().register("mixer", pipeline, self.stats, self.srtlatency)
+        for i in range(self.guests_count):
+            monitor.watch_flow(f"mix{i+1}", b.get(f"out{i}"))
+            monitor.watch_srt(f"mix{i+1}", b.get(f"srtout{i}"))
+        return pipeline
+
+    def start(self):
+        with self.mtx:
+            if not self.guests_count:
+                return
+            self.pipeline = self.build()
+            self.bus = self.pipeline.get_bus()
+            self.bus.add_signal_watch()
+            self.pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self):
+        with self.mtx:
+            Instrumentation.instance().unregister("mixer")
+            if self.pipeline:
+                self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline = None
+            self.bus = None
+
+    def set_volumes(self, target, guests, externals):
+        """ Громкости, с которыми гость @target слышит остальных гостей
+            и внешние источники. Собственный голос гостя в смесь не входит. """
+        with self.mtx:
+            for j, vol in enumerate(guests[:self.guests_count]):
+                self.guest_volumes[target][j] = vol
+            for e, vol in enumerate(externals[:self.externals_count]):
+                self.external_volumes[target][e] = vol
+            if self.pipeline:
+                Gst.util_set_object_arg(self.pipeline.get_by_name(f"mix{target}"),
+                    "matrix", self.matrix_row(target))
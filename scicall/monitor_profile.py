@@ -0,0 +1,101 @@
+""" Профили ветвей предпросмотра.
+
+Предпросмотр рисуется в виджеты на 160-320 точек, а кадры источников
+идут с полной частотой и размером, и композитинг интерфейса стоил
+дороже самой маршрутизации. Поэтому ветви предпросмотра строятся одним
+помощником: кадры прореживаются videorate до частоты профиля и
+уменьшаются до перевода цвета, спектроскоп рисует столько кадров и
+такого размера, сколько покажет виджет.
+
+    full   - полная частота и размер источника
+    normal - 320x240, 10 кадров в секунду
+    low    - 160x120, 5 кадров в секунду
+
+Звук по умолчанию показывается индикатором уровня (level_meter), ветвь
+спектроскопа строится только с SPECTRASCOPE (--spectrascope).
+
+Первым в ветви стоит valve: предпросмотр скрытой вкладки интерфейса
+выключается целиком (set_monitors_active), очередь и отрисовка ветви
+при этом простаивают.
+"""
+
+from scicall.queue_policy import QueueKind
+from scicall.level_meter import level_elements
+
+
+class MonitorProfile:
+    def __init__(self, width=None, height=None, fps=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+
+    def video_caps(self):
+        fields = []
+        if self.width:
+            fields += [ f"width={self.width}", f"height={self.height}" ]
+        if self.fps:
+            fields.append(f"framerate={self.fps}/1")
+        return ",".join([ "video/x-raw" ] + fields) if fields else None
+
+
+PROFILES = {
+    "full": MonitorProfile(),
+    "normal": MonitorProfile(320, 240, 10),
+    "low": MonitorProfile(160, 120, 5),
+}
+
+DEFAULT_PROFILE = "normal"
+SPECTRASCOPE = False
+
+VALVE_PREFIX = "monitorvalve_"
+
+
+def current_profile():
+    return PROFILES[DEFAULT_PROFILE]
+
+
+def valve(b, queue_name, active=True):
+    drop = "false" if active else "true"
+    return b.add(f"valve drop={drop}", VALVE_PREFIX + queue_name)
+
+
+def video_monitor(b, queue_name, sink, active=True, profile=None):
+    """ Элементы ветви предпросмотра видео для GraphBuilder.chain после тройника.
+        @sink - описание выходного элемента, например "autovideosink name=videoend". """
+    profile = profile or current_profile()
+    items = [ valve(b, queue_name, active), b.queue(QueueKind.PREVIEW, queue_name) ]
+    if profile.fps:
+        items.append("videorate drop-only=true")
+    if profile.width:
+        items.append("videoscale")
+    items.append("videoconvert")
+    caps = profile.video_caps()
+    if caps:
+        items.append(caps)
+    items.append(sink)
+    return items
+
+
+def audio_monitor(b, queue_name, sink, level, active=True, profile=None):
+    """ Ветвь индикатора уровня с элементом level по имени @level, либо, при
+        SPECTRASCOPE, ветвь спектроскопа с окном @sink. Размер и частота
+        кадров спектроскопа - по профилю. """
+    items = [ valve(b, queue_name, active), b.queue(QueueKind.PREVIEW, queue_name) ]
+    if not SPECTRASCOPE:
+        return items + level_elements(level)
+    profile = profile or current_profile()
+    items += [ "audioconvert", "spectrascope" ]
+    caps = profile.video_caps()
+    if caps:
+        items.append(caps)
+    items += [ "videoconvert", sink ]
+    return items
+
+
+def set_monitors_active(container, active):
+    """ Открывает или закрывает все ветви предпросмотра конвеера или bin-а. """
+    if container is None:
+        return
+    for element in container.iterate_recurse():
+        if element.get_name().startswith(VALVE_PREFIX):
+            element.set_property("drop", not active)
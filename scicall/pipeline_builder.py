@@ -0,0 +1,192 @@
+""" Программная сборка конвееров.
+
+Вместо форматирования большого шаблона, Gst.parse_launch и поиска
+очередей по имени конвеер собирается из элементов напрямую:
+
+    b = GraphBuilder()
+    tee = b.add("tee name=videotee")
+    b.chain("videotestsrc is-live=true", "videoconvert", tee)
+    b.chain(tee, "queue name=q0", "x264enc tune=zerolatency", "fakesink")
+    pipeline = b.build()
+
+Описание элемента - имя фабрики и свойства "ключ=значение", строка caps
+("video/x-raw,width=640") становится capsfilter. Описания разбираются один
+раз, фабрики элементов и объекты caps кэшируются между перезапусками.
+Очереди получают профиль своей ветви при создании (см. queue_policy),
+граф проверяется перед PLAYING.
+"""
+
+import shlex
+import threading
+
+from gi.repository import Gst
+
+from scicall.queue_policy import DEFAULT_KIND, apply_profile
+
+_lock = threading.Lock()
+_factories = {}
+_caps = {}
+_specs = {}
+
+
+def element_factory(name):
+    with _lock:
+        factory = _factories.get(name)
+        if factory is None:
+            factory = Gst.ElementFactory.find(name)
+            if factory is None:
+                raise Exception(f"gstreamer element is not available: {name}")
+            _factories[name] = factory
+        return factory
+
+
+def cached_caps(text):
+    with _lock:
+        caps = _caps.get(text)
+        if caps is None:
+            caps = Gst.Caps.from_string(text)
+            if caps is None:
+                raise Exception(f"wrong caps: {text}")
+            _caps[text] = caps
+        return caps
+
+
+def parse_spec(spec):
+    """ "x264enc tune=zerolatency" --> ("x264enc", (("tune", "zerolatency"),)) """
+    with _lock:
+        parsed = _specs.get(spec)
+    if parsed is not None:
+        return parsed
+
+    spec = spec.strip()
+    first = spec.split()[0].split(",")[0]
+    if "/" in first and "=" not in first:
+        parsed = ("capsfilter", (("caps", spec),))
+    else:
+        tokens = shlex.split(spec)
+        props = []
+        for token in tokens[1:]:
+            key, sep, value = token.partition("=")
+            if not sep:
+                raise Exception(f"wrong property '{token}' in '{spec}'")
+            props.append((key, value))
+        parsed = (tokens[0], tuple(props))
+
+    with _lock:
+        _specs[spec] = parsed
+    return parsed
+
+
+def split_chain(text):
+    """ "a ! b ! c" --> ["a", "b", "c"] """
+    return [ part.strip() for part in text.split("!") if part.strip() ]
+
+
+def make_element(spec, name=None):
+    factory_name, props = parse_spec(spec)
+    element = element_factory(factory_name).create(None)
+    if element is None:
+        raise Exception(f"can not create element: {factory_name}")
+    for key, value in props:
+        if key == "name":
+            element.set_name(value)
+        elif key == "caps" and factory_name == "capsfilter":
+            element.set_property("caps", cached_caps(value))
+        else:
+            Gst.util_set_object_arg(element, key, value)
+    if name:
+        element.set_name(name)
+    return element
+
+
+def factory_name(element):
+    factory = element.get_factory()
+    return factory.get_name() if factory else None
+
+
+class GraphBuilder:
+    """ Собирает конвеер или bin из описаний элементов.
+
+        @container - Gst.Pipeline (по умолчанию) или Gst.Bin.
+        @stats - QueueStats, в который регистрируются созданные очереди.
+    """
+
+    def __init__(self, container=None, stats=None):
+        self.container = container or Gst.Pipeline.new(None)
+        self.stats = stats
+        self.elements = []
+
+    def add(self, item, name=None, kind=None):
+        """ Добавляет элемент по описанию или уже созданный элемент.
+            @kind - профиль очереди, если элемент - очередь. """
+        if isinstance(item, str):
+            element = make_element(item, name)
+        else:
+            element = item
+            if name:
+                element.set_name(name)
+        self.container.add(element)
+        self.elements.append(element)
+        if factory_name(element) == "queue":
+            apply_profile(element, kind or DEFAULT_KIND)
+            if self.stats is not None:
+                self.stats.watch(element, kind or DEFAULT_KIND)
+        return element
+
+    def queue(self, kind, name=None):
+        return self.add("queue", name, kind)
+
+    def element(self, item):
+        if isinstance(item, str):
+            return self.add(item)
+        if item.get_parent() is self.container:
+            return item
+        return self.add(item)
+
+    def chain(self, *items):
+        """ Создаёт и последовательно соединяет элементы.
+            Строка с "!" разворачивается в несколько элементов, уже
+            добавленный элемент (например, тройник) просто соединяется. """
+        elements = []
+        for item in items:
+            if isinstance(item, str) and "!" in item:
+                elements += [ self.element(part) for part in split_chain(item) ]
+            else:
+                elements.append(self.element(item))
+        for a, b in zip(elements, elements[1:]):
+            self.link(a, b)
+        return elements[0], elements[-1]
+
+    def link(self, src, dst, srcpad=None, sinkpad=None):
+        if srcpad or sinkpad:
+            ok = src.link_pads(srcpad, dst, sinkpad)
+        else:
+            ok = src.link(dst)
+        if not ok:
+            raise Exception(f"can not link {src.get_name()}:{srcpad or ''} to {dst.get_name()}:{sinkpad or ''}")
+
+    def get(self, name):
+        return self.container.get_by_name(name)
+
+    def ghost(self, ghostname, element, padname):
+        """ Выводит пад элемента наружу bin-а. """
+        pad = element.get_static_pad(padname)
+        self.container.add_pad(Gst.GhostPad.new(ghostname, pad))
+
+    def validate(self):
+        """ Все постоянные пады созданных элементов должны быть соединены. """
+        problems = []
+        for element in self.elements:
+            for pad in element.pads:
+                template = pad.get_pad_template()
+                if template and template.presence != Gst.PadPresence.ALWAYS:
+                    continue
+                if pad.get_peer() is None:
+                    problems.append(f"{element.get_name()}:{pad.get_name()}")
+        if problems:
+            raise Exception("pipeline has unlinked pads: " + ", ".join(problems))
+
+    def build(self):
+        self.validate()
+        return self.container
+
@@ -1,10 +1,8 @@
 from gi.repository import GObject, Gst, GstVideo
 from scicall.util import pipeline_chain
+from scicall.codec_registry import CodecRegistry
 from enum import Enum
-
-from PyQt5.QtWidgets import *
-from PyQt5.QtGui import *
-from PyQt5.QtCore import *
+import threading
 
 class GstSubchain:
     def __init__(self, *arr):
@@ -58,6 +56,79 @@ class GstSubchain:
     def is_enabled(self):
         return self.enabled
 
+def add_branch(pipeline, element):
+    """ Добавляет ветвь в работающий конвеер. Ветвь запускается до того,
+        как к ней будет подключен источник. """
+    pipeline.add(element)
+    element.sync_state_with_parent()
+
+def remove_branch(pipeline, element):
+    """ Удаляет уже отсоединённую ветвь из конвеера. """
+    element.set_state(Gst.State.NULL)
+    if element.get_parent() is pipeline:
+        pipeline.remove(element)
+
+def request_src_pad(element, template="src_%u"):
+    if hasattr(element, "request_pad_simple"):
+        return element.request_pad_simple(template)
+    return element.get_request_pad(template)
+
+class DynamicTee:
+    """ Тройник, к которому ветви подключаются и отключаются без остановки конвеера.
+
+        Отсоединение выполняется idle пробой на выходном паде тройника, то есть в
+        момент, когда через него не идёт буфер. Обработчик завершения вызывается в
+        отдельном потоке, чтобы не выполнять смену состояний из потока данных.
+    """
+
+    def __init__(self, tee):
+        self.tee = tee
+        self.tee.set_property("allow-not-linked", True)
+        self.pads = {}
+
+    def keys(self):
+        return list(self.pads.keys())
+
+    def link(self, key, sinkpad):
+        srcpad = request_src_pad(self.tee)
+        ret = srcpad.link(sinkpad)
+        if ret != Gst.PadLinkReturn.OK:
+            self.tee.release_request_pad(srcpad)
+            raise Exception(f"tee link failed: {ret}")
+        self.pads[key] = srcpad
+        return srcpad
+
+    def unlink(self, key, done=None):
+        srcpad = self.pads.pop(key, None)
+        if srcpad is None:
+            if done:
+                threading.Thread(target=done, daemon=True).start()
+            return
+
+        def on_idle(pad, info):
+            peer = pad.get_peer()
+            if peer:
+                pad.unlink(peer)
+            self.tee.release_request_pad(pad)
+            if done:
+                threading.Thread(target=done, daemon=True).start()
+            return Gst.PadProbeReturn.REMOVE
+
+        srcpad.add_probe(Gst.PadProbeType.IDLE, on_idle)
+
+def activate_chain(elements):
+    """ Возвращает выключенную цепочку в состояние конвеера. """
+    for element in reversed(elements):
+        element.set_locked_state(False)
+        element.sync_state_with_parent()
+
+def deactivate_chain(elements):
+    """ Останавливает цепочку внутри работающего конвеера.
+        Закрытое состояние не даёт конвееру включить её обратно. """
+    for element in elements:
+        element.set_locked_state(True)
+        element.set_state(Gst.State.NULL)
+
 class GPUType(str, Enum):
     AUTOMATIC = "Автоматически",
     CPU = "Нет",
@@ -68,6 +139,8 @@ def video_decoder_type(codertype):
         videodecoder = "avdec_h264" 
     elif codertype == GPUType.NVIDIA:
         videodecoder = "nvh264dec"
+    else:
+        videodecoder = CodecRegistry.instance().decoder()
     return videodecoder 
 
 def video_coder_type(codertype):
@@ -75,49 +148,25 @@ def video_coder_type(codertype):
         videocoder = "x264enc tune=zerolatency" 
     elif codertype == GPUType.NVIDIA:
         videocoder = "nvh264enc"
+    else:
+        videocoder = CodecRegistry.instance().encoder()
     return videocoder
 
 def get_gpu_type():
     return GPUType.NVIDIA
 
-ISNVIDIA = None 
-class GPUChecker(QComboBox):
-    def __init__(self):
-        super().__init__()
-        
-        for a in GPUType:
-            self.addItem(a)
-
-    def automatic(self):
-        global ISNVIDIA
-        if ISNVIDIA is False:
-            return GPUType.CPU
-        if ISNVIDIA is True:
-            return GPUType.NVIDIA
-        try:
-            p = Gst.parse_launch("nvh264enc")
-            p.set_state(Gst.State.PLAYING)
-            p.set_state(Gst.State.NULL)
-            ISNVIDIA=True
-        except Exception as ex:
-            ISNVIDIA=False
-            return GPUType.CPU
-
+def detect_gpu_type():
+    """ Доступность аппаратного кодера nvidia по реестру кодеров. """
+    if CodecRegistry.instance().best_family("encoder") == "nvidia":
         return GPUType.NVIDIA
+    return GPUType.CPU
 
-    def get(self):
-        text = self.currentText()
-        if text == GPUType.AUTOMATIC:
-            return self.automatic()
-        else:
-            return text
-
-    def set(self, type):
-        lst = list(GPUType)
-        for i, o in enumerate(lst):
-            if type == o:
-                self.setCurrentIndex(i)
-
+def gpu_type_from_text(text):
+    """ Автоматический режим остаётся автоматическим: кодер и декодер
+        выбирает реестр (video_coder_type, video_decoder_type). """
+    if text == GPUType.AUTOMATIC:
+        return GPUType.AUTOMATIC
+    return text
 
 def global_videocaps():
     #return "video/x-raw"
@@ -153,21 +202,3 @@ def default_audioencoder():
         return "opusenc frame-size=20 perfect-timestamp=true"
     elif default_audiocodec() == "aac":
         return "faac"
-
-def max_size_bytes(): return 100000
-def max_size_buffers(): return 3
-def max_size_time(): return 0
-def max_threshold_bytes(): return 0
-def max_threshold_buffers(): return 0
-def max_threshold_time(): return 0
-
-def setup_queuee(q):
-    if q is None:
-        return
-    q.set_property("max-size-bytes", max_size_bytes()) 
-    q.set_property("max-size-buffers", max_size_buffers())
-    q.set_property("max-size-time", max_size_time())
-    q.set_property("min-threshold-bytes", max_threshold_bytes()) 
-    q.set_property("min-threshold-buffers", max_threshold_buffers())
-    q.set_property("min-threshold-time", max_threshold_time())
-    q.set_property("silent", True)
\ No newline at end of file
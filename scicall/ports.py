@@ -1,7 +1,12 @@
 PORT_BASE = 20100
-EXTERNAL_PORT_BASE = 20190
+EXTERNAL_PORT_BASE = 19100
 PORTS_BY_CHANNEL = 20
 PORTS_BY_EXTSOURCE = 20
+MAX_PORT = 65535
+
+# Единый управляющий порт станции, каналы различаются номером в hello_from_guest.
+# Совпадает с бывшим управляющим портом первого канала.
+STATION_CONTROL_PORT = PORT_BASE
 
 def channel_video_port(ch):
     return PORT_BASE + ch * PORTS_BY_CHANNEL + 1
@@ -18,17 +23,68 @@ def channel_mpeg_stream_port(ch):
 def channel_feedback_mpeg_stream_port(ch):
     return PORT_BASE + ch * PORTS_BY_CHANNEL + 8
 
-def channel_control_port(ch):
-    return PORT_BASE + ch * PORTS_BY_CHANNEL + 0
-
 def internal_channel_audio_udpspam_port(ch):
     return PORT_BASE + ch * PORTS_BY_CHANNEL + 5
 
 def channel_feedback_audio_port(ch):
     return PORT_BASE + ch * PORTS_BY_CHANNEL + 9
 
-def channel_audio_mirror_port(ch):
-    return PORT_BASE + ch * PORTS_BY_CHANNEL + 10
+def internal_external_audio_udpspam_port(ch):
+    return EXTERNAL_PORT_BASE + ch * PORTS_BY_EXTSOURCE + 5
+
+def channel_ports(ch):
+    """ Все порты, занимаемые каналом гостя. """
+    return [
+        channel_video_port(ch),
+        channel_audio_port(ch),
+        channel_feedback_video_port(ch),
+        internal_channel_audio_udpspam_port(ch),
+        channel_mpeg_stream_port(ch),
+        channel_mpeg_stream_port(ch) + 1,
+        channel_feedback_mpeg_stream_port(ch),
+        channel_feedback_audio_port(ch),
+    ]
+
+def external_feedback_video_port(ch):
+    """ Общий srt порт, с которого видео источника забирают все гости. """
+    return EXTERNAL_PORT_BASE + ch * PORTS_BY_EXTSOURCE + 6
+
+def external_ports(ch):
+    """ Все порты, занимаемые внешним источником. """
+    return [
+        internal_external_audio_udpspam_port(ch),
+        external_feedback_video_port(ch),
+    ]
+
+def max_externals_count():
+    return (PORT_BASE - EXTERNAL_PORT_BASE) // PORTS_BY_EXTSOURCE
+
+def max_guests_count():
+    return (MAX_PORT + 1 - PORT_BASE) // PORTS_BY_CHANNEL
+
+def validate_port_map(guests_count, externals_count):
+    """ Проверяет, что порты всех каналов и внешних источников
+        не пересекаются и лежат в своих блоках. """
+    if guests_count < 1:
+        raise Exception("at least one guest channel is required")
+    if externals_count < 0:
+        raise Exception("count of external sources can not be negative")
+    if guests_count > max_guests_count():
+        raise Exception(f"too many guest channels: {guests_count} > {max_guests_count()}")
+    if externals_count > max_externals_count():
+        raise Exception(f"too many external sources: {externals_count} > {max_externals_count()}")
+
+    owners = { STATION_CONTROL_PORT: "station control" }
+    blocks = (
+        [ (f"guest {ch+1}", channel_ports(ch), PORT_BASE + ch * PORTS_BY_CHANNEL, PORTS_BY_CHANNEL)
+            for ch in range(guests_count) ] +
+        [ (f"external {ch+1}", external_ports(ch), EXTERNAL_PORT_BASE + ch * PORTS_BY_EXTSOURCE, PORTS_BY_EXTSOURCE)
+            for ch in range(externals_count) ])
 
-def external_mirror_audio_port(ch):
-    return PORT_BASE + ch * PORTS_BY_EXTSOURCE + 0
+    for owner, ports, start, size in blocks:
+        for port in ports:
+            if not start <= port < start + size:
+                raise Exception(f"port {port} of {owner} is out of its block {start}-{start+size-1}")
+            if port in owners:
+                raise Exception(f"port {port} of {owner} is already used by {owners[port]}")
+            owners[port] = owner
@@ -0,0 +1,94 @@
+""" Мост между управляющим каналом на asyncio и интерфейсом на Qt.
+
+Сессии живут в потоке ControlLoopThread, события приходят в поток
+интерфейса сигналами (соединение по умолчанию ставит их в очередь),
+а отправка передаётся обратно в цикл через call_soon_threadsafe.
+"""
+
+import asyncio
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from scicall.control_plane import ControlServer, ControlClient, ControlLoopThread
+
+
+class QtControlServer(QObject):
+    session_opened = pyqtSignal(object)
+    message = pyqtSignal(object, object)
+    session_closed = pyqtSignal(object)
+
+    def __init__(self, keepalive_payload=None):
+        super().__init__()
+        self.loop = ControlLoopThread.instance()
+        self.keepalive_payload = keepalive_payload
+        self.server = None
+
+    def listen(self, host, port):
+        """ Ошибка привязки порта пробрасывается вызывающему. """
+        self.server = ControlServer(self.on_session)
+        self.loop.run(self.server.listen(host, port)).result()
+
+    def on_session(self, session):
+        session.on_message = lambda session, data: self.message.emit(session, data)
+        session.on_close = self.session_closed.emit
+        session.start_keepalive(payload=self.keepalive_payload)
+        self.session_opened.emit(session)
+
+    def send(self, session, dct):
+        self.loop.call(session.send, dct)
+
+    def send_and_close(self, session, dct):
+        self.send(session, dct)
+        self.loop.run(session.drain_and_close())
+
+    def close_session(self, session):
+        self.loop.call(session.close)
+
+    def close(self):
+        if self.server:
+            self.loop.run(self.server.close())
+        self.server = None
+
+
+class QtControlClient(QObject):
+    connected = pyqtSignal()
+    failed = pyqtSignal(str)
+    message = pyqtSignal(object)
+    disconnected = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.loop = ControlLoopThread.instance()
+        self.session = None
+        self.connecting = False
+
+    def is_connected(self):
+        return self.session is not None and not self.session.closed
+
+    def connect_to(self, host, port):
+        """ Не блокирует: результат приходит сигналом connected или failed. """
+        self.connecting = True
+        self.loop.run(self.connect_coro(host, port))
+
+    async def connect_coro(self, host, port):
+        try:
+            session = await ControlClient.connect(host, port,
+                on_message=lambda session, data: self.message.emit(data),
+                on_close=lambda session: self.disconnected.emit())
+        except (OSError, asyncio.TimeoutError) as ex:
+            self.connecting = False
+            self.failed.emit(str(ex) or type(ex).__name__)
+            return
+        self.session = session
+        self.connecting = False
+        session.start_keepalive()
+        self.connected.emit()
+
+    def send(self, dct):
+        if self.session:
+            self.loop.call(self.session.send, dct)
+
+    def disconnect_from_host(self):
+        if self.session:
+            self.loop.call(self.session.close)
+        self.session = None
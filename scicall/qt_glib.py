@@ -0,0 +1,44 @@
+""" Контекст GLib в процессе интерфейса Qt.
+
+Таймеры GLib.timeout_add/idle_add (liveness) и сигналы шин конвееров
+(add_signal_watch) срабатывают, только когда кто-то крутит контекст GLib
+по умолчанию. Qt под linux делает это сам (QEventDispatcherGlib), а под
+windows - нет. Отдельный поток с GLib.MainLoop здесь не годится: под linux
+он забрал бы контекст у потока Qt, и интерфейс бы встал.
+
+GlibPump по QTimer обрабатывает готовые события контекста в потоке
+интерфейса, если диспетчер Qt этого не делает.
+"""
+
+from gi.repository import GLib
+from PyQt5.QtCore import QAbstractEventDispatcher, QObject, QTimer
+
+PUMP_INTERVAL = 20
+
+
+def qt_iterates_glib():
+    dispatcher = QAbstractEventDispatcher.instance()
+    return dispatcher is not None and "Glib" in dispatcher.metaObject().className()
+
+
+class GlibPump(QObject):
+    def __init__(self, interval=PUMP_INTERVAL):
+        super().__init__()
+        self.context = GLib.MainContext.default()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.pump)
+        self.interval = interval
+
+    def start(self):
+        """ Вызывается после создания QApplication. """
+        if qt_iterates_glib():
+            return False
+        self.timer.start(self.interval)
+        return True
+
+    def stop(self):
+        self.timer.stop()
+
+    def pump(self):
+        while self.context.pending():
+            self.context.iteration(False)
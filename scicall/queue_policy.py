@@ -0,0 +1,131 @@
+""" Профили очередей по типу ветви и статистика их заполнения.
+
+Одинаковый предел в 100000 байт для всех очередей не подходит никому:
+кадр 640x480 в сыром виде занимает ~460 КБ, и такая очередь пропускает
+по одному кадру, а для opus тот же предел - это секунды звука.
+Поэтому пределы задаются по типу ветви:
+
+    raw_video - сырое видео, ограничение в кадрах
+    encoded   - закодированное видео внутри станции, ограничение по времени
+    audio     - сырой и закодированный звук, ограничение по времени
+    preview   - предпросмотр, один кадр, старые кадры выбрасываются
+    network   - вход и выход srt, ограничение по времени с запасом на джиттер
+    fanout    - перед общим srtsink раздачи, старые буферы выбрасываются
+"""
+
+from enum import Enum
+
+from gi.repository import Gst
+
+from scicall.instrumentation import Instrumentation
+
+MS = 1000000
+
+
+class QueueKind(str, Enum):
+    RAW_VIDEO = "raw_video"
+    ENCODED = "encoded"
+    AUDIO = "audio"
+    PREVIEW = "preview"
+    NETWORK = "network"
+    FANOUT = "fanout"
+
+
+class QueueProfile:
+    def __init__(self, buffers=0, bytes=0, time=0, leaky=None):
+        self.buffers = buffers
+        self.bytes = bytes
+        self.time = time
+        self.leaky = leaky
+
+    def apply(self, queue):
+        queue.set_property("max-size-buffers", self.buffers)
+        queue.set_property("max-size-bytes", self.bytes)
+        queue.set_property("max-size-time", self.time)
+        queue.set_property("min-threshold-buffers", 0)
+        queue.set_property("min-threshold-bytes", 0)
+        queue.set_property("min-threshold-time", 0)
+        if self.leaky:
+            Gst.util_set_object_arg(queue, "leaky", self.leaky)
+        queue.set_property("silent", True)
+
+    def fill(self, buffers, bytes, time):
+        """ Заполненность от 0 до 1 по самому тесному из пределов. """
+        levels = []
+        if self.buffers:
+            levels.append(buffers / self.buffers)
+        if self.bytes:
+            levels.append(bytes / self.bytes)
+        if self.time:
+            levels.append(time / self.time)
+        return max(levels) if levels else 0
+
+
+PROFILES = {
+    QueueKind.RAW_VIDEO: QueueProfile(buffers=3),
+    QueueKind.ENCODED: QueueProfile(time=200 * MS),
+    QueueKind.AUDIO: QueueProfile(time=100 * MS),
+    QueueKind.PREVIEW: QueueProfile(buffers=1, leaky="downstream"),
+    QueueKind.NETWORK: QueueProfile(time=500 * MS),
+    QueueKind.FANOUT: QueueProfile(time=500 * MS, leaky="downstream"),
+}
+
+DEFAULT_KIND = QueueKind.ENCODED
+
+
+def apply_profile(queue, kind=DEFAULT_KIND):
+    PROFILES[kind].apply(queue)
+
+
+class QueueStats:
+    """ Статистика очередей одного конвеера.
+
+        Переполнение у обычной очереди означает, что поток стоял в ожидании,
+        у очереди с выбрасыванием - что были потеряны буферы.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def watch(self, queue, kind):
+        """ Следит за очередью, только если измерения включены: иначе
+            обработчик overrun на потоке очереди не нужен. """
+        if not Instrumentation.instance().enabled:
+            return
+        entry = { "queue": queue, "kind": kind, "overruns": 0, "seen": False }
+        queue.set_property("silent", False)
+        queue.connect("overrun", self.on_overrun, entry)
+        self.entries.append(entry)
+
+    def on_overrun(self, queue, entry):
+        entry["overruns"] += 1
+
+    def snapshot(self):
+        result = {}
+        for entry in list(self.entries):
+            queue = entry["queue"]
+            if queue.get_parent() is None:
+                if entry["seen"]:
+                    self.entries.remove(entry)
+                continue
+            entry["seen"] = True
+
+            kind = entry["kind"]
+            profile = PROFILES[kind]
+            buffers = queue.get_property("current-level-buffers")
+            bytes = queue.get_property("current-level-bytes")
+            time = queue.get_property("current-level-time")
+            overruns = entry["overruns"]
+            result[queue.get_path_string()] = {
+                "kind": kind.value,
+                "buffers": buffers,
+                "bytes": bytes,
+                "time_ms": time / MS,
+                "fill": round(profile.fill(buffers, bytes, time), 3),
+                "overruns": 0 if profile.leaky else overruns,
+                "drops": overruns if profile.leaky else 0,
+            }
+        return result
+
+    def clear(self):
+        self.entries = []
@@ -0,0 +1,157 @@
+""" Запись каналов гостей без перекодирования.
+
+Закодированные h264 и opus берутся с тройников приёма канала (те же, от
+которых питаются декодеры) и пишутся splitmuxsink-ом в файлы по
+сегментам. Декодирования и кодирования нет, запись канала стоит одного
+мультиплексора и записи на диск.
+
+    guest1-20261018-120000-00000.mkv, guest1-...-00001.mkv, ...
+
+Видео начинается с ключевого кадра: до него буферы выбрасываются, а у
+гостя запрашивается ключевой кадр. При остановке в ветвь записи
+отправляется EOS, и bin разбирается после закрытия последнего сегмента,
+так что mp4 получает корректный индекс.
+
+Закрытие сегмента ловится синхронным обработчиком шины: цикл GLib для
+этого не нужен, и остановка конвеера может дождаться его (stop(timeout)).
+"""
+
+import os
+import threading
+import time
+
+from gi.repository import Gst
+
+from scicall.pipeline_builder import GraphBuilder
+from scicall.queue_policy import QueueKind
+import scicall.pipeline_utils as pipeline_utils
+
+MUXERS = {
+    "mkv": "matroskamux",
+    "mp4": "mp4mux",
+}
+
+DEFAULT_FORMAT = "mkv"
+DEFAULT_SEGMENT = 300
+
+# Запись на диск может вставать: очереди записи длиннее обычных.
+RECORD_QUEUE_TIME = 2000 * 1000000
+
+# Сколько остановка конвеера ждёт закрытия последнего сегмента, в секундах.
+RECORD_STOP_TIMEOUT = 3
+
+
+class ChannelRecorder:
+    """ Запись одного канала.
+
+        @tees - { "video": DynamicTee, "audio": DynamicTee } закодированных потоков.
+        @segment - длительность сегмента в секундах.
+    """
+
+    TEE_KEY = "record"
+
+    def __init__(self, pipeline, tees, directory, name,
+            segment=DEFAULT_SEGMENT, fmt=DEFAULT_FORMAT, stats=None):
+        self.pipeline = pipeline
+        self.tees = tees
+        self.directory = directory
+        self.name = name
+        self.segment = segment
+        self.fmt = fmt
+        self.stats = stats
+        self.bin = None
+        self.splitmux = None
+        self.stopping = False
+        self.fragments = []
+        self.bus_handler = None
+        self.on_done = None
+        self.mtx = threading.Lock()
+        self.finished = threading.Event()
+
+    def location(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.directory, f"{self.name}-{stamp}-%05d.{self.fmt}")
+
+    def build(self):
+        b = GraphBuilder(Gst.Bin.new(f"recorder-{self.name}"), stats=self.stats)
+        splitmux = b.add(f"splitmuxsink max-size-time={self.segment * Gst.SECOND} "
+            f"muxer-factory={MUXERS[self.fmt]}", "splitmux")
+        splitmux.set_property("location", self.location())
+
+        # h264parse переводит поток в avc, если этого требует mp4mux.
+        vqueue = b.queue(QueueKind.ENCODED, "qrv")
+        vqueue.set_property("max-size-time", RECORD_QUEUE_TIME)
+        _, vlast = b.chain(vqueue, "h264parse")
+        b.link(vlast, splitmux, sinkpad="video")
+        b.ghost("video_sink", vqueue, "sink")
+
+        aqueue = b.queue(QueueKind.AUDIO, "qra")
+        aqueue.set_property("max-size-time", RECORD_QUEUE_TIME)
+        _, alast = b.chain(aqueue, pipeline_utils.default_audioparser())
+        b.link(alast, splitmux, sinkpad="audio_%u")
+        b.ghost("audio_sink", aqueue, "sink")
+
+        vqueue.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.wait_keyframe)
+        self.splitmux = splitmux
+        return b.build()
+
+    def wait_keyframe(self, pad, info):
+        if info.get_buffer().has_flags(Gst.BufferFlags.DELTA_UNIT):
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.REMOVE
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.bin = self.build()
+        bus = self.pipeline.get_bus()
+        bus.enable_sync_message_emission()
+        self.bus_handler = bus.connect("sync-message::element", self.on_element_message)
+        pipeline_utils.add_branch(self.pipeline, self.bin)
+        for kind in ("video", "audio"):
+            self.tees[kind].link(self.TEE_KEY, self.bin.get_static_pad(f"{kind}_sink"))
+        print("RECORDER:", self.name, "started", self.splitmux.get_property("location"))
+
+    def stop(self, done=None, timeout=None):
+        """ Отсоединяет запись от тройников и закрывает последний сегмент.
+            @done() вызывается после разборки. С @timeout ждёт закрытия
+            сегмента не дольше @timeout секунд (перед остановкой конвеера),
+            потом разбирает ветвь в любом случае. """
+        if self.bin is None or self.stopping:
+            return
+        self.stopping = True
+        self.on_done = done
+        gstbin = self.bin
+
+        def unlinked(kind):
+            return lambda: gstbin.get_static_pad(f"{kind}_sink").send_event(Gst.Event.new_eos())
+
+        for kind in ("video", "audio"):
+            self.tees[kind].unlink(self.TEE_KEY, unlinked(kind))
+        if timeout is not None and not self.finished.wait(timeout):
+            print("RECORDER:", self.name, "last segment is not closed in", timeout, "s")
+            self.finish()
+
+    def on_element_message(self, bus, msg):
+        """ Вызывается на потоке splitmuxsink. """
+        if msg.src is not self.splitmux:
+            return
+        structure = msg.get_structure()
+        if structure.get_name() == "splitmuxsink-fragment-closed":
+            self.fragments.append(structure.get_string("location"))
+            if self.stopping:
+                threading.Thread(target=self.finish, daemon=True).start()
+
+    def finish(self):
+        with self.mtx:
+            if self.bin is None:
+                return
+            bus = self.pipeline.get_bus()
+            if self.bus_handler is not None:
+                bus.disconnect(self.bus_handler)
+                self.bus_handler = None
+            pipeline_utils.remove_branch(self.pipeline, self.bin)
+            self.bin = None
+            self.finished.set()
+        print("RECORDER:", self.name, "stopped,", len(self.fragments), "segments")
+        if self.on_done:
+            self.on_done()
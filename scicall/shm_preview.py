@@ -0,0 +1,140 @@
+""" Предпросмотр через разделяемую память.
+
+Конвеер не рисует сам: ветвь предпросмотра прореживает кадры до
+PREVIEW_FPS, уменьшает их и отдаёт в shmsink. Интерфейс (или отдельный
+просмотрщик) забирает их через shmsrc --> appsink с той частотой, с
+которой рисует. Конвеер при этом не привязан к окну процесса интерфейса
+и может работать в процессе канала (см. channel_worker).
+
+Перед shmsink стоит очередь предпросмотра в один кадр с выбрасыванием:
+если читатель отстал и область памяти занята, ждёт только ветвь
+предпросмотра, основной поток не тормозится.
+
+Путь сокета определяется именем конвеера, так что писатель и читатель
+находят друг друга без согласования. shmsink есть только под unix, под
+windows остаётся прежний предпросмотр в окно (см. available()).
+Просмотр без интерфейса:
+
+    python3 -m scicall.shm_preview station.ch1
+"""
+
+import getpass
+import os
+import sys
+import tempfile
+
+from gi.repository import Gst
+
+PREVIEW_WIDTH = 320
+PREVIEW_HEIGHT = 240
+PREVIEW_FPS = 10
+PREVIEW_FORMAT = "BGRx"
+
+# Область памяти на несколько кадров.
+SHM_FRAMES = 4
+
+
+def available():
+    """ Предпросмотр через разделяемую память возможен на этой машине. """
+    return sys.platform != "win32" and Gst.ElementFactory.find("shmsink") is not None
+
+
+def preview_dir():
+    return os.environ.get("SCICALL_PREVIEW_DIR") or os.path.join(
+        tempfile.gettempdir(), f"scicall-preview-{getpass.getuser()}")
+
+
+def preview_socket_path(name):
+    return os.path.join(preview_dir(), f"{name}.sock")
+
+
+def preview_caps(width=PREVIEW_WIDTH, height=PREVIEW_HEIGHT, fps=PREVIEW_FPS):
+    return f"video/x-raw,format={PREVIEW_FORMAT},width={width},height={height},framerate={fps}/1"
+
+
+def writer_elements(name, width=PREVIEW_WIDTH, height=PREVIEW_HEIGHT, fps=PREVIEW_FPS):
+    """ Элементы ветви, пишущей предпросмотр @name в разделяемую память.
+        Кадры прореживаются до масштабирования. """
+    path = preview_socket_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+    return [
+        "videorate drop-only=true",
+        "videoscale",
+        "videoconvert",
+        preview_caps(width, height, fps),
+        f"shmsink socket-path={path} shm-size={width * height * 4 * SHM_FRAMES} "
+            "wait-for-connection=false sync=false async=false",
+    ]
+
+
+class ShmPreviewReader:
+    """ Читатель кадров предпросмотра @name.
+
+        pull() возвращает последний кадр (bytes в PREVIEW_FORMAT) или None,
+        цикл GLib не нужен. Если писатель ещё не запущен или перезапустился,
+        читатель переподключается при следующем pull().
+    """
+
+    def __init__(self, name, width=PREVIEW_WIDTH, height=PREVIEW_HEIGHT, fps=PREVIEW_FPS):
+        self.path = preview_socket_path(name)
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.pipeline = None
+        self.appsink = None
+
+    def start(self):
+        if not os.path.exists(self.path):
+            return False
+        self.pipeline = Gst.parse_launch(
+            f"shmsrc socket-path={self.path} is-live=true do-timestamp=true ! "
+            f"{preview_caps(self.width, self.height, self.fps)} ! "
+            "appsink name=sink max-buffers=1 drop=true sync=false")
+        self.appsink = self.pipeline.get_by_name("sink")
+        self.pipeline.set_state(Gst.State.PLAYING)
+        return True
+
+    def stop(self):
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.NULL)
+        self.pipeline = None
+        self.appsink = None
+
+    def pull(self):
+        if self.pipeline is None and not self.start():
+            return None
+        msg = self.pipeline.get_bus().pop_filtered(Gst.MessageType.ERROR | Gst.MessageType.EOS)
+        if msg is not None:
+            self.stop()
+            return None
+        sample = self.appsink.emit("try-pull-sample", 0)
+        if sample is None:
+            return None
+        buf = sample.get_buffer()
+        ok, info = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return None
+        try:
+            return bytes(info.data)
+        finally:
+            buf.unmap(info)
+
+
+def main(name):
+    Gst.init(sys.argv[:1])
+    pipeline = Gst.parse_launch(
+        f"shmsrc socket-path={preview_socket_path(name)} is-live=true do-timestamp=true ! "
+        f"{preview_caps()} ! videoconvert ! autovideosink sync=false")
+    pipeline.set_state(Gst.State.PLAYING)
+    bus = pipeline.get_bus()
+    msg = bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+    if msg.type == Gst.MessageType.ERROR:
+        print(msg.parse_error()[0].message)
+    pipeline.set_state(Gst.State.NULL)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1]))
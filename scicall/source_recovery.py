@@ -0,0 +1,80 @@
+""" Перезапуск источника без остановки остального конвеера.
+
+Раньше при обрыве srt весь конвеер проходил PAUSED --> READY --> PAUSED -->
+PLAYING, и вместе с источником сбрасывались кодеры, окна предпросмотра и
+отправка звука в микшер. Здесь перезапускается только цепочка источника
+(srtsrc и разборщик за ним): она переводится в NULL, нижележащие элементы
+получают flush, чтобы выбросить остатки старого потока, после чего цепочка
+возвращается в состояние конвеера. Остальные ветви продолжают работать.
+
+Живой источник ставит метки времени по часам конвеера, поэтому время
+нижележащих элементов не сбрасывается (flush-stop без reset-time).
+"""
+
+import time
+
+from gi.repository import Gst
+
+MIN_RESTART_INTERVAL = 1
+
+
+def chain_between(first, last):
+    """ Элементы от @first до @last включительно по постоянным src падам. """
+    elements = [first]
+    element = first
+    while element is not last:
+        pad = element.get_static_pad("src")
+        peer = pad.get_peer() if pad else None
+        if peer is None:
+            raise Exception(f"{last.get_name()} is not downstream of {first.get_name()}")
+        element = peer.get_parent_element()
+        elements.append(element)
+    return elements
+
+
+def restart_chain(elements, flush=True):
+    """ Перезапускает цепочку, @elements - от источника вниз по потоку.
+        Возвращает время перезапуска в секундах. """
+    start = time.monotonic()
+    for element in elements:
+        element.set_state(Gst.State.NULL)
+    if flush:
+        peer = elements[-1].get_static_pad("src").get_peer()
+        if peer:
+            peer.send_event(Gst.Event.new_flush_start())
+            peer.send_event(Gst.Event.new_flush_stop(False))
+    for element in reversed(elements):
+        element.sync_state_with_parent()
+    return time.monotonic() - start
+
+
+class SourceRecovery:
+    """ Перезапуск цепочек источника с ограничением частоты.
+
+        @chains - список цепочек, каждая - список элементов.
+    """
+
+    def __init__(self, name, chains, min_interval=MIN_RESTART_INTERVAL):
+        self.name = name
+        self.chains = chains
+        self.min_interval = min_interval
+        self.last_restart = None
+        self.restarts = 0
+        self.last_duration = None
+
+    def restart(self, reason=None):
+        now = time.monotonic()
+        if self.last_restart is not None and now - self.last_restart < self.min_interval:
+            return False
+        self.last_restart = now
+        self.last_duration = sum(restart_chain(chain) for chain in self.chains)
+        self.restarts += 1
+        print("RECOVERY:", self.name, "source restarted", reason or "",
+            "%.1f ms" % (self.last_duration * 1000))
+        return True
+
+    def snapshot(self):
+        return {
+            "restarts": self.restarts,
+            "last_duration_ms": None if self.last_duration is None else round(self.last_duration * 1000, 1),
+        }
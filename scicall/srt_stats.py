@@ -0,0 +1,126 @@
+""" Статистика srt соединений и подбор задержки по ней.
+
+srtsrc и srtsink отдают свойство "stats" (Gst.Structure). У слушающего
+элемента статистика каждого подключенного абонента лежит в массиве
+"callers". Здесь она приводится к одному виду для приёма и передачи,
+у раздачи многим абонентам берётся первый из них и их число.
+
+Задержка srt выбирается один раз при соединении, поэтому сменить её можно
+только переподключением. AdaptiveLatency лишь советует новое значение,
+а переподключение выполняет канал станции через рукопожатие.
+"""
+
+import time
+
+SRT_POLL_INTERVAL = 2
+
+
+def structure_to_dict(structure):
+    result = {}
+    for i in range(structure.n_fields()):
+        name = structure.nth_field_name(i)
+        value = structure.get_value(name)
+        if isinstance(value, (list, tuple)):
+            value = [ structure_to_dict(v) if hasattr(v, "n_fields") else v for v in value ]
+        result[name] = value
+    return result
+
+
+def first_of(dct, *names):
+    for name in names:
+        if name in dct:
+            return dct[name]
+    return None
+
+
+def read_stats(element):
+    """ Статистика srt элемента или None, если соединения ещё нет. """
+    if element is None:
+        return None
+    structure = element.get_property("stats")
+    if structure is None:
+        return None
+    raw = structure_to_dict(structure)
+    callers = raw.get("callers")
+    count = 1
+    if isinstance(callers, list):
+        if not callers:
+            return None
+        raw = callers[0]
+        count = len(callers)
+
+    return {
+        "rtt_ms": first_of(raw, "rtt-ms"),
+        "bandwidth_mbps": first_of(raw, "bandwidth-mbps"),
+        "rate_mbps": first_of(raw, "receive-rate-mbps", "send-rate-mbps"),
+        "packets": first_of(raw, "packets-received", "packets-sent") or 0,
+        "lost": first_of(raw, "packets-received-lost", "packets-sent-lost") or 0,
+        "retransmitted": first_of(raw, "packets-received-retransmitted", "packets-retransmitted") or 0,
+        "dropped": first_of(raw, "packets-received-dropped", "packets-sent-dropped") or 0,
+        "latency_ms": first_of(raw, "negotiated-latency-ms"),
+        "callers": count,
+    }
+
+
+class AdaptiveLatency:
+    """ Подбор задержки srt по rtt и выброшенным пакетам.
+
+        Цель - RTT_FACTOR * rtt + запас. Если появились пакеты, выброшенные
+        из-за опоздания, задержка поднимается сразу. Опускается она, только
+        если цель держится ниже текущей больше чем на порог гистерезиса
+        несколько опросов подряд. Между сменами выдерживается пауза.
+    """
+
+    RTT_FACTOR = 4
+
+    def __init__(self, current, minimum=40, maximum=1000, margin=20,
+            hysteresis=0.25, stable_polls=5, cooldown=30):
+        self.current = current
+        self.minimum = minimum
+        self.maximum = maximum
+        self.margin = margin
+        self.hysteresis = hysteresis
+        self.stable_polls = stable_polls
+        self.cooldown = cooldown
+        self.changed_at = time.monotonic()
+        self.lower_polls = 0
+        self.last_dropped = None
+
+    def clamp(self, value):
+        value = int(round(value / 10.0)) * 10
+        return max(self.minimum, min(self.maximum, value))
+
+    def update(self, stats, now=None):
+        """ Возвращает новую задержку или None, если менять не нужно. """
+        if not stats or stats.get("rtt_ms") is None:
+            return None
+        now = time.monotonic() if now is None else now
+
+        dropped = stats.get("dropped", 0)
+        new_drops = 0 if self.last_dropped is None else max(0, dropped - self.last_dropped)
+        self.last_dropped = dropped
+
+        target = self.clamp(stats["rtt_ms"] * self.RTT_FACTOR + self.margin)
+        if new_drops:
+            target = max(target, self.clamp(self.current * 1.5))
+
+        if now - self.changed_at < self.cooldown:
+            return None
+
+        if target > self.current and (new_drops or target > self.current * (1 + self.hysteresis)):
+            return self.change(target, now)
+
+        if target < self.current * (1 - self.hysteresis):
+            self.lower_polls += 1
+            if self.lower_polls >= self.stable_polls:
+                return self.change(target, now)
+        else:
+            self.lower_polls = 0
+        return None
+
+    def change(self, target, now):
+        self.current = target
+        self.changed_at = now
+        self.lower_polls = 0
+        self.last_dropped = None
+        return target
@@ -0,0 +1,501 @@
+from gi.repository import GObject, Gst, GstVideo
+import threading
+
+import scicall.pipeline_utils as pipeline_utils
+from scicall.ports import *
+from scicall.mix_minus import internal_audio_out_template
+from scicall.pipeline_builder import GraphBuilder
+from scicall.queue_policy import QueueKind, QueueStats
+from scicall.instrumentation import Instrumentation
+from scicall.srt_stats import read_stats
+from scicall.liveness import LivenessMonitor, DEFAULT_TIMEOUT
+from scicall.source_recovery import SourceRecovery, chain_between
+from scicall.fanout import SrtFanout
+from scicall.keyframe import KeyframeRequester, encoder_with_gop
+from scicall.recorder import ChannelRecorder, RECORD_STOP_TIMEOUT
+import scicall.shm_preview as shm_preview
+from scicall.monitor_profile import video_monitor, audio_monitor, set_monitors_active
+from scicall.level_meter import LevelTracker
+
+
+CONSUMER_INPUTS = {
+    "video_preview": [ "video" ],
+    "audio_preview": [ "audio" ],
+    "shm_preview": [ "video" ],
+    "ndi": [ "video", "audio" ],
+    # Декодирование без вывода, для замеров нагрузки.
+    "null": [ "video", "audio" ],
+}
+
+
+class RawDecoder:
+    """ Декодер одного закодированного потока канала и тройник его сырых данных. """
+
+    def __init__(self, gstbin, tee):
+        self.bin = gstbin
+        self.tee = tee
+        self.refs = 0
+
+
+class StationChannelPipeline:
+    """ Конвеер приёма потока одного гостя на станции.
+
+        Не зависит от Qt. Базовый конвеер только принимает закодированные потоки и
+        отправляет звук в микшер. Декодирование видео и звука собирается по запросу,
+        когда подключается потребитель сырых данных (предпросмотр, ndi), и
+        разбирается, когда отключается последний из них.
+
+        Схема:
+            srtsrc --> h264parse --> h264tee --(по запросу)--> декодер --> t1 --> потребители
+            srtsrc --> opusparse --> opusin --> микшер
+                          \--(по запросу)--> декодер --> t2 --> потребители
+
+        Наличие потока гостя отслеживает LivenessMonitor: @liveness_timeout -
+        допустимый перерыв видео в мс, @on_alive/@on_lost - его колбэки.
+        restart_sources() перезапускает только srtsrc и разборщики, не трогая
+        декодеры и потребители. @on_keyframe_needed(reason) вызывается, когда
+        видео нужно начать с ключевого кадра: при появлении потока и при
+        запуске декодера посреди потока.
+
+        Предпросмотр видео либо рисуется в окно процесса (video_preview,
+        окно назначает @sync_handler), либо отдаётся в разделяемую память
+        под именем monitor_name() (shm_preview).
+
+        set_recording() включает запись закодированных потоков без
+        перекодирования; запись переживает перезапуск конвеера, сегмент,
+        открытый в момент остановки, закрывается до остановки конвеера.
+    """
+
+    def __init__(self, channelno, liveness_timeout=DEFAULT_TIMEOUT):
+        self.mtx = threading.RLock()
+        self.channelno = channelno
+        self.liveness_timeout = liveness_timeout
+        self.liveness = None
+        self.recovery = None
+        self.on_alive = None
+        self.on_lost = None
+        self.on_keyframe_needed = None
+        self.record_settings = None
+        self.recorder = None
+        self.pipeline = None
+        self.bus = None
+        self.gputype = None
+        self.stats = QueueStats()
+        self.levels = LevelTracker()
+        self.srtsrcs = {}
+        self.encoded_tees = {}
+        self.decoders = {}
+        self.consumers = {}
+
+    def ndi_name(self):
+        return f"Guest{self.channelno+1}-AudioVideo"
+
+    def monitor_name(self):
+        return f"station.ch{self.channelno+1}"
+
+    def build(self, srtlatency):
+        srtport = channel_mpeg_stream_port(self.channelno)
+        udpspam = internal_channel_audio_udpspam_port(self.channelno)
+
+        b = GraphBuilder(stats=self.stats)
+        h264tee = b.add("tee name=h264tee allow-not-linked=true")
+        opusin = b.add("tee name=opusin allow-not-linked=true")
+        videosrc, _ = b.chain(f"srtsrc uri=srt://:{srtport} wait-for-connection=true latency={srtlatency}",
+            b.queue(QueueKind.NETWORK, "q0"), "h264parse name=videoparse config-interval=-1", h264tee)
+        audiosrc, _ = b.chain(f"srtsrc uri=srt://:{srtport+1} wait-for-connection=true latency={srtlatency}",
+            b.queue(QueueKind.NETWORK, "q2"),
+            f"{pipeline_utils.default_audioparser()} name=audioparse", opusin)
+        self.srtsrcs = { "video": videosrc, "audio": audiosrc }
+        self.recovery = SourceRecovery(self.monitor_name(), [
+            chain_between(videosrc, b.get("videoparse")),
+            chain_between(audiosrc, b.get("audioparse")),
+        ])
+        b.chain(opusin, b.queue(QueueKind.AUDIO, "qt5"), internal_audio_out_template(udpspam))
+        pipeline = b.build()
+
+        monitor = Instrumentation.instance().register(
+            self.monitor_name(), pipeline, self.stats, srtlatency)
+        monitor.watch_flow("video_in", b.get("q0"))
+        monitor.watch_flow("audio_in", b.get("q2"))
+        monitor.watch_srt("video_in", videosrc)
+        monitor.watch_srt("audio_in", audiosrc)
+        self.levels = LevelTracker()
+        monitor.watch_level("audio_in", self.levels, "audiolevel")
+        return pipeline, h264tee, opusin
+
+    def start(self, gputype, srtlatency, sync_handler=None):
+        with self.mtx:
+            self.gputype = gputype
+            self.stats = QueueStats()
+            self.pipeline, h264tee, opusin = self.build(srtlatency)
+            self.encoded_tees = {
+                "video": pipeline_utils.DynamicTee(h264tee),
+                "audio": pipeline_utils.DynamicTee(opusin),
+            }
+            self.decoders = {}
+            self.consumers = {}
+
+            self.bus = self.pipeline.get_bus()
+            self.bus.add_signal_watch()
+            self.levels.attach(self.bus)
+            if sync_handler:
+                self.bus.enable_sync_message_emission()
+                self.bus.connect('sync-message::element', sync_handler)
+            self.start_liveness()
+            self.pipeline.set_state(Gst.State.PLAYING)
+            if self.record_settings:
+                self.start_recorder()
+
+    def start_liveness(self):
+        self.liveness = LivenessMonitor(self.monitor_name(), self.liveness_timeout,
+            on_alive=self.stream_alive,
+            on_lost=lambda reason: self.on_lost and self.on_lost(reason))
+        videosrc = self.srtsrcs["video"]
+        self.liveness.watch_pad(videosrc.get_static_pad("src"))
+        self.liveness.watch_srt(videosrc)
+        self.liveness.watch_bus(self.bus, list(self.srtsrcs.values()))
+        self.liveness.start()
+
+    def stream_alive(self):
+        self.keyframe_needed("stream")
+        if self.on_alive:
+            self.on_alive()
+
+    def keyframe_needed(self, reason):
+        if self.on_keyframe_needed:
+            self.on_keyframe_needed(reason)
+
+    def restart_sources(self, reason=None):
+        with self.mtx:
+            if self.recovery is None:
+                return False
+            return self.recovery.restart(reason)
+
+    def set_recording(self, directory=None, segment=None, fmt=None):
+        """ @directory=None выключает запись. """
+        with self.mtx:
+            if directory is None:
+                self.record_settings = None
+                self.stop_recorder()
+                return
+            self.record_settings = { "directory": directory }
+            if segment:
+                self.record_settings["segment"] = segment
+            if fmt:
+                self.record_settings["fmt"] = fmt
+            if self.pipeline and self.recorder is None:
+                self.start_recorder()
+
+    def is_recording(self):
+        with self.mtx:
+            return self.recorder is not None
+
+    def start_recorder(self):
+        self.recorder = ChannelRecorder(self.pipeline, self.encoded_tees,
+            name=f"guest{self.channelno+1}", stats=self.stats, **self.record_settings)
+        self.recorder.start()
+        self.keyframe_needed("recorder")
+
+    def stop_recorder(self, timeout=None):
+        if self.recorder:
+            self.recorder.stop(timeout=timeout)
+            self.recorder = None
+
+    def liveness_state(self):
+        with self.mtx:
+            return self.liveness.state if self.liveness else None
+
+    def audio_level(self):
+        """ Уровень звука гостя, пока подключен audio_preview. """
+        return self.levels.get("audiolevel")
+
+    def stop(self):
+        with self.mtx:
+            Instrumentation.instance().unregister(self.monitor_name())
+            self.stop_recorder(timeout=RECORD_STOP_TIMEOUT)
+            if self.liveness:
+                self.liveness.stop()
+                self.liveness = None
+            self.recovery = None
+            if self.pipeline:
+                self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline = None
+            self.bus = None
+            self.srtsrcs = {}
+            self.encoded_tees = {}
+            self.decoders = {}
+            self.consumers = {}
+
+    def is_running(self):
+        with self.mtx:
+            return self.pipeline is not None
+
+    def srt_stats(self):
+        """ Статистика srt приёма гостя: { "video": ..., "audio": ... } """
+        with self.mtx:
+            return { kind: read_stats(element) for kind, element in self.srtsrcs.items() }
+
+    def decoder_bin(self, kind):
+        b = GraphBuilder(Gst.Bin.new(None), stats=self.stats)
+        if kind == "video":
+            first, last = b.chain(b.queue(QueueKind.ENCODED, "qd"),
+                pipeline_utils.video_decoder_type(self.gputype))
+        else:
+            first, last = b.chain(b.queue(QueueKind.AUDIO, "qd"),
+                pipeline_utils.default_audiodecoder(),
+                "audioconvert", "audioresample")
+        b.ghost("sink", first, "sink")
+        b.ghost("src", last, "src")
+        return b.build()
+
+    def acquire_decoder(self, kind):
+        decoder = self.decoders.get(kind)
+        if decoder is None:
+            gstbin = self.decoder_bin(kind)
+            tee = Gst.ElementFactory.make("tee", None)
+            pipeline_utils.add_branch(self.pipeline, tee)
+            pipeline_utils.add_branch(self.pipeline, gstbin)
+            gstbin.link(tee)
+            self.encoded_tees[kind].link(kind, gstbin.get_static_pad("sink"))
+            decoder = RawDecoder(gstbin, pipeline_utils.DynamicTee(tee))
+            self.decoders[kind] = decoder
+            print("STATION: decoder started", self.channelno, kind)
+            if kind == "video":
+                self.keyframe_needed("decoder")
+        decoder.refs += 1
+        return decoder
+
+    def release_decoder(self, pipeline, kind):
+        """ Вызывается после отсоединения потребителя от тройника декодера. """
+        with self.mtx:
+            if pipeline is not self.pipeline:
+                return
+            decoder = self.decoders[kind]
+            decoder.refs -= 1
+            if decoder.refs > 0:
+                return
+            del self.decoders[kind]
+
+            def done():
+                pipeline_utils.remove_branch(pipeline, decoder.bin)
+                pipeline_utils.remove_branch(pipeline, decoder.tee.tee)
+                print("STATION: decoder stopped", self.channelno, kind)
+
+            self.encoded_tees[kind].unlink(kind, done)
+
+    def consumer_bin(self, kind):
+        b = GraphBuilder(Gst.Bin.new(None), stats=self.stats)
+        if kind == "video_preview":
+            first, last = b.chain(*video_monitor(b, "qt0", "autovideosink sync=false name=videoend"))
+            b.ghost("video_sink", first, "sink")
+        elif kind == "shm_preview":
+            first, last = b.chain(b.queue(QueueKind.PREVIEW, "qsp"),
+                *shm_preview.writer_elements(self.monitor_name()))
+            b.ghost("video_sink", first, "sink")
+        elif kind == "audio_preview":
+            first, last = b.chain(*audio_monitor(b, "qt1", "autovideosink sync=false name=audioend",
+                "audiolevel"))
+            b.ghost("audio_sink", first, "sink")
+        elif kind == "ndi":
+            combiner = b.add("ndisinkcombiner name=combiner")
+            qnv, last = b.chain(b.queue(QueueKind.RAW_VIDEO, "qnv"), "videoconvert", combiner)
+            b.chain(combiner, f"ndisink ndi-name={self.ndi_name()}")
+            qna, last = b.chain(b.queue(QueueKind.AUDIO, "qna"), "audioconvert", "audioresample")
+            b.link(last, combiner, sinkpad="audio")
+            b.ghost("video_sink", qnv, "sink")
+            b.ghost("audio_sink", qna, "sink")
+        elif kind == "null":
+            qnv, _ = b.chain(b.queue(QueueKind.RAW_VIDEO, "qnv"), "fakesink sync=false")
+            qna, _ = b.chain(b.queue(QueueKind.AUDIO, "qna"), "fakesink sync=false")
+            b.ghost("video_sink", qnv, "sink")
+            b.ghost("audio_sink", qna, "sink")
+        else:
+            raise Exception(f"unknown consumer: {kind}")
+        return b.build()
+
+    def attach_consumer(self, kind):
+        """ Подключает потребителя сырых данных, при необходимости запуская декодеры. """
+        with self.mtx:
+            if self.pipeline is None or kind in self.consumers:
+                return
+            gstbin = self.consumer_bin(kind)
+            pipeline_utils.add_branch(self.pipeline, gstbin)
+            for inp in CONSUMER_INPUTS[kind]:
+                decoder = self.acquire_decoder(inp)
+                decoder.tee.link(kind, gstbin.get_static_pad(f"{inp}_sink"))
+            self.consumers[kind] = gstbin
+
+    def detach_consumer(self, kind):
+        with self.mtx:
+            gstbin = self.consumers.pop(kind, None)
+            if gstbin is None:
+                return
+            pipeline = self.pipeline
+            inputs = CONSUMER_INPUTS[kind]
+            pending = [ len(inputs) ]
+            lock = threading.Lock()
+
+            def make_done(inp):
+                def done():
+                    with lock:
+                        pending[0] -= 1
+                        last = pending[0] == 0
+                    if last:
+                        pipeline_utils.remove_branch(pipeline, gstbin)
+                    self.release_decoder(pipeline, inp)
+                return done
+
+            for inp in inputs:
+                self.decoders[inp].tee.unlink(kind, make_done(inp))
+
+    def set_consumer(self, kind, enabled):
+        if enabled:
+            self.attach_consumer(kind)
+        else:
+            self.detach_consumer(kind)
+
+    def has_consumer(self, kind):
+        with self.mtx:
+            return kind in self.consumers
+
+
+class ExternalSourcePipeline:
+    """ Конвеер внешнего источника: кодирует сигнал один раз и раздаёт его гостям.
+
+        Не зависит от Qt. Ветви предпросмотра строятся только при @previews=True
+        и выключаются без пересборки через set_previews_active().
+        Видео кодируется один раз и раздаётся всем гостям одним слушающим
+        srtsink (SrtFanout) на порту feedback_videoport().
+    """
+
+    def __init__(self, chno, previews=True):
+        self.mtx = threading.RLock()
+        self.chno = chno
+        self.previews = previews
+        self.previews_active = True
+        self.srtlatency = 80
+        self.source_type = "Тестовый1"
+        self.ndi_name = ""
+        self.pipeline = None
+        self.bus = None
+        self.stats = QueueStats()
+        self.levels = LevelTracker()
+        self.fanout = None
+        self.keyframes = None
+
+    def audio_source(self, b):
+        srctype = self.source_type
+        if srctype == "Тестовый1":
+            return [ "audiotestsrc is-live=true" ]
+        elif srctype == "Тестовый2":
+            return [ "audiotestsrc is-live=true" ]
+        elif srctype == "NDI":
+            return [ f'ndiaudiosrc do-timestamp=true timestamp-mode=2 timeout=0 ndi-name="{self.ndi_name}" ! audioresample ! audioconvert',
+                b.queue(QueueKind.AUDIO, "qa5") ]
+        return [ "audiotestsrc" ]
+
+    def video_source(self, b):
+        srctype = self.source_type
+        if srctype == "Тестовый1":
+            return [ "videotestsrc is-live=true" ]
+        elif srctype == "Тестовый2":
+            return [ "videotestsrc pattern=snow is-live=true" ]
+        elif srctype == "NDI":
+            return [ f'ndivideosrc do-timestamp=true timestamp-mode=2 timeout=0 ndi-name="{self.ndi_name}"',
+                b.queue(QueueKind.RAW_VIDEO, "q5") ]
+        return [ "videotestsrc" ]
+
+    def build_audio(self, b):
+        audioencoder = pipeline_utils.default_audioencoder()
+        udpspam = internal_external_audio_udpspam_port(self.chno)
+
+        audiotee = b.add("tee name=audiotee")
+        b.chain(*self.audio_source(b), "audioconvert", b.queue(QueueKind.AUDIO, "qa0"), audiotee)
+        if self.previews:
+            b.chain(audiotee, *audio_monitor(b, "qa1", "autovideosink name=audioend", "audiolevel",
+                self.previews_active))
+        b.chain(audiotee, b.queue(QueueKind.AUDIO, "qa2"), "audioresample", audioencoder,
+            internal_audio_out_template(udpspam))
+
+    def build(self):
+        if self.source_type == "Нет":
+            return None
+        videocaps = pipeline_utils.global_videocaps()
+        h264caps = "video/x-h264,profile=baseline,stream-format=byte-stream,alignment=au,framerate=30/1"
+        video_encoder = encoder_with_gop("x264enc tune=zerolatency")
+
+        self.stats = QueueStats()
+        self.levels = LevelTracker()
+        b = GraphBuilder(stats=self.stats)
+        sourcetee = b.add("tee name=sourcetee")
+        b.chain(*self.video_source(b), "videoconvert", videocaps, b.queue(QueueKind.RAW_VIDEO, "q0"), sourcetee)
+        if self.previews:
+            b.chain(sourcetee, *video_monitor(b, "q1", "autovideosink name=videoend", self.previews_active))
+        encoder = b.add(video_encoder, "videoencoder")
+        _, h264tee = b.chain(sourcetee, b.queue(QueueKind.RAW_VIDEO, "q2"), encoder, h264caps,
+            "h264parse config-interval=-1", "tee name=h264tee allow-not-linked=true")
+        self.keyframes = KeyframeRequester(encoder)
+        self.fanout = SrtFanout(self.feedback_videoport(), self.srtlatency, self.stats,
+            on_caller_added=lambda address: self.request_keyframe("caller " + address))
+        b.chain(h264tee, self.fanout.build())
+        self.build_audio(b)
+        pipeline = b.build()
+
+        monitor = Instrumentation.instance().register(
+            self.monitor_name(), pipeline, self.stats, self.srtlatency)
+        monitor.watch_flow("video_out", h264tee, "sink")
+        monitor.watch_latency("video_encode", b.get("q2"), h264tee)
+        monitor.watch_srt("fanout", self.fanout.srtsink)
+        if self.previews:
+            monitor.watch_level("audio", self.levels, "audiolevel")
+        return pipeline
+
+    def start(self, sync_handler=None):
+        with self.mtx:
+            pipeline = self.build()
+            if pipeline is None:
+                return None
+
+            self.pipeline = pipeline
+            self.bus = self.pipeline.get_bus()
+            self.bus.add_signal_watch()
+            self.levels.attach(self.bus)
+            if sync_handler:
+                self.bus.enable_sync_message_emission()
+                self.bus.connect('sync-message::element', sync_handler)
+            self.pipeline.set_state(Gst.State.PLAYING)
+            return self.pipeline
+
+    def monitor_name(self):
+        return f"external{self.chno+1}"
+
+    def set_previews_active(self, active):
+        with self.mtx:
+            self.previews_active = active
+            set_monitors_active(self.pipeline, active)
+
+    def audio_level(self):
+        return self.levels.get("audiolevel")
+
+    def stop(self):
+        with self.mtx:
+            Instrumentation.instance().unregister(self.monitor_name())
+            if self.pipeline:
+                self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline = None
+            self.bus = None
+            self.fanout = None
+            self.keyframes = None
+
+    def feedback_videoport(self):
+        return external_feedback_video_port(self.chno)
+
+    def request_keyframe(self, reason=None):
+        """ Новый гость на раздаче или его запрос request_keyframe. """
+        keyframes = self.keyframes
+        if keyframes:
+            keyframes.request(reason)
+
+    def fanout_snapshot(self):
+        with self.mtx:
+            return self.fanout.snapshot() if self.fanout else None
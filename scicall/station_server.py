@@ -0,0 +1,356 @@
+""" Станция без графического интерфейса.
+
+Запускает единый управляющий сервер, конвееры приёма гостей и конвеер
+внешнего источника без ветвей предпросмотра. Управляющие соединения
+обслуживаются циклом asyncio, сообщения шин gstreamer - циклом GLib
+в отдельном потоке.
+
+С --workers конвеер каждого гостя работает в своём процессе под
+надзором ChannelSupervisor (см. supervisor).
+"""
+
+import asyncio
+import signal
+import threading
+
+from gi.repository import GLib, Gst
+
+import scicall.pipeline_utils as pipeline_utils
+import scicall.util as util
+from scicall.pipeline_utils import GPUType
+from scicall.ports import *
+from scicall.station_pipeline import StationChannelPipeline, ExternalSourcePipeline
+from scicall.mix_minus import MixMinusPipeline
+from scicall.control_codec import CODECS
+from scicall.control_plane import ControlServer, ChannelRouter
+from scicall.handshake import StationHandshake
+import scicall.control_codec as control_codec
+from scicall.instrumentation import add_metrics_arguments
+from scicall.srt_stats import AdaptiveLatency, SRT_POLL_INTERVAL
+from scicall.liveness import DEFAULT_TIMEOUT
+from scicall.recorder import MUXERS, DEFAULT_FORMAT, DEFAULT_SEGMENT
+from scicall.instrumentation import Instrumentation
+from scicall.supervisor import ChannelSupervisor
+from scicall.supervisor import available as workers_available
+from scicall.shm_preview import available as shm_preview_available
+
+GPU_TYPES = {
+    "auto": GPUType.AUTOMATIC,
+    "cpu": GPUType.CPU,
+    "nvidia": GPUType.NVIDIA,
+}
+
+EXTERNAL_SOURCE_TYPES = {
+    "none": "Нет",
+    "test1": "Тестовый1",
+    "test2": "Тестовый2",
+    "ndi": "NDI",
+}
+
+
+class HeadlessChannel:
+    """ Канал станции: сессия и конвеер приёма одного гостя. """
+
+    def __init__(self, channelno, station):
+        self.channelno = channelno
+        self.station = station
+        self.stream = station.channel_stream(channelno)
+        self.stream.on_lost = self.on_stream_lost
+        self.stream.on_keyframe_needed = self.request_guest_keyframe
+        if station.record_dir:
+            self.stream.set_recording(station.record_dir, station.record_segment, station.record_format)
+        self.loop = None
+        self.session = None
+        self.srtlatency = station.srtlatency
+        self.adaptive = None
+        self.handshake = StationHandshake(
+            send=self.send_to_opposite,
+            schedule=self.schedule,
+            prepare_feedback=lambda: {"videoport": self.station.feedback_videoport()},
+            on_failed=self.on_handshake_failed)
+
+    def schedule(self, ms, fn):
+        asyncio.get_event_loop().call_later(ms / 1000, fn)
+
+    def is_connected(self):
+        return self.session is not None
+
+    def is_busy(self):
+        return self.is_connected()
+
+    def guest_volumes_array(self):
+        return [ 0 if i == self.channelno else 1 for i in range(self.station.guests_count()) ]
+
+    def external_volumes_array(self):
+        return [ self.station.external_volume ] * self.station.externals_count()
+
+    async def start(self):
+        self.start_common_stream()
+
+    async def stop(self):
+        if self.session:
+            self.session.on_close = None
+            self.session.close()
+        self.stream.stop()
+
+    def start_common_stream(self):
+        self.stream.start(
+            gputype=self.station.gpu_type(),
+            srtlatency=self.srtlatency)
+        if self.station.ndi_output:
+            self.stream.attach_consumer("ndi")
+        if self.station.shm_preview:
+            self.stream.attach_consumer("shm_preview")
+        if self.station.audio_levels:
+            self.stream.attach_consumer("audio_preview")
+
+    def restart_common_stream(self):
+        self.stream.stop()
+        self.start_common_stream()
+
+    def request_guest_keyframe(self, reason):
+        """ Может вызываться из потоков gstreamer. """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.send_to_opposite,
+                {"cmd": "request_keyframe", "reason": reason})
+
+    def on_stream_lost(self, reason):
+        """ Обрыв srt при живом управляющем соединении: гость переподключится
+            сам, перезапускается только приём. """
+        print("STATION: channel", self.channelno, "stream lost:", reason)
+        if self.session is not None:
+            self.stream.restart_sources(reason)
+
+    def send_to_opposite(self, dct):
+        if self.session is None:
+            return
+        self.session.send(dct)
+
+    def attach(self, session):
+        print("STATION: guest connected", self.channelno, session.peer)
+        self.session = session
+        self.loop = asyncio.get_event_loop()
+        session.on("ack", self.handshake.on_ack)
+        session.on("request_keyframe", lambda data: self.station.request_feedback_keyframe())
+        session.on_close = self.client_disconnected
+        if self.station.adaptive_latency:
+            self.adaptive = AdaptiveLatency(self.srtlatency,
+                minimum=self.station.srtlatency_min, maximum=self.station.srtlatency_max)
+        self.handshake.start(self.srtlatency)
+
+    def on_handshake_failed(self, state, reason):
+        """ Гость не прошёл рукопожатие: соединение закрывается, и
+            client_disconnected перезапускает приём канала для следующего гостя. """
+        print("STATION: channel", self.channelno, "closing guest after failed handshake")
+        if self.session is not None:
+            self.session.close()
+
+    def poll_srt(self):
+        """ Опрос статистики приёма, при необходимости - смена задержки. """
+        if self.adaptive is None or not self.handshake.is_ready():
+            return
+        new = self.adaptive.update(self.stream.srt_stats().get("video"))
+        if new is not None and new != self.srtlatency:
+            self.renegotiate_latency(new)
+
+    def renegotiate_latency(self, srtlatency):
+        """ Задержка srt согласуется при соединении, поэтому приёмник
+            перезапускается и гость проходит рукопожатие заново. """
+        print("STATION: channel", self.channelno, "srtlatency",
+            self.srtlatency, "-->", srtlatency)
+        self.srtlatency = srtlatency
+        self.handshake.reset()
+        self.restart_common_stream()
+        self.handshake.start(srtlatency)
+
+    def client_disconnected(self, session):
+        print("STATION : guest_disconnected", self.channelno)
+        self.session = None
+        self.station.router.forget(session)
+        self.handshake.reset()
+        self.adaptive = None
+        self.srtlatency = self.station.srtlatency
+        self.restart_common_stream()
+
+
+class StationServer:
+    """ Станция без графического интерфейса. """
+
+    def __init__(self, args):
+        self.srtlatency = args.srtlatency
+        self.adaptive_latency = args.adaptive_latency
+        self.srtlatency_min = args.srtlatency_min
+        self.srtlatency_max = args.srtlatency_max
+        self.liveness_timeout = args.liveness_timeout
+        self.record_dir = args.record
+        self.record_segment = args.record_segment
+        self.record_format = args.record_format
+        self.ndi_output = args.ndi
+        self.shm_preview = args.shm_preview and shm_preview_available()
+        if args.shm_preview and not self.shm_preview:
+            print("STATION: shared memory preview is not available on this platform")
+        self.audio_levels = args.audio_levels
+        self.gputype = GPU_TYPES[args.gpu]
+        self.external_volume = 1 if args.external_volume else 0
+        validate_port_map(args.channels, args.externals)
+        self.control_port = args.control_port
+        self.control_server = ControlServer(self.on_session)
+        workers = args.workers and workers_available()
+        if args.workers and not workers:
+            print("STATION: channel worker processes are not available on this platform,",
+                "channels run in the station process")
+        self.supervisor = ChannelSupervisor(self.liveness_timeout,
+            metrics=Instrumentation.instance().enabled) if workers else None
+        self.router = ChannelRouter()
+        self.channels = [ HeadlessChannel(i, self) for i in range(args.channels) ]
+        for ch in self.channels:
+            self.router.register(ch.channelno, ch)
+        self.externals = [ ExternalSourcePipeline(i, previews=False) for i in range(args.externals) ]
+        for ext in self.externals:
+            ext.source_type = EXTERNAL_SOURCE_TYPES[args.external]
+            ext.ndi_name = args.external_ndi_name
+        self.mixer = MixMinusPipeline(self.guests_count(), self.externals_count(), self.srtlatency)
+        for ch in self.channels:
+            self.mixer.set_volumes(ch.channelno, ch.guest_volumes_array(), ch.external_volumes_array())
+
+    def channel_stream(self, channelno):
+        if self.supervisor:
+            return self.supervisor.proxy(channelno)
+        return StationChannelPipeline(channelno, self.liveness_timeout)
+
+    def guests_count(self):
+        return len(self.channels)
+
+    def externals_count(self):
+        return len(self.externals)
+
+    def gpu_type(self):
+        return pipeline_utils.gpu_type_from_text(self.gputype)
+
+    def on_session(self, session):
+        session.on("hello_from_guest", lambda data: self.on_hello(session, data))
+        session.start_keepalive()
+
+    def on_hello(self, session, data):
+        channel, refusal = self.router.route(session, data)
+        if channel is None:
+            print("STATION: refuse guest", session.peer, refusal["cmd"])
+            session.send(refusal)
+            asyncio.ensure_future(session.drain_and_close())
+            return
+        channel.attach(session)
+
+    def request_feedback_keyframe(self):
+        if self.externals:
+            self.externals[0].request_keyframe("guest request")
+
+    def feedback_videoport(self):
+        """ Видео обратного канала гостям отдаёт только первый источник. """
+        if self.externals:
+            return self.externals[0].feedback_videoport()
+        return None
+
+    async def poll_srt(self):
+        while True:
+            await asyncio.sleep(SRT_POLL_INTERVAL)
+            for ch in self.channels:
+                try:
+                    ch.poll_srt()
+                except Exception as ex:
+                    print("STATION: srt stats of channel", ch.channelno, "failed:", ex)
+
+    async def run(self):
+        self.stop_event = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        self.mixer.start()
+        if self.supervisor:
+            await self.supervisor.start()
+        for ch in self.channels:
+            await ch.start()
+        for ext in self.externals:
+            ext.start()
+        await self.control_server.listen("0.0.0.0", self.control_port)
+        print("STATION: control port", self.control_port)
+        print("STATION: started", self.guests_count(), "channels,",
+            self.externals_count(), "external sources")
+
+        poller = asyncio.ensure_future(self.poll_srt()) if self.adaptive_latency else None
+        await self.stop_event.wait()
+        if poller:
+            poller.cancel()
+
+        for ch in self.channels:
+            await ch.stop()
+        if self.supervisor:
+            await self.supervisor.stop()
+        await self.control_server.close()
+        for ext in self.externals:
+            ext.stop()
+        self.mixer.stop()
+
+
+def run_glib_mainloop():
+    """ Цикл GLib нужен для доставки сообщений шин конвееров. """
+    mainloop = GLib.MainLoop()
+    thread = threading.Thread(target=mainloop.run, daemon=True)
+    thread.start()
+    return mainloop
+
+
+def add_server_arguments(parser):
+    parser.add_argument("--server", action="store_true",
+        help="запустить станцию без графического интерфейса")
+    parser.add_argument("--channels", type=int, default=3,
+        help="количество каналов гостей")
+    parser.add_argument("--externals", type=int, default=1,
+        help="количество внешних источников")
+    parser.add_argument("--srtlatency", type=int, default=80)
+    parser.add_argument("--adaptive-latency", action="store_true",
+        help="подбирать задержку srt каждого канала по rtt и потерям")
+    parser.add_argument("--srtlatency-min", type=int, default=40)
+    parser.add_argument("--srtlatency-max", type=int, default=1000)
+    parser.add_argument("--liveness-timeout", type=int, default=DEFAULT_TIMEOUT,
+        help="перерыв потока гостя в мс, после которого поток считается потерянным")
+    parser.add_argument("--control-port", type=int, default=STATION_CONTROL_PORT,
+        help="единый управляющий порт станции (в интерфейсе - и порт по умолчанию для гостя)")
+    parser.add_argument("--control-codec", choices=CODECS, default=control_codec.DEFAULT_CODEC,
+        help="кадрирование управляющего канала, одинаковое у станции и гостей")
+    parser.add_argument("--record", metavar="DIR", default=None,
+        help="записывать потоки гостей в каталог без перекодирования")
+    parser.add_argument("--record-segment", type=int, default=DEFAULT_SEGMENT,
+        help="длительность файла записи в секундах")
+    parser.add_argument("--record-format", choices=list(MUXERS), default=DEFAULT_FORMAT)
+    parser.add_argument("--shm-preview", action="store_true",
+        help="отдавать предпросмотр видео гостей через разделяемую память")
+    parser.add_argument("--audio-levels", action="store_true",
+        help="измерять уровень звука гостей (индикаторы и метрики)")
+    parser.add_argument("--workers", action="store_true",
+        help="запускать конвеер каждого гостя в отдельном процессе (кроме Windows)")
+    parser.add_argument("--gpu", choices=list(GPU_TYPES), default="auto")
+    parser.add_argument("--reprobe-codecs", action="store_true",
+        help="заново проверить кодеры и декодеры, не используя кэш")
+    parser.add_argument("--no-ndi", dest="ndi", action="store_false",
+        help="не конвертировать потоки гостей в ndi")
+    parser.add_argument("--external", choices=list(EXTERNAL_SOURCE_TYPES), default="test1")
+    parser.add_argument("--external-ndi-name", default="")
+    parser.add_argument("--external-volume", action="store_true",
+        help="подмешивать гостям звук внешних источников")
+    add_metrics_arguments(parser)
+
+
+def run_server(args):
+    if args.external == "ndi":
+        util.start_ndi_device_provider()
+    mainloop = run_glib_mainloop()
+    station = StationServer(args)
+    try:
+        asyncio.run(station.run())
+    finally:
+        mainloop.quit()
+    return 0
@@ -0,0 +1,272 @@
+""" Каналы станции в отдельных процессах.
+
+ChannelSupervisor слушает локальный сокет и на каждый канал запускает
+процесс scicall.channel_worker. WorkerChannelProxy повторяет ту часть
+интерфейса StationChannelPipeline, которой пользуется канал станции, и
+переводит вызовы в команды процессу. Прокси помнит желаемое состояние
+канала (запущен ли конвеер, потребители, запись) и повторяет его, когда
+процесс подключается заново.
+
+Упавший процесс перезапускается через WORKER_RESTART_DELAY. Зависший -
+замолчавший управляющий канал или цикл GLib, не отвечающий дольше
+WORKER_STALL_TIMEOUT - убивается и тоже перезапускается. Остальные
+каналы при этом не затрагиваются.
+
+Вызовы прокси и его колбэки (on_alive, on_lost, on_keyframe_needed)
+выполняются в цикле asyncio супервизора. Сам процесс станции получает
+от каналов только сводное состояние.
+
+Процессы связаны с супервизором unix сокетом, которого у asyncio нет
+на Windows: там каналы работают в процессе станции (available()).
+"""
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from scicall.channel_worker import WORKER_CODEC
+from scicall.codec_registry import CodecRegistry
+from scicall.control_plane import ControlServer
+from scicall.instrumentation import Instrumentation
+from scicall.liveness import DEFAULT_TIMEOUT
+
+WORKER_RESTART_DELAY = 1
+WORKER_STALL_TIMEOUT = 5
+
+
+def available():
+    """ Каналы в отдельных процессах возможны на этой машине. """
+    return sys.platform != "win32"
+
+
+class WorkerChannelProxy:
+    def __init__(self, supervisor, channelno):
+        self.supervisor = supervisor
+        self.channelno = channelno
+        self.on_alive = None
+        self.on_lost = None
+        self.on_keyframe_needed = None
+        self.session = None
+        self.process = None
+        self.stopping = False
+        self.restarts = 0
+        self.running = None
+        self.consumers = set()
+        self.record_settings = None
+        self.state = {}
+        self.cpu_load = None
+        self.last_cpu = None
+
+    def monitor_name(self):
+        return f"station.ch{self.channelno+1}"
+
+    def send(self, dct):
+        if self.session is not None:
+            self.session.send(dct)
+
+    def start(self, gputype, srtlatency, sync_handler=None):
+        """ @sync_handler не поддерживается: окна предпросмотра живут в
+            процессе интерфейса. """
+        self.running = {"cmd": "start", "gputype": gputype.name, "srtlatency": srtlatency}
+        self.consumers = set()
+        self.send(self.running)
+
+    def stop(self):
+        self.running = None
+        self.consumers = set()
+        self.send({"cmd": "stop"})
+
+    def is_running(self):
+        return self.running is not None
+
+    def restart_sources(self, reason=None):
+        if self.session is None:
+            return False
+        self.send({"cmd": "restart_sources", "reason": reason})
+        return True
+
+    def set_consumer(self, kind, enabled):
+        if enabled:
+            self.consumers.add(kind)
+        else:
+            self.consumers.discard(kind)
+        self.send({"cmd": "set_consumer", "kind": kind, "enabled": enabled})
+
+    def attach_consumer(self, kind):
+        self.set_consumer(kind, True)
+
+    def detach_consumer(self, kind):
+        self.set_consumer(kind, False)
+
+    def set_recording(self, directory=None, segment=None, fmt=None):
+        self.record_settings = None if directory is None else {
+            "directory": directory, "segment": segment, "fmt": fmt }
+        self.send(dict(self.record_settings or {}, cmd="set_recording"))
+
+    def is_recording(self):
+        return self.state.get("recording", False)
+
+    def liveness_state(self):
+        return self.state.get("liveness")
+
+    def srt_stats(self):
+        return self.state.get("srt") or {}
+
+    def audio_level(self):
+        return self.state.get("level")
+
+    def attach(self, session):
+        if self.session is not None:
+            self.session.on_close = None
+            self.session.close()
+        self.session = session
+        session.on("alive", lambda data: self.on_alive and self.on_alive())
+        session.on("lost", lambda data: self.on_lost and self.on_lost(data.get("reason")))
+        session.on("keyframe_needed",
+            lambda data: self.on_keyframe_needed and self.on_keyframe_needed(data.get("reason")))
+        session.on("state", self.on_state)
+        session.on_close = self.worker_disconnected
+        session.start_keepalive(timeout=WORKER_STALL_TIMEOUT)
+        self.replay()
+
+    def replay(self):
+        """ Повторяет желаемое состояние канала в новом процессе. """
+        if self.record_settings:
+            self.send(dict(self.record_settings, cmd="set_recording"))
+        if self.running:
+            self.send(self.running)
+            for kind in self.consumers:
+                self.send({"cmd": "set_consumer", "kind": kind, "enabled": True})
+
+    def on_state(self, data):
+        now = time.monotonic()
+        if self.last_cpu is not None and now > self.last_cpu[0]:
+            self.cpu_load = (data["cpu"] - self.last_cpu[1]) / (now - self.last_cpu[0])
+        self.last_cpu = (now, data["cpu"])
+        self.state = data
+        if data.get("metrics"):
+            for name, snapshot in data["metrics"].items():
+                Instrumentation.instance().publish(name, snapshot)
+        if data.get("glib_lag", 0) > WORKER_STALL_TIMEOUT:
+            print("SUPERVISOR: channel", self.channelno, "glib loop stalled, kill worker")
+            self.kill()
+
+    def worker_disconnected(self, session):
+        self.session = None
+        self.state = {}
+        self.last_cpu = None
+        self.cpu_load = None
+        Instrumentation.instance().withdraw(self.monitor_name())
+        if not self.stopping:
+            self.kill()
+
+    def kill(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+
+    async def run(self):
+        """ Держит процесс канала запущенным до shutdown(). """
+        while not self.stopping:
+            self.process = await asyncio.create_subprocess_exec(
+                *self.supervisor.worker_command(self.channelno))
+            print("SUPERVISOR: channel", self.channelno, "worker pid", self.process.pid)
+            code = await self.process.wait()
+            if self.stopping:
+                break
+            self.restarts += 1
+            print("SUPERVISOR: channel", self.channelno, "worker exited with", code)
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    async def shutdown(self):
+        """ Закрытие управляющего соединения останавливает процесс канала. """
+        self.stopping = True
+        if self.session is not None:
+            self.session.on_close = None
+            self.session.close()
+            self.session = None
+        if self.process is not None and self.process.returncode is None:
+            try:
+                await asyncio.wait_for(self.process.wait(), WORKER_STALL_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.process.kill()
+        Instrumentation.instance().withdraw(self.monitor_name())
+
+    def snapshot(self):
+        return {
+            "pid": self.process.pid if self.process else None,
+            "connected": self.session is not None,
+            "restarts": self.restarts,
+            "liveness": self.liveness_state(),
+            "recording": self.is_recording(),
+            "cpu_load": None if self.cpu_load is None else round(self.cpu_load, 3),
+        }
+
+
+class ChannelSupervisor:
+    """ Запуск и надзор за процессами каналов.
+
+        proxy(channelno) создаёт прокси канала до запуска, start() поднимает
+        локальный сокет и процессы.
+    """
+
+    def __init__(self, liveness_timeout=DEFAULT_TIMEOUT, metrics=False):
+        self.liveness_timeout = liveness_timeout
+        self.metrics = metrics
+        self.proxies = {}
+        self.server = ControlServer(self.on_session, codec=WORKER_CODEC)
+        self.directory = None
+        self.tasks = []
+
+    def proxy(self, channelno):
+        proxy = WorkerChannelProxy(self, channelno)
+        self.proxies[channelno] = proxy
+        return proxy
+
+    def socket_path(self):
+        return os.path.join(self.directory, "supervisor.sock")
+
+    def worker_command(self, channelno):
+        command = [ sys.executable, "-m", "scicall.channel_worker",
+            "--channel", str(channelno),
+            "--supervisor", self.socket_path(),
+            "--liveness-timeout", str(self.liveness_timeout),
+            "--codec-cache", CodecRegistry.instance().path ]
+        if self.metrics:
+            command.append("--metrics")
+        return command
+
+    async def start(self):
+        if not available():
+            raise Exception("channel worker processes need unix sockets, not available on Windows")
+        self.directory = tempfile.mkdtemp(prefix="scicall-")
+        await self.server.listen_unix(self.socket_path())
+        self.tasks = [ asyncio.ensure_future(proxy.run()) for proxy in self.proxies.values() ]
+        print("SUPERVISOR: started", len(self.proxies), "channel workers")
+
+    def on_session(self, session):
+        session.on("worker_hello", lambda data: self.on_hello(session, data))
+
+    def on_hello(self, session, data):
+        proxy = self.proxies.get(data.get("ch"))
+        if proxy is None:
+            print("SUPERVISOR: unknown channel worker", data)
+            session.close()
+            return
+        print("SUPERVISOR: channel", proxy.channelno, "worker connected, pid", data.get("pid"))
+        proxy.attach(session)
+
+    async def stop(self):
+        for proxy in self.proxies.values():
+            await proxy.shutdown()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self.server.close()
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def snapshot(self):
+        return { ch: proxy.snapshot() for ch, proxy in self.proxies.items() }
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+""" Проверка управляющего канала по петле без конвееров и без Qt.
+
+Поднимает станционный сервер с единым управляющим портом, по каналу
+на гостя, и подключает к нему FakeGuest-ов одновременно. Каналы
+отвечают рукопожатием StationHandshake. Печатает время до готовности
+гостей.
+
+    python3 -m scicall.testcontrol --guests 300
+"""
+
+import argparse
+import asyncio
+import time
+
+from scicall.control_plane import ControlServer, ChannelRouter, FakeGuest
+from scicall.handshake import StationHandshake
+
+
+class LoopbackChannel:
+    def __init__(self, stats):
+        self.session = None
+        self.stats = stats
+
+    def is_busy(self):
+        return self.session is not None
+
+    def attach(self, session):
+        loop = asyncio.get_event_loop()
+        self.session = session
+        self.handshake = StationHandshake(
+            send=session.send,
+            schedule=lambda ms, fn: loop.call_later(ms / 1000, fn),
+            on_ready=lambda: self.stats.append("ready"),
+            on_failed=lambda state, reason: self.stats.append("failed"))
+        session.on("ack", self.handshake.on_ack)
+        self.handshake.start(80)
+
+
+def station_session(session, router):
+    def on_hello(data):
+        channel, refusal = router.route(session, data)
+        if channel is None:
+            session.send(refusal)
+            asyncio.ensure_future(session.drain_and_close())
+            return
+        channel.attach(session)
+
+    session.on("hello_from_guest", on_hello)
+    session.start_keepalive()
+
+
+async def main(guests, codec):
+    stats = []
+    router = ChannelRouter()
+    for i in range(guests):
+        router.register(i, LoopbackChannel(stats))
+    server = ControlServer(lambda session: station_session(session, router), codec=codec)
+    await server.listen("127.0.0.1", 0)
+    port = server.port()
+
+    async def one(i):
+        guest = FakeGuest(i, codec=codec)
+        start = time.time()
+        await guest.connect("127.0.0.1", port)
+        await asyncio.wait_for(guest.ready.wait(), 10)
+        return guest, time.time() - start
+
+    start = time.time()
+    results = await asyncio.gather(*[ one(i) for i in range(guests) ])
+    total = time.time() - start
+
+    times = sorted(t for guest, t in results)
+    print("sessions:", len(server.sessions), "ready:", stats.count("ready"),
+        "failed:", stats.count("failed"))
+    print("total: %.1f ms, median: %.1f ms, max: %.1f ms" % (
+        total * 1000, times[len(times) // 2] * 1000, times[-1] * 1000))
+
+    for guest, t in results:
+        guest.close()
+    await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guests", type=int, default=100)
+    parser.add_argument("--codec", default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args.guests, args.codec))
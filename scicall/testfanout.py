@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+""" Проверка учёта абонентов SrtFanout без srt соединений.
+
+Имитирует сигналы caller-added двух гостей и caller-removed одного из
+них так, как их посылает srtsink (sock всегда 0), и проверяет, что
+второй гость остался в списке.
+
+    python3 -m scicall.testfanout
+"""
+
+import sys
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gio
+
+from scicall.fanout import SrtFanout
+
+
+def guest_address(host, port):
+    return Gio.InetSocketAddress.new_from_string(host, port)
+
+
+def main():
+    fanout = SrtFanout(port=0, srtlatency=80)
+    first = guest_address("10.0.0.1", 5000)
+    second = guest_address("10.0.0.2", 5000)
+
+    fanout.caller_added(None, 0, first)
+    fanout.caller_added(None, 0, second)
+    assert fanout.callers_count() == 2, fanout.snapshot()
+
+    fanout.caller_removed(None, 0, first)
+    assert fanout.callers_count() == 1, fanout.snapshot()
+    assert fanout.snapshot()["callers"] == [ "10.0.0.2:5000" ], fanout.snapshot()
+
+    fanout.caller_removed(None, 0, second)
+    assert fanout.callers_count() == 0, fanout.snapshot()
+    print("ok")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
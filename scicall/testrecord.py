@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+""" Замер записи нескольких каналов одновременно.
+
+Каждый канал - синтетический закодированный поток (videotestsrc -->
+x264enc --> h264parse и audiotestsrc --> opusenc) на тройниках, как
+у приёма станции. К тройникам подключается ChannelRecorder с короткими
+сегментами. Замеряются интервалы смены сегментов, размер сегментов и
+общая скорость записи на диск.
+
+    python3 -m scicall.testrecord --channels 4 --segment 5 --duration 30
+    python3 -m scicall.testrecord --channels 4 --format mp4 --dir /tmp/rec
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from scicall.pipeline_builder import GraphBuilder
+from scicall.pipeline_utils import DynamicTee
+from scicall.recorder import ChannelRecorder, MUXERS, DEFAULT_FORMAT
+
+
+def make_channel(b, n, bitrate):
+    vtee = b.add(f"tee name=vtee{n}")
+    b.chain("videotestsrc is-live=true pattern=ball",
+        "video/x-raw,width=640,height=480,framerate=30/1",
+        f"x264enc tune=zerolatency speed-preset=ultrafast key-int-max=30 bitrate={bitrate}",
+        "h264parse config-interval=-1", vtee)
+    atee = b.add(f"tee name=atee{n}")
+    b.chain("audiotestsrc is-live=true", "audio/x-raw,rate=48000,channels=1",
+        "opusenc", atee)
+    return { "video": DynamicTee(vtee), "audio": DynamicTee(atee) }
+
+
+class RotationMeter:
+    """ Время закрытия сегментов по сообщениям splitmuxsink. """
+
+    def __init__(self, bus):
+        self.closed = {}
+        bus.connect("message::element", self.on_element_message)
+
+    def on_element_message(self, bus, msg):
+        structure = msg.get_structure()
+        if structure is None or structure.get_name() != "splitmuxsink-fragment-closed":
+            return
+        self.closed.setdefault(msg.src.get_parent().get_name(), []).append(
+            (time.monotonic(), structure.get_string("location")))
+
+
+def main(args):
+    Gst.init(sys.argv)
+    mainloop = GLib.MainLoop()
+    threading.Thread(target=mainloop.run, daemon=True).start()
+
+    b = GraphBuilder()
+    channels = [ make_channel(b, n, args.bitrate) for n in range(args.channels) ]
+    pipeline = b.build()
+    bus = pipeline.get_bus()
+    bus.add_signal_watch()
+    rotation = RotationMeter(bus)
+    pipeline.set_state(Gst.State.PLAYING)
+
+    recorders = [ ChannelRecorder(pipeline, tees, args.dir, f"bench{n}",
+        segment=args.segment, fmt=args.format) for n, tees in enumerate(channels) ]
+    started = time.monotonic()
+    for recorder in recorders:
+        recorder.start()
+
+    time.sleep(args.duration)
+
+    stopped = threading.Semaphore(0)
+    for recorder in recorders:
+        recorder.stop(stopped.release)
+    for _ in recorders:
+        if not stopped.acquire(timeout=10):
+            print("recorder did not finish")
+    elapsed = time.monotonic() - started
+    pipeline.set_state(Gst.State.NULL)
+    mainloop.quit()
+
+    total = 0
+    intervals = []
+    for recorder in recorders:
+        sizes = [ os.path.getsize(f) for f in recorder.fragments if os.path.exists(f) ]
+        total += sum(sizes)
+        closed = [ t for t, _ in rotation.closed.get(f"recorder-{recorder.name}", []) ]
+        intervals += [ b - a for a, b in zip(closed, closed[1:]) ]
+        print("%s: %d segments, %.1f MB" % (recorder.name, len(sizes), sum(sizes) / 1e6))
+
+    if intervals:
+        intervals.sort()
+        print("rotation interval: min %.2f s, median %.2f s, max %.2f s (segment %d s)" % (
+            intervals[0], intervals[len(intervals) // 2], intervals[-1], args.segment))
+    print("%d channels, %.1f s, %.1f MB, %.2f MB/s" % (
+        args.channels, elapsed, total / 1e6, total / 1e6 / elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--segment", type=int, default=5,
+        help="длительность сегмента в секундах")
+    parser.add_argument("--duration", type=int, default=30,
+        help="длительность записи в секундах")
+    parser.add_argument("--bitrate", type=int, default=2000,
+        help="битрейт видео каждого канала в кбит/с")
+    parser.add_argument("--format", choices=list(MUXERS), default=DEFAULT_FORMAT)
+    parser.add_argument("--dir", default="recordings-bench")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+""" Замер восстановления приёма после обрыва srt по петле.
+
+Отправитель (videotestsrc --> x264enc --> srtsink) обрывается и
+подключается заново. Приёмник замечает обрыв LivenessMonitor-ом и
+восстанавливается одним из способов:
+
+    targeted - перезапуск только srtsrc и разборщика (source_recovery)
+    full     - прежний цикл всего конвеера PAUSED/READY/PAUSED/PLAYING
+
+В том же конвеере приёмника работает независимая ветвь (живой
+audiotestsrc), по наибольшему перерыву буферов в ней оценивается
+побочный сбой, который перезапуск вносит в остальные ветви.
+
+    python3 -m scicall.testrecovery --mode targeted --rounds 5
+    python3 -m scicall.testrecovery --mode full --rounds 5
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from scicall.pipeline_builder import GraphBuilder
+from scicall.queue_policy import QueueKind
+from scicall.liveness import LivenessMonitor
+from scicall.source_recovery import SourceRecovery, chain_between
+
+
+class GapMeter:
+    """ Время прихода буферов на пад и наибольший перерыв между ними. """
+
+    def __init__(self, pad):
+        self.times = []
+        pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+
+    def on_buffer(self, pad, info):
+        self.times.append(time.monotonic())
+        return Gst.PadProbeReturn.OK
+
+    def first_after(self, t):
+        return next((x for x in self.times if x > t), None)
+
+    def max_gap(self, start, stop):
+        times = [ x for x in self.times if start <= x <= stop ]
+        return max((b - a for a, b in zip(times, times[1:])), default=None)
+
+
+def make_sender(port):
+    return Gst.parse_launch(
+        "videotestsrc is-live=true ! video/x-raw,width=320,height=240,framerate=30/1 ! "
+        "x264enc tune=zerolatency key-int-max=30 ! video/x-h264,profile=baseline ! "
+        f"srtsink uri=srt://127.0.0.1:{port} latency=40 wait-for-connection=false")
+
+
+def make_receiver(port):
+    b = GraphBuilder()
+    tee = b.add("tee name=h264tee")
+    srtsrc, _ = b.chain(f"srtsrc uri=srt://:{port} wait-for-connection=true latency=40",
+        b.queue(QueueKind.NETWORK, "q0"), "h264parse name=parse", tee)
+    b.chain(tee, b.queue(QueueKind.ENCODED, "qd"), "avdec_h264", "fakesink name=decoded sync=false")
+    b.chain("audiotestsrc is-live=true", "audio/x-raw,rate=24000,channels=1",
+        b.queue(QueueKind.AUDIO, "qa"), "fakesink name=other sync=true")
+    return b.build(), srtsrc, b.get("parse")
+
+
+def full_cycle(pipeline):
+    pipeline.set_state(Gst.State.PAUSED)
+    pipeline.set_state(Gst.State.READY)
+    pipeline.set_state(Gst.State.PAUSED)
+    pipeline.set_state(Gst.State.PLAYING)
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def main(args):
+    Gst.init(sys.argv)
+    mainloop = GLib.MainLoop()
+    threading.Thread(target=mainloop.run, daemon=True).start()
+
+    receiver, srtsrc, parser = make_receiver(args.port)
+    decoded = GapMeter(receiver.get_by_name("decoded").get_static_pad("sink"))
+    other = GapMeter(receiver.get_by_name("other").get_static_pad("sink"))
+    recovery = SourceRecovery("receiver", [ chain_between(srtsrc, parser) ], min_interval=0)
+    restarts = []
+
+    def on_lost(reason):
+        restarts.append(time.monotonic())
+        if args.mode == "targeted":
+            recovery.restart(reason)
+        else:
+            full_cycle(receiver)
+
+    bus = receiver.get_bus()
+    bus.add_signal_watch()
+    liveness = LivenessMonitor("receiver", args.timeout, on_lost=on_lost)
+    liveness.watch_pad(parser.get_static_pad("src"))
+    liveness.watch_srt(srtsrc)
+    liveness.watch_bus(bus, [ srtsrc ])
+    receiver.set_state(Gst.State.PLAYING)
+    liveness.start()
+
+    sender = make_sender(args.port)
+    sender.set_state(Gst.State.PLAYING)
+    if not wait_for(lambda: decoded.times, 10):
+        print("no stream from the sender")
+        return 1
+
+    results = []
+    for i in range(args.rounds):
+        time.sleep(1)
+        sender.set_state(Gst.State.NULL)
+        dropped = time.monotonic()
+        time.sleep(args.outage / 1000)
+        sender.set_state(Gst.State.PLAYING)
+        resumed = time.monotonic()
+
+        if not wait_for(lambda: decoded.first_after(resumed), 10):
+            print("round", i, ": stream did not recover")
+            continue
+        first = decoded.first_after(resumed)
+        time.sleep(0.5)
+        gap = other.max_gap(dropped, time.monotonic())
+        results.append((first - resumed, gap))
+        print("round %d: recovery %.1f ms, other branch max gap %.1f ms" % (
+            i, (first - resumed) * 1000, (gap or 0) * 1000))
+
+    liveness.stop()
+    sender.set_state(Gst.State.NULL)
+    receiver.set_state(Gst.State.NULL)
+    mainloop.quit()
+
+    if results:
+        recoveries = sorted(r for r, g in results)
+        gaps = sorted(g or 0 for r, g in results)
+        print("%s: restarts %d, median recovery %.1f ms, worst other branch gap %.1f ms" % (
+            args.mode, len(restarts), recoveries[len(recoveries) // 2] * 1000, gaps[-1] * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["targeted", "full"], default="targeted")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--port", type=int, default=21900)
+    parser.add_argument("--timeout", type=int, default=300,
+        help="таймаут LivenessMonitor в мс")
+    parser.add_argument("--outage", type=int, default=500,
+        help="длительность обрыва отправителя в мс")
+    sys.exit(main(parser.parse_args()))
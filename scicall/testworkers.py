@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+""" Замер числа каналов станции против ядер процессора.
+
+На каждый канал запускается отправитель (gst-launch-1.0: videotestsrc -->
+x264enc --> srtsink и audiotestsrc --> opusenc --> srtsink) и канал
+станции, который принимает и декодирует поток (потребитель "null").
+Каналы работают либо в одном процессе (inprocess), либо каждый в своём
+процессе под ChannelSupervisor (workers). Для каждого числа каналов
+печатается загрузка процессора процессами станции в ядрах и число
+каналов, чей поток жив.
+
+Отправители нагружают ту же машину, их загрузка в замер не входит.
+
+    python3 -m scicall.testworkers --mode workers --channels 1,2,4,8
+    python3 -m scicall.testworkers --mode inprocess --channels 1,2,4,8
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from scicall.liveness import Liveness
+from scicall.pipeline_utils import GPUType
+from scicall.ports import channel_mpeg_stream_port, validate_port_map
+from scicall.station_pipeline import StationChannelPipeline
+from scicall.supervisor import ChannelSupervisor
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def sender_command(channelno, width, height):
+    port = channel_mpeg_stream_port(channelno)
+    return [ "gst-launch-1.0", "-q",
+        "videotestsrc", "is-live=true", "pattern=ball", "!",
+        f"video/x-raw,width={width},height={height},framerate=30/1", "!",
+        "x264enc", "tune=zerolatency", "speed-preset=ultrafast", "key-int-max=30", "!",
+        "video/x-h264,profile=baseline", "!",
+        "srtsink", f"uri=srt://127.0.0.1:{port}", "latency=80", "wait-for-connection=false",
+        "audiotestsrc", "is-live=true", "!", "audio/x-raw,rate=48000,channels=1", "!",
+        "opusenc", "!",
+        "srtsink", f"uri=srt://127.0.0.1:{port+1}", "latency=80", "wait-for-connection=false" ]
+
+
+def process_cpu(pid):
+    """ Процессорное время процесса в секундах. """
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+class InprocessChannels:
+    def __init__(self, count):
+        self.streams = [ StationChannelPipeline(i) for i in range(count) ]
+
+    async def start(self):
+        for stream in self.streams:
+            stream.start(gputype=GPUType.CPU, srtlatency=80)
+            stream.attach_consumer("null")
+
+    def pids(self):
+        return [ os.getpid() ]
+
+    def alive(self):
+        return sum(1 for s in self.streams if s.liveness_state() == Liveness.ALIVE)
+
+    async def stop(self):
+        for stream in self.streams:
+            stream.stop()
+
+
+class WorkerChannels:
+    def __init__(self, count):
+        self.supervisor = ChannelSupervisor()
+        self.proxies = [ self.supervisor.proxy(i) for i in range(count) ]
+
+    async def start(self):
+        await self.supervisor.start()
+        for proxy in self.proxies:
+            proxy.start(gputype=GPUType.CPU, srtlatency=80)
+            proxy.attach_consumer("null")
+
+    def pids(self):
+        return [ p.process.pid for p in self.proxies if p.process and p.process.returncode is None ]
+
+    def alive(self):
+        return sum(1 for p in self.proxies if p.liveness_state() == Liveness.ALIVE)
+
+    async def stop(self):
+        await self.supervisor.stop()
+
+
+async def measure(args, count):
+    channels = WorkerChannels(count) if args.mode == "workers" else InprocessChannels(count)
+    await channels.start()
+    senders = [ subprocess.Popen(sender_command(i, args.width, args.height)) for i in range(count) ]
+    try:
+        await asyncio.sleep(args.warmup)
+        pids = channels.pids()
+        before = sum(process_cpu(pid) for pid in pids)
+        await asyncio.sleep(args.duration)
+        cores = (sum(process_cpu(pid) for pid in pids) - before) / args.duration
+        alive = channels.alive()
+    finally:
+        for sender in senders:
+            sender.terminate()
+        for sender in senders:
+            sender.wait()
+        await channels.stop()
+    print("%s: %d channels, %.2f cores of %d, %.2f per channel, alive %d/%d" % (
+        args.mode, count, cores, os.cpu_count(), cores / count, alive, count))
+    return count, cores, alive
+
+
+async def main(args):
+    results = []
+    for count in args.channels:
+        results.append(await measure(args, count))
+        await asyncio.sleep(1)
+    print()
+    print("channels  cores  alive")
+    for count, cores, alive in results:
+        print("%8d  %5.2f  %5d" % (count, cores, alive))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["workers", "inprocess"], default="workers")
+    parser.add_argument("--channels", type=lambda s: [ int(x) for x in s.split(",") ],
+        default=[1, 2, 4])
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+    validate_port_map(max(args.channels), 0)
+    Gst.init(sys.argv[:1])
+    mainloop = GLib.MainLoop()
+    threading.Thread(target=mainloop.run, daemon=True).start()
+    asyncio.run(main(args))
+    mainloop.quit()